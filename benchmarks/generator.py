@@ -0,0 +1,135 @@
+# Builds synthetic templates for the benchmarks
+# Templates are generated from a seed so every run benchmarks the same files
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import yaml
+
+# Every generated repo is committed with this identity so git doesn't need
+# any config on the machine running the benchmarks
+GIT_ENV = {
+    "GIT_AUTHOR_NAME": "NASTI Benchmarks",
+    "GIT_AUTHOR_EMAIL": "benchmarks@example.com",
+    "GIT_COMMITTER_NAME": "NASTI Benchmarks",
+    "GIT_COMMITTER_EMAIL": "benchmarks@example.com",
+}
+
+WORDS = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit"]
+
+# TemplateSpec describes a synthetic template along each axis the
+# benchmarks vary
+# files is the number of files in the template
+# file_size is the size of each file in bytes
+# mutations is the number of mutations in the nastifile
+# fan_out is the number of files each mutation references
+# depth is how many directories deep the files are spread
+class TemplateSpec:
+    def __init__(self, files=200, file_size=4096, mutations=5, fan_out=20, depth=3):
+        self.files = files
+        self.file_size = file_size
+        self.mutations = mutations
+        self.fan_out = min(fan_out, files)
+        self.depth = depth
+
+    # Returns a copy with some axes changed
+    def with_axes(self, **axes):
+        spec = TemplateSpec(self.files, self.file_size, self.mutations, self.fan_out, self.depth)
+        for axis, value in axes.items():
+            setattr(spec, axis, value)
+        spec.fan_out = min(spec.fan_out, spec.files)
+        return spec
+
+    def to_dict(self):
+        return {
+            "files": self.files,
+            "file_size": self.file_size,
+            "mutations": self.mutations,
+            "fan_out": self.fan_out,
+            "depth": self.depth,
+        }
+
+    def get_token(self, mutation):
+        return f"nasti_bench_token_{mutation}"
+
+    def get_name(self, mutation):
+        return f"mutation_{mutation}"
+
+    # The answers that process every mutation in silent mode
+    def get_answers(self):
+        return {self.get_name(mutation): f"value_{mutation}" for mutation in range(self.mutations)}
+
+    # Returns the relative path of every file in the template
+    # Files are spread across a tree of directories depth deep with a few
+    # directories at every level
+    def get_files(self):
+        files = []
+        for i in range(self.files):
+            dirs = [f"dir_{(i // (4 ** level)) % 4}" for level in range(self.depth)]
+            files.append("/".join(dirs + [f"file_{i}.txt"]))
+        return files
+
+    # Returns a dictionary of file to the mutations that reference it
+    # Each mutation references fan_out files spread evenly through the template
+    def get_file_mutations(self):
+        files = self.get_files()
+        file_mutations = {}
+        for mutation in range(self.mutations):
+            for i in range(self.fan_out):
+                file = files[(mutation + i * len(files) // self.fan_out) % len(files)]
+                file_mutations.setdefault(file, []).append(mutation)
+        return file_mutations
+
+# Writes a template matching spec into path, which mustn't exist yet
+def generate_template(path, spec, seed=0):
+    rng = random.Random(seed)
+    file_mutations = spec.get_file_mutations()
+    mutation_files = {mutation: [] for mutation in range(spec.mutations)}
+    for file in spec.get_files():
+        tokens = [spec.get_token(mutation) for mutation in file_mutations.get(file, [])]
+        for mutation in file_mutations.get(file, []):
+            mutation_files[mutation].append(file)
+        os.makedirs(os.path.dirname(path + "/" + file), exist_ok=True)
+        with open(path + "/" + file, "w") as f:
+            f.write(make_text(rng, spec.file_size, tokens))
+    nastifile = {
+        "mutations": [
+            {
+                "name": spec.get_name(mutation),
+                "prompt": f"Value for mutation {mutation}",
+                "replace": spec.get_token(mutation),
+                "files": mutation_files[mutation],
+            }
+            for mutation in range(spec.mutations)
+        ],
+    }
+    with open(path + "/nasti.yaml", "w") as f:
+        yaml.safe_dump(nastifile, f, sort_keys=False)
+
+# Returns about size characters of words with each token in it three times
+def make_text(rng, size, tokens):
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    # Tokens go at the start, the middle and the end
+    for token in tokens:
+        for position in (0, len(words) // 2, len(words)):
+            words.insert(position, token)
+    return " ".join(words) + "\n"
+
+# Commits the template at template_dir into a new bare repo at repo_dir
+# Returns a file:// URL NASTI can clone it from without a network
+def make_bare_repo(template_dir, repo_dir):
+    env = dict(os.environ)
+    env.update(GIT_ENV)
+    with tempfile.TemporaryDirectory() as work_dir:
+        checkout_dir = work_dir + "/checkout"
+        shutil.copytree(template_dir, checkout_dir)
+        for command in (["git", "init", "-q"], ["git", "add", "-A"], ["git", "commit", "-q", "-m", "Template"]):
+            subprocess.run(command, cwd=checkout_dir, env=env, check=True)
+        subprocess.run(["git", "clone", "-q", "--bare", checkout_dir, repo_dir], env=env, check=True)
+    return "file://" + os.path.abspath(repo_dir)
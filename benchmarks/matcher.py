@@ -0,0 +1,63 @@
+# Compares the shared TokenMatcher against running one str.replace or
+# re.search per mutation, which is what NASTI did before.
+# Run from the project root with:
+#   python -m benchmarks.matcher
+import random
+import re
+import timeit
+from nasti.matcher import TokenMatcher, ReplacementSet
+
+TOKEN_COUNTS = [1, 10, 50]
+TEXT_SIZE = 1024 * 1024
+REPEAT = 5
+
+def make_tokens(count):
+    return [f"nasti_token_{i}_" for i in range(count)]
+
+# Builds text where roughly one word in every density words is a token
+def make_text(tokens, size, density=200):
+    rng = random.Random(0)
+    words = ["lorem", "ipsum", "dolor", "sit", "amet"]
+    chunks = []
+    length = 0
+    while length < size:
+        if tokens and rng.randrange(density) == 0:
+            word = rng.choice(tokens)
+        else:
+            word = rng.choice(words)
+        chunks.append(word)
+        length += len(word) + 1
+    return " ".join(chunks)
+
+def best_of(func):
+    return min(timeit.repeat(func, number=1, repeat=REPEAT))
+
+def loop_replace(replacements, text):
+    for replace, value in replacements:
+        text = text.replace(replace, value)
+    return text
+
+def loop_search(tokens, text):
+    return {token for token in tokens if re.search(token, text)}
+
+def main():
+    print(f"{'tokens':>6}  {'loop replace':>12}  {'single pass':>12}  {'loop search':>12}  {'matcher find':>12}")
+    for count in TOKEN_COUNTS:
+        tokens = make_tokens(count)
+        replacements = [(token, token.upper()) for token in tokens]
+        text = make_text(tokens, TEXT_SIZE)
+        # Searching text without any tokens in it is the worst case for find
+        plain_text = make_text([], TEXT_SIZE)
+        replacement_set = ReplacementSet(replacements)
+        matcher = TokenMatcher(tokens)
+        assert replacement_set.apply(text) == loop_replace(replacements, text)
+        print(
+            f"{count:>6}"
+            f"  {best_of(lambda: loop_replace(replacements, text)):>12.4f}"
+            f"  {best_of(lambda: replacement_set.apply(text)):>12.4f}"
+            f"  {best_of(lambda: loop_search(tokens, plain_text)):>12.4f}"
+            f"  {best_of(lambda: matcher.find(plain_text)):>12.4f}"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+# Times NASTI end to end and at the API level on synthetic templates and
+# compares the results against stored baselines. Everything runs against
+# local directories and local bare git repos, so no network is needed.
+# Run from the project root with:
+#   python -m benchmarks.suite
+# Record new baselines after an intended change with:
+#   python -m benchmarks.suite --update
+#
+# Baselines are only comparable on similar machines, so a fixed calibration
+# workload is timed right before every benchmark and each baseline is
+# scaled by how much faster or slower the machine is now than when the
+# baseline was recorded. A single calibration is as noisy as the shortest
+# benchmarks, so every result in a run is scaled by the median of all the
+# calibrations taken during it.
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import zlib
+from click.testing import CliRunner
+from benchmarks.generator import TemplateSpec, generate_template, make_bare_repo, GIT_ENV
+from nasti.cli import cli
+from nasti.nasti import Nasti
+from nasti.nastifile import NastiFile
+from nasti.mutation import Mutation
+import nasti.config_cache as config_cache
+
+BASELINES_PATH = os.path.dirname(os.path.abspath(__file__)) + "/baselines.json"
+REPEAT = 9
+# A result this much slower than its baseline is a regression
+TOLERANCE = 0.5
+# Differences smaller than this many seconds are noise whatever the
+# tolerance. Benchmarks that take a few milliseconds swing by far more
+# than 50% from run to run on a busy machine, so they only fail when
+# they get slower by more than a scheduler hiccup
+MIN_SLACK = 0.05
+
+# Each template varies one axis from the base template
+BASE_SPEC = TemplateSpec()
+TEMPLATES = {
+    "base": BASE_SPEC,
+    "many_files": BASE_SPEC.with_axes(files=2000),
+    "big_files": BASE_SPEC.with_axes(files=20, file_size=1024 * 1024, fan_out=10),
+    "many_mutations": BASE_SPEC.with_axes(mutations=50),
+    "wide_fan_out": BASE_SPEC.with_axes(fan_out=200),
+    "deep_tree": BASE_SPEC.with_axes(depth=12),
+}
+# What's timed on every template
+OPERATIONS = ["cli_process", "cli_validate", "cli_find", "nasti_run", "nastifile_validate", "nastifile_find", "mutation_run"]
+GIT_BENCHMARK = "git_source/nasti_run"
+
+# Benchmark times one operation on one template
+# setup runs before every repeat and isn't timed, run is what's timed
+# Dirty pages are flushed before every run so writing back what setup or
+# an earlier benchmark wrote isn't timed either
+class Benchmark:
+    def __init__(self, name, run, setup=None):
+        self.name = name
+        self.run = run
+        self.setup = setup
+
+    # Returns the median time of repeat runs in seconds
+    # The median is steadier than the best time, one lucky run can't set a
+    # baseline no later run gets near
+    def measure(self, repeat=REPEAT):
+        times = []
+        for _ in range(repeat):
+            if self.setup:
+                self.setup()
+            os.sync()
+            start = time.perf_counter()
+            self.run()
+            times.append(time.perf_counter() - start)
+        return statistics.median(times)
+
+# Builds every benchmark for a template generated in work_dir
+# Returns a list of Benchmarks
+def make_benchmarks(template_name, spec, work_dir):
+    template_dir = work_dir + "/" + template_name
+    output_dir = work_dir + "/" + template_name + "_output"
+    generate_template(template_dir, spec)
+    answers = spec.get_answers()
+    silent = ",".join(f"{name}={value}" for name, value in answers.items())
+
+    def clear_output():
+        shutil.rmtree(output_dir, ignore_errors=True)
+        # Every CLI run parses the nastifile again like a new process would
+        config_cache.memory_cache = config_cache.NastiFileCache()
+
+    def copy_template():
+        clear_output()
+        shutil.copytree(template_dir, output_dir)
+
+    def run_cli(*args):
+        result = CliRunner().invoke(cli, list(args), catch_exceptions=False)
+        assert result.exit_code == 0, result.output
+        return result.output
+
+    def cli_process():
+        run_cli("process", template_dir, output_dir, "-s", silent)
+        assert os.path.isdir(output_dir + "/.git"), "process didn't create the project"
+
+    def cli_validate():
+        assert "Nastifile is valid" in run_cli("validate", template_dir)
+
+    def nasti_run():
+        Nasti(nasti_opts(template_dir, output_dir, answers)).run()
+
+    def nastifile_validate():
+        nasti_file = make_nasti_file(template_dir)
+        nasti_file.load()
+        nasti_file.validate_mutations()
+
+    def nastifile_find():
+        make_nasti_file(template_dir).find_unmentioned_files()
+
+    # Each mutation rewrites its files in place on its own
+    def mutation_run():
+        nasti_file = make_nasti_file(output_dir)
+        nasti_file.load()
+        for mutation_config in nasti_file.config["mutations"]:
+            Mutation(mutation_config, output_dir, os, open, input, no_print, silent_mode=True, silent_opts=answers).run()
+
+    def cli_find():
+        run_cli("find", template_dir)
+
+    operations = {
+        "cli_process": (cli_process, clear_output),
+        "cli_validate": (cli_validate, clear_output),
+        "cli_find": (cli_find, clear_output),
+        "nasti_run": (nasti_run, clear_output),
+        "nastifile_validate": (nastifile_validate, None),
+        "nastifile_find": (nastifile_find, None),
+        "mutation_run": (mutation_run, copy_template),
+    }
+    return [Benchmark(f"{template_name}/{operation}", *operations[operation]) for operation in OPERATIONS]
+
+# Processing a template cloned from a local bare repo
+def make_git_benchmarks(work_dir):
+    template_dir = work_dir + "/git_template"
+    output_dir = work_dir + "/git_output"
+    generate_template(template_dir, BASE_SPEC)
+    url = make_bare_repo(template_dir, work_dir + "/git_template.git")
+    answers = BASE_SPEC.get_answers()
+
+    def clear_output():
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    def nasti_run():
+        Nasti(nasti_opts(url, output_dir, answers)).run()
+
+    return [Benchmark(GIT_BENCHMARK, nasti_run, clear_output)]
+
+def nasti_opts(source, output_dir, answers):
+    return {
+        "source": source,
+        "output_dir": output_dir,
+        "os_dep": os,
+        "open_dep": open,
+        "input_dep": input,
+        "print_dep": no_print,
+        "help_text": "",
+        "git_init": False,
+        "silent_mode": True,
+        "silent_opts": answers,
+        "config_cache": config_cache.NastiFileCache(),
+    }
+
+def make_nasti_file(path):
+    return NastiFile({
+        "path": path,
+        "os_dep": os,
+        "open_dep": open,
+        "print_dep": no_print,
+        "config_cache": config_cache.NastiFileCache(),
+    })
+
+def no_print(*args):
+    pass
+
+# Times a fixed mix of hashing, compression, interpreter and filesystem
+# work. Most benchmarks spend much of their time creating directories and
+# files, and how fast a machine does that changes independently of how
+# fast it computes
+# Returns the median time in seconds
+def calibrate(repeat=5):
+    data = bytes(range(256)) * (16 * 1024)
+    def workload():
+        hashlib.sha1(data).digest()
+        zlib.compress(data, 1)
+        sum(i * i for i in range(100000))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for i in range(100):
+                os.makedirs(f"{tmp_dir}/{i}/nested")
+                with open(f"{tmp_dir}/{i}/nested/file", "wb") as f:
+                    f.write(data[:4096])
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        workload()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+def load_baselines(path=BASELINES_PATH):
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+def save_baselines(results, path=BASELINES_PATH):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+# Returns the time a result's baseline allows on the machine as it is now
+def get_allowed(result, baseline):
+    return baseline["seconds"] * result["calibration"] / baseline["calibration"]
+
+# Returns the names of the results that are slower than their baseline
+# allows. Results without a baseline are never regressions
+def find_regressions(results, baselines, tolerance=TOLERANCE):
+    regressions = []
+    for name, result in results.items():
+        if name not in baselines:
+            continue
+        allowed = get_allowed(result, baselines[name])
+        if result["seconds"] > allowed * (1 + tolerance) and result["seconds"] - allowed > MIN_SLACK:
+            regressions.append(name)
+    return regressions
+
+def matches(name, filters):
+    return not filters or any(f in name for f in filters)
+
+# Runs every benchmark whose name contains one of the filters
+# Returns a dictionary of benchmark name to a dictionary of the seconds it
+# took and the run's calibration time
+def run_benchmarks(filters=[], repeat=REPEAT, print_dep=print):
+    results = {}
+    env = dict(os.environ)
+    # The CLI creates a git repo in every project it processes
+    os.environ.update(GIT_ENV)
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            benchmarks = []
+            # Templates are only generated if something runs on them
+            for template_name, spec in TEMPLATES.items():
+                if any(matches(f"{template_name}/{operation}", filters) for operation in OPERATIONS):
+                    benchmarks += make_benchmarks(template_name, spec, work_dir)
+            if matches(GIT_BENCHMARK, filters):
+                benchmarks += make_git_benchmarks(work_dir)
+            calibrations = []
+            for benchmark in benchmarks:
+                if matches(benchmark.name, filters):
+                    calibrations.append(calibrate())
+                    results[benchmark.name] = {"seconds": benchmark.measure(repeat)}
+                    print_dep(f"{benchmark.name:<36} {results[benchmark.name]['seconds']:>9.4f}s")
+            for result in results.values():
+                result["calibration"] = statistics.median(calibrations)
+    finally:
+        os.environ.clear()
+        os.environ.update(env)
+    return results
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark NASTI against stored baselines.")
+    parser.add_argument("filters", nargs="*", help="Only run benchmarks whose name contains one of these")
+    parser.add_argument("--update", action="store_true", help="Store the results as the new baselines")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help=f"Runs of each benchmark, the median is kept. Default is {REPEAT}")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help=f"How much slower than its baseline a result can be. Default is {TOLERANCE}")
+    parser.add_argument("--baselines", default=BASELINES_PATH, help="The baselines file")
+    args = parser.parse_args(args)
+
+    results = run_benchmarks(args.filters, args.repeat)
+    baselines = load_baselines(args.baselines)
+    if args.update:
+        # Keep the baselines of the benchmarks that didn't run
+        save_baselines({**(baselines or {}), **results}, args.baselines)
+        print(f"Saved {len(results)} baselines to {args.baselines}")
+        return 0
+    if not baselines:
+        print(f"No baselines in {args.baselines}, run with --update to record them")
+        return 0
+    regressions = find_regressions(results, baselines, args.tolerance)
+    for name in regressions:
+        allowed = get_allowed(results[name], baselines[name])
+        print(f"REGRESSION {name}: {results[name]['seconds']:.4f}s, baseline {allowed:.4f}s")
+    if regressions:
+        return 1
+    print("No regressions")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from nasti.source_handlers import SourceHandlerResolver, ArchiveHandler
+from nasti.nastifile import NastiFile
+from nasti.nasti import Nasti
+from nasti.copier import TemplateCopier
+from nasti.renderer import TemplateRenderer
+import nasti.config_cache as config_cache
+import nasti.exceptions as exceptions
+
+# NastiBatch generates many projects from one template
+# The source is resolved, the nastifile parsed and the mutations validated
+# once, then each answer set is generated into its own output directory
+# from that one copy of the source on a pool of worker threads.
+class NastiBatch:
+
+    def __init__(self, opts={}):
+        # Dependency injection
+        self.os_dep = opts["os_dep"]
+        self.open_dep = opts["open_dep"]
+        self.print_dep = opts["print_dep"]
+        self.help_text = opts["help_text"]
+
+        self.source = opts["source"]
+        self.handler = None
+        # answer_sets and output_dirs are lists of the same length
+        # answer_sets[i] is generated into output_dirs[i]
+        self.answer_sets = opts["answer_sets"]
+        self.output_dirs = opts["output_dirs"]
+        self.git_init = opts["git_init"]
+        self.native_git = False
+        if "native_git" in opts:
+            self.native_git = opts["native_git"]
+
+        self.jobs = 1
+        if "jobs" in opts:
+            self.jobs = opts["jobs"]
+        self.copy_mode = TemplateCopier.COPY_MODE
+        if "copy_mode" in opts:
+            self.copy_mode = opts["copy_mode"]
+        self.git_cache = None
+        if "git_cache" in opts:
+            self.git_cache = opts["git_cache"]
+        self.config_cache = config_cache.memory_cache
+        if "config_cache" in opts:
+            self.config_cache = opts["config_cache"]
+        # Every project shares the compiled default templates
+        self.renderer = TemplateRenderer()
+
+    # Generates every project
+    # Returns a list of (output dir, exception) with one entry per answer
+    # set in order, exception is None if the project was generated
+    # A failed project is deleted and doesn't stop the others
+    def run(self):
+        self.__verify_output_dirs()
+        resolver = SourceHandlerResolver(self.source, self.help_text, self.os_dep, self.print_dep, self.git_cache)
+        self.handler = resolver.resolve()
+        try:
+            self.handler.run()
+            nasti_file = self.__load_nasti_file()
+            return self.__map(self.__generate, list(zip(self.answer_sets, self.output_dirs)), self.__get_jobs(nasti_file))
+        finally:
+            self.handler.clean_up()
+
+    # The same as run but generates the projects with Nasti.run_async
+    # jobs projects at a time, for callers that already run an event loop
+    async def run_async(self):
+        import asyncio
+        self.__verify_output_dirs()
+        resolver = SourceHandlerResolver(self.source, self.help_text, self.os_dep, self.print_dep, self.git_cache)
+        self.handler = resolver.resolve()
+        try:
+            await asyncio.to_thread(self.handler.run)
+            nasti_file = await asyncio.to_thread(self.__load_nasti_file)
+            semaphore = asyncio.Semaphore(self.__get_jobs(nasti_file))
+            async def generate(answers, output_dir):
+                async with semaphore:
+                    try:
+                        await self.__make_nasti(answers, output_dir).run_async()
+                    except Exception as e:
+                        return output_dir, e
+                    return output_dir, None
+            return await asyncio.gather(*(generate(answers, output_dir) for answers, output_dir in zip(self.answer_sets, self.output_dirs)))
+        finally:
+            self.handler.clean_up()
+
+    def __load_nasti_file(self):
+        nasti_file = NastiFile({
+            "path": self.handler.source_dir,
+            "os_dep": self.os_dep,
+            "open_dep": self.open_dep,
+            "print_dep": self.print_dep,
+            "config_cache": self.config_cache,
+            "renderer": self.renderer,
+        })
+        nasti_file.load()
+        # Archive files are only checked as they're extracted
+        nasti_file.validate_mutations(check_files=not isinstance(self.handler, ArchiveHandler))
+        return nasti_file
+
+    def __generate(self, answers_and_output_dir):
+        answers, output_dir = answers_and_output_dir
+        try:
+            self.__make_nasti(answers, output_dir).run()
+        except Exception as e:
+            return output_dir, e
+        return output_dir, None
+
+    def __make_nasti(self, answers, output_dir):
+        return Nasti({
+            "source": self.source,
+            "handler": self.handler,
+            "validate": False,
+            "print_dep": self.print_dep,
+            "git_init": self.git_init,
+            "native_git": self.native_git,
+            "help_text": self.help_text,
+            "os_dep": self.os_dep,
+            "open_dep": self.open_dep,
+            "input_dep": self.__no_input,
+            "output_dir": output_dir,
+            "silent_mode": True,
+            "silent_opts": answers,
+            "copy_mode": self.copy_mode,
+            "lazy": True,
+            "config_cache": self.config_cache,
+            "renderer": self.renderer,
+        })
+
+    # Hooks change the working directory of the whole process
+    # so templates with hooks are generated one at a time
+    def __get_jobs(self, nasti_file):
+        if nasti_file.hooks.before or nasti_file.hooks.after:
+            return 1
+        return self.jobs
+
+    # Checked up front so no project is half way done when a
+    # clash is found, and so nothing ever prompts for a new directory
+    def __verify_output_dirs(self):
+        if len(self.output_dirs) != len(set(self.output_dirs)):
+            raise exceptions.NastiBatchOutputDirExistsException("Error: Two answer sets have the same output directory.")
+        for output_dir in self.output_dirs:
+            if self.os_dep.path.exists(output_dir):
+                raise exceptions.NastiBatchOutputDirExistsException(f"Error: Output directory {output_dir} already exists.")
+
+    def __no_input(self, text):
+        raise exceptions.NastiBatchInputRequiredException("Error: Batch mode can't prompt for input.")
+
+    def __map(self, func, items, jobs):
+        if jobs <= 1 or len(items) <= 1:
+            return list(map(func, items))
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            return list(executor.map(func, items))
+
+# Reads a JSON Lines file with one answer set per line
+# Each answer set is an object of mutation and global names to string
+# values, the same as an --input-file. Blank lines are skipped
+def load_answer_sets(path, open_dep=open):
+    answer_sets = []
+    with open_dep(path, 'r') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                answers = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise exceptions.NastiBatchAnswersInvalidException(f"Error: Line {line_number} of {path} isn't valid JSON: {e}")
+            if not answers or not isinstance(answers, dict) or not all(isinstance(key, str) and isinstance(val, str) for key, val in answers.items()):
+                raise exceptions.NastiBatchAnswersInvalidException(f"Error: Line {line_number} of {path} should be an object of key value pairs of strings.")
+            answer_sets.append(answers)
+    if not answer_sets:
+        raise exceptions.NastiBatchAnswersInvalidException(f"Error: {path} doesn't contain any answer sets.")
+    return answer_sets
+
+# Works out the output directory for each answer set under dest_dir
+# If name_key is given each directory is named after that answer,
+# otherwise they're numbered from 1 in the order of the answer sets
+def get_output_dirs(answer_sets, dest_dir, name_key=None):
+    output_dirs = []
+    for i, answers in enumerate(answer_sets, 1):
+        name = str(i)
+        if name_key:
+            if name_key not in answers:
+                raise exceptions.NastiBatchAnswersInvalidException(f"Error: Answer set {i} has no {name_key} to name its output directory.")
+            name = answers[name_key]
+            if name in ["", ".", ".."] or "/" in name or os.sep in name:
+                raise exceptions.NastiBatchAnswersInvalidException(f"Error: Answer set {i} can't name an output directory {name}.")
+        output_dirs.append(os.path.join(dest_dir, name))
+    return output_dirs
@@ -0,0 +1,211 @@
+import time
+from nasti.matcher import TokenMatcher
+from nasti.nastifile import NastiFile, UnmentionedFilesResult
+from nasti.scanner import TemplateScanner
+
+# TemplateChecker does what validate and find do, but keeps the tokens it
+# found in every file so that when files change only those files are read
+# again and only the mutations they affect are checked again. It's what
+# validate --watch runs on every change.
+class TemplateChecker:
+    NASTIFILE_NAME = "nasti.yaml"
+
+    def __init__(self, nasti_file, perf_counter=time.perf_counter):
+        self.nasti_file = nasti_file
+        self.perf_counter = perf_counter
+        self.config = None
+        self.mutations = []
+        self.matcher = None
+        # Tokens found in each file a mutation references, read the way
+        # validate reads them
+        self.referenced_tokens = {}
+        # Tokens found in each file in the template that has any, read the
+        # way find reads them
+        self.template_tokens = {}
+        # The error each mutation failed validation with and the files
+        # each mutation matches but doesn't reference, in nastifile order
+        self.errors = []
+        self.unmentioned = []
+        # The nastifile couldn't be loaded or the template couldn't be read
+        self.error = None
+        # What the last check did
+        self.files_checked = 0
+        self.mutations_checked = 0
+        self.seconds = 0
+
+    # Checks the whole template
+    def check_all(self):
+        start = self.perf_counter()
+        self.__load()
+        self.referenced_tokens = {}
+        self.template_tokens = {}
+        if not self.error:
+            self.__scan_referenced(self.__get_referenced_files())
+            scanner = self.nasti_file.get_scanner()
+            try:
+                self.template_tokens = scanner.scan(self.matcher)
+            except OSError as e:
+                self.error = e
+            self.files_checked = len(scanner.list_files())
+            self.__check_mutations(range(len(self.mutations)), range(len(self.mutations)))
+        self.seconds = self.perf_counter() - start
+
+    # Checks again after the given paths changed, paths are relative to
+    # the template as a watcher returns them
+    # Returns False if none of them matter to the nastifile
+    def check_changes(self, paths):
+        if "" in paths or self.error:
+            self.check_all()
+            return True
+        if self.NASTIFILE_NAME in paths:
+            if not self.__reload():
+                self.check_all()
+            return True
+        start = self.perf_counter()
+        scanner = self.nasti_file.get_scanner()
+        files = self.__expand(scanner, paths)
+        referenced = set(self.__get_referenced_files())
+        changed_referenced = [file for file in files if file in referenced]
+        changed_template = [file for file in files if self.__is_template_file(scanner, file)]
+        if not changed_referenced and not changed_template:
+            return False
+        self.__scan_referenced(changed_referenced)
+        tokens = self.__scan_template(scanner, changed_template)
+        changed_referenced = set(changed_referenced)
+        validate = [i for i, mutation in enumerate(self.mutations) if changed_referenced.intersection(mutation.files)]
+        find = [i for i, mutation in enumerate(self.mutations) if mutation.replace in tokens]
+        self.files_checked = len(changed_referenced.union(changed_template))
+        self.__check_mutations(validate, find)
+        self.seconds = self.perf_counter() - start
+        return True
+
+    def is_valid(self):
+        return not self.error and not any(self.errors)
+
+    def get_unmentioned_files(self):
+        result = UnmentionedFilesResult()
+        for mutation, files in zip(self.mutations, self.unmentioned):
+            result.add(mutation, files)
+        return result
+
+    def get_report(self):
+        if self.error:
+            return f"[red]:x: Nastifile is invalid.[/red]\n{self.error}"
+        if self.is_valid():
+            report = "[green]:heavy_check_mark: Nastifile is valid.[/green]"
+        else:
+            report = "[red]:x: Nastifile is invalid.[/red]"
+            for error in self.errors:
+                if error:
+                    report += f"\n{error}"
+        report += self.get_unmentioned_files().get_report()
+        report += f"\n[gray]Checked {self.files_checked} files and {self.mutations_checked} mutations in {self.seconds * 1000:.0f}ms.[/gray]"
+        return report
+
+    # Loads the nastifile again after it changed
+    # If its tokens are the ones already searched for, or some of them,
+    # what's known about the files stays and only files it references
+    # for the first time are read
+    # Returns False if the whole template has to be checked again
+    def __reload(self):
+        if self.error or not self.mutations:
+            return False
+        start = self.perf_counter()
+        tokens = set(self.matcher.tokens)
+        binary_extensions = self.config.get(NastiFile.BINARY_EXTENSIONS_KEY)
+        self.__load()
+        if self.error:
+            return True
+        if not set(self.matcher.tokens).issubset(tokens) or self.config.get(NastiFile.BINARY_EXTENSIONS_KEY) != binary_extensions:
+            return False
+        files = [file for file in self.__get_referenced_files() if file not in self.referenced_tokens]
+        self.__scan_referenced(files)
+        self.files_checked = len(files)
+        self.__check_mutations(range(len(self.mutations)), range(len(self.mutations)))
+        self.seconds = self.perf_counter() - start
+        return True
+
+    def __load(self):
+        self.error = None
+        self.mutations = []
+        self.errors = []
+        self.unmentioned = []
+        # The binary extensions might have changed
+        self.nasti_file.classifier = None
+        try:
+            self.nasti_file.load()
+            self.mutations = self.nasti_file.get_mutations()
+        except Exception as e:
+            self.error = e
+            return
+        self.config = self.nasti_file.config
+        self.matcher = TokenMatcher([mutation.replace for mutation in self.mutations])
+        self.errors = [None] * len(self.mutations)
+        self.unmentioned = [[] for _ in self.mutations]
+
+    # validate and find are the indexes of the mutations to validate and to
+    # find unmentioned files for again
+    def __check_mutations(self, validate, find):
+        for i in validate:
+            try:
+                self.mutations[i].validate(self.referenced_tokens)
+                self.errors[i] = None
+            except Exception as e:
+                self.errors[i] = e
+        for i in find:
+            self.unmentioned[i] = self.mutations[i].get_unmentioned_files(self.template_tokens)
+        self.mutations_checked = len(set(validate).union(find))
+
+    def __get_referenced_files(self):
+        files = []
+        for mutation in self.mutations:
+            files += mutation.files
+        return list(dict.fromkeys(files))
+
+    # Files that can't be read are left out so validating the mutation
+    # that references them reports the problem
+    def __scan_referenced(self, files):
+        file_tokens = self.nasti_file.get_scanner().scan_files(self.matcher, files, ignore_errors=True)
+        for file in files:
+            if file in file_tokens:
+                self.referenced_tokens[file] = file_tokens[file]
+            else:
+                self.referenced_tokens.pop(file, None)
+
+    # Returns every token that was or now is in the files
+    def __scan_template(self, scanner, files):
+        tokens = set()
+        for file in files:
+            tokens |= self.template_tokens.pop(file, set())
+        existing = [file for file in files if self.nasti_file.os_dep.path.isfile(scanner.get_full_path(file))]
+        file_tokens = scanner.scan_files(self.matcher, existing, errors='replace', ignore_errors=True, skip_binary=True)
+        for file, found in file_tokens.items():
+            if found:
+                self.template_tokens[file] = found
+                tokens |= found
+        return tokens
+
+    # Directories stand for every file under them, the ones there now and
+    # the ones there before
+    # Files that came and went between checks, like an editor's temporary
+    # files, are left out
+    def __expand(self, scanner, paths):
+        os_dep = self.nasti_file.os_dep
+        known = set(self.referenced_tokens).union(self.template_tokens)
+        files = set()
+        for path in paths:
+            files.update(file for file in known if file.startswith(path + "/"))
+            full_path = scanner.get_full_path(path)
+            if os_dep.path.isdir(full_path):
+                files.update(path + "/" + file for file in TemplateScanner(full_path, os_dep).list_files())
+            elif path in known or os_dep.path.isfile(full_path):
+                files.add(path)
+        return files
+
+    # The files find scans, everything but dot files, nastifiles and
+    # binary files
+    def __is_template_file(self, scanner, file):
+        names = file.split("/")
+        if any(name.startswith(".") for name in names) or names[-1] == self.NASTIFILE_NAME:
+            return False
+        return not scanner.classifier.is_binary(file)
@@ -0,0 +1,56 @@
+# FileClassifier decides which template files are binary so token scans can
+# skip them. Files are judged by their extension first, then by sniffing
+# the start of the file for NUL bytes and the magic numbers of common binary
+# formats. Each file is only judged once per run.
+class FileClassifier:
+    # Extensions that are always binary, matched case insensitively
+    BINARY_EXTENSIONS = [
+        # Images
+        ".png", ".jpg", ".jpeg", ".gif", ".bmp", ".ico", ".icns", ".webp", ".tif", ".tiff", ".psd",
+        # Fonts
+        ".woff", ".woff2", ".ttf", ".otf", ".eot",
+        # Archives
+        ".zip", ".gz", ".tgz", ".bz2", ".xz", ".zst", ".7z", ".rar", ".jar", ".war",
+        # Compiled code
+        ".class", ".pyc", ".pyo", ".o", ".a", ".so", ".dylib", ".dll", ".exe", ".wasm",
+        # Media and documents
+        ".mp3", ".mp4", ".mov", ".wav", ".ogg", ".webm", ".pdf",
+        # Databases
+        ".sqlite", ".db",
+    ]
+
+    # extensions is added to BINARY_EXTENSIONS and can hold any file name
+    # ending, such as ".min.js" for generated files that shouldn't be scanned
+    def __init__(self, extensions=[]):
+        self.extensions = tuple(extension.lower() for extension in self.BINARY_EXTENSIONS + list(extensions))
+        # Maps a file to whether it's binary
+        self.files = {}
+
+    # Returns True if the file is known to be binary without reading it,
+    # either from its extension or because it was found to be binary earlier
+    def is_binary(self, file):
+        if file not in self.files:
+            if not file.lower().endswith(self.extensions):
+                return False
+            self.files[file] = True
+        return self.files[file]
+
+    def set_binary(self, file):
+        self.files[file] = True
+
+# Files are sniffed this many bytes in
+SNIFF_SIZE = 8192
+
+# Binary formats that might not have a NUL byte near the start
+MAGIC_NUMBERS = (
+    b"\x89PNG", b"GIF87a", b"GIF89a", b"\xff\xd8\xff", b"%PDF-",
+    b"PK\x03\x04", b"\x1f\x8b", b"\x28\xb5\x2f\xfd", b"\xfd7zXZ", b"7z\xbc\xaf\x27\x1c", b"Rar!\x1a\x07",
+    b"\x7fELF", b"\xca\xfe\xba\xbe", b"\xcf\xfa\xed\xfe", b"\xce\xfa\xed\xfe",
+    b"wOFF", b"wOF2", b"OggS", b"fLaC",
+)
+
+# Returns True if the first bytes of a file look binary
+# data can be anything bytes-like, only the first SNIFF_SIZE bytes are checked
+def is_binary_data(data):
+    prefix = bytes(data[:SNIFF_SIZE])
+    return b"\0" in prefix or prefix.startswith(MAGIC_NUMBERS)
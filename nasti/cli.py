@@ -1,13 +1,14 @@
 import click
 import sys
 import os
-import json
-import yaml
-from nasti.nastifile import NastiFile
-from nasti.nasti import Nasti
+from nasti.copier import TemplateCopier
+from nasti.git_cache import GitMirrorCache
+from nasti.profiler import Profiler, null_profiler
 import rich
-from prompt_toolkit import PromptSession
-from prompt_toolkit.history import InMemoryHistory
+
+# NASTI is often run from scripts and pre-commit hooks where startup time
+# matters, so each command imports what it needs when it runs rather than
+# everything being imported up front
 
 def remove_silent_opt_outer_quotes(s):
     if len(s) < 2:  # If the string length is less than 2, just return the original string
@@ -33,6 +34,37 @@ def parse_silent_opts(silent_str):
 
     return silent_dict
 
+# Parsed nastifiles are always shared in memory, the flag keeps them on disk too
+def get_config_cache(nastifile_cache):
+    import nasti.config_cache as config_cache
+    if nastifile_cache:
+        return config_cache.NastiFileCache(config_cache.NastiFileCache.default_cache_dir())
+    return config_cache.memory_cache
+
+# The git cache is only used when the flag is given
+def get_git_cache(git_cache, git_cache_dir, git_cache_size):
+    if git_cache:
+        return GitMirrorCache(git_cache_dir, git_cache_size * 1024 * 1024)
+    return None
+
+# Options shared by several commands
+copy_mode_option = click.option("--copy-mode", "-c", type=click.Choice(TemplateCopier.MODES), default=TemplateCopier.COPY_MODE, help="How files no mutation changes are copied from the template. hardlink shares them with the template, so editing them later edits the template. Default is copy.")
+nastifile_cache_option = click.option("--nastifile-cache", help="Keep parsed nastifiles in ~/.cache/nasti/nastifiles between runs. Default is False", is_flag=True, default=False)
+
+# Decorators apply from the bottom up so these are added last first
+def git_cache_options(command):
+    command = click.option("--git-cache-size", type=click.IntRange(min=0), default=GitMirrorCache.DEFAULT_MAX_SIZE // (1024 * 1024), help="Size limit of the git cache in megabytes. Default is 1024.")(command)
+    command = click.option("--git-cache-dir", type=click.Path(file_okay=False), help="Directory the git cache is kept in. Default is ~/.cache/nasti/git")(command)
+    return click.option("--git-cache", help="Clone git templates through a local cache of mirrors. Default is False", is_flag=True, default=False)(command)
+
+# Silent mode never prompts so it doesn't need prompt_toolkit
+def get_input_dep(silent_mode):
+    if silent_mode:
+        return input
+    from prompt_toolkit import PromptSession
+    from prompt_toolkit.history import InMemoryHistory
+    return PromptSession(history=InMemoryHistory()).prompt
+
 @click.group()
 def cli():
     """
@@ -46,10 +78,23 @@ def cli():
 @click.argument("source", required=True)
 @click.argument("dest_dir", required=False)
 @click.option("--git", "-g", help="Create a git repo in the new project. Default is True.", is_flag=True, default=True )
+@click.option("--native-git", help="Create the git repo without running git when your git config allows it. Default is False", is_flag=True, default=False)
 @click.option("--defaults", "-d", help="Accept all defaults. Default is False", is_flag=True, default=False )
 @click.option("--silent", "-s", help="Silent mode with key=value pairs separated by commas.")
 @click.option("--input-file", "-f", type=click.Path(exists=True, file_okay=True, dir_okay=False, readable=True), help="Input file in JSON or YAML format containing key=value pairs.")
-def process(source, git, defaults, dest_dir, silent, input_file):
+@copy_mode_option
+@click.option("--lazy", "-l", help="Read mutated files straight from the template and only write the results. Default is False", is_flag=True, default=False)
+@git_cache_options
+@nastifile_cache_option
+@click.option("--plan", "show_plan", help="Print what processing the template would do as JSON without writing anything. Default is False", is_flag=True, default=False)
+@click.option("--lock/--no-lock", help="Write a lockfile so the project can be updated with nasti update. It holds every answer in plain text. Default is False.", default=False)
+@click.option("--profile", "profile_path", type=click.Path(dir_okay=False, writable=True), help="Write the time, I/O and memory use of every phase of the run to this file.")
+@click.option("--profile-format", type=click.Choice(Profiler.FORMATS), default=Profiler.JSON_FORMAT, help="Format of the --profile file, JSON or Chrome trace events. Default is json.")
+def process(source, git, native_git, defaults, dest_dir, silent, input_file, copy_mode, lazy, git_cache, git_cache_dir, git_cache_size, nastifile_cache, show_plan, lock, profile_path, profile_format):
+    import json
+    import yaml
+    from nasti.nasti import Nasti
+
     # When in silent mode we don't prompt the user for input
     silent_mode = False
     silent_opts = {}
@@ -92,25 +137,40 @@ def process(source, git, defaults, dest_dir, silent, input_file):
         silent_mode = True
 
 
+    # Profiling is off unless asked for
+    profiler = Profiler() if profile_path else null_profiler
+
     try:
-        history = InMemoryHistory()
-        session = PromptSession(history=history)
         nasti = Nasti({
             "source": source, 
             "print_dep": rich.print, 
             "git_init": git, 
+            "native_git": native_git,
             "help_text": cli.get_help(click.Context(cli)),
             "os_dep": os,
             "open_dep": open,
-            "input_dep": session.prompt,
+            "input_dep": get_input_dep(silent_mode),
             "accept_defaults": defaults,
             "output_dir": dest_dir,
             "silent_mode": silent_mode,
             "silent_opts": silent_opts,
+            "copy_mode": copy_mode,
+            "lazy": lazy,
+            "git_cache": get_git_cache(git_cache, git_cache_dir, git_cache_size),
+            "config_cache": get_config_cache(nastifile_cache),
+            "lock": lock,
+            "profiler": profiler,
         })
+        if show_plan:
+            report = nasti.plan()
+            click.echo(json.dumps(report.to_dict(), indent=2))
+            return
         nasti.run()
     except Exception as e:
         print(f"    Error: {e}")
+        # A plan is usually run by CI, which needs to see it fail
+        if show_plan:
+            sys.exit(1)
     except KeyboardInterrupt:
         # Check if the output directory exists
         if nasti.output_dir:
@@ -119,10 +179,155 @@ def process(source, git, defaults, dest_dir, silent, input_file):
             rich.print("[gray][italic]   Deleting output directory...[/italic][/gray]")
             nasti.delete_output_dir()
             rich.print("[gray][italic]   Exiting.[gray][italic]")
+    finally:
+        # Failed runs are profiled too
+        if profile_path:
+            profiler.save(profile_path, profile_format)
+
+@click.command()
+@click.argument("source", required=True)
+@click.argument("answers_file", type=click.Path(exists=True, file_okay=True, dir_okay=False, readable=True))
+@click.argument("dest_dir", required=False, default=".")
+@click.option("--name-from", "-n", help="Name each output directory after this answer. Default is to number them.")
+@click.option("--jobs", "-j", type=click.IntRange(min=1), default=4, help="Number of projects to generate at once. Default is 4.")
+@click.option("--git", "-g", help="Create a git repo in each new project. Default is True.", is_flag=True, default=True )
+@click.option("--native-git", help="Create the git repo without running git when your git config allows it. Default is False", is_flag=True, default=False)
+@copy_mode_option
+@git_cache_options
+@nastifile_cache_option
+def batch(source, answers_file, dest_dir, name_from, jobs, git, native_git, copy_mode, git_cache, git_cache_dir, git_cache_size, nastifile_cache):
+    """
+    Generate one project per line of a JSON Lines answers file.
+    """
+    from nasti.batch import NastiBatch, load_answer_sets, get_output_dirs
+
+    try:
+        answer_sets = load_answer_sets(answers_file)
+        output_dirs = get_output_dirs(answer_sets, dest_dir, name_from)
+        nasti_batch = NastiBatch({
+            "source": source,
+            "print_dep": rich.print,
+            "git_init": git,
+            "native_git": native_git,
+            "help_text": cli.get_help(click.Context(cli)),
+            "os_dep": os,
+            "open_dep": open,
+            "answer_sets": answer_sets,
+            "output_dirs": output_dirs,
+            "jobs": jobs,
+            "copy_mode": copy_mode,
+            "git_cache": get_git_cache(git_cache, git_cache_dir, git_cache_size),
+            "config_cache": get_config_cache(nastifile_cache),
+        })
+        results = nasti_batch.run()
+    except Exception as e:
+        rich.print("[red]:stop_sign:[bold] Error processing the batch[/bold][red]")
+        rich.print(e)
+        sys.exit(1)
+
+    failures = 0
+    for output_dir, error in results:
+        if error:
+            failures += 1
+            rich.print(f"[red]:x: {output_dir}[/red] {error}")
+        else:
+            rich.print(f"[green]:heavy_check_mark: {output_dir}[/green]")
+    rich.print(f"Generated {len(results) - failures} of {len(results)} projects.")
+    if failures:
+        sys.exit(1)
+
+@click.command()
+@click.argument("project_dir", required=False, default=".")
+@click.option("--source", help="Update from this template instead of the one the project was generated from.")
+@click.option("--silent", "-s", help="New or changed answers as key=value pairs separated by commas.")
+@click.option("--force", help="Overwrite files that were edited in the project. Default is False", is_flag=True, default=False)
+@git_cache_options
+@nastifile_cache_option
+def update(project_dir, source, silent, force, git_cache, git_cache_dir, git_cache_size, nastifile_cache):
+    """
+    Apply changes to a template to a project generated from it.
+    """
+    from nasti.update import NastiUpdate
+
+    try:
+        answers = parse_silent_opts(silent) if silent else {}
+        opts = {
+            "print_dep": rich.print,
+            "help_text": cli.get_help(click.Context(cli)),
+            "os_dep": os,
+            "open_dep": open,
+            "project_dir": project_dir,
+            "answers": answers,
+            "force": force,
+            "git_cache": get_git_cache(git_cache, git_cache_dir, git_cache_size),
+            "config_cache": get_config_cache(nastifile_cache),
+        }
+        if source:
+            opts["source"] = source
+        result = NastiUpdate(opts).run()
+    except Exception as e:
+        rich.print("[red]:stop_sign:[bold] Error updating the project[/bold][red]")
+        rich.print(e)
+        sys.exit(1)
+
+    if result.up_to_date:
+        rich.print("[green]:heavy_check_mark: The project is up to date.[/green]")
+        return
+    for label, files in [("added", result.added), ("updated", result.updated), ("removed", result.removed)]:
+        for file in files:
+            rich.print(f"[green]{label}[/green] {file}")
+    for file in result.conflicts:
+        rich.print(f"[red]:x: conflict[/red] {file} was edited in the project and left alone")
+    rich.print(f"Added {len(result.added)}, updated {len(result.updated)} and removed {len(result.removed)} files.")
+    # Scripts updating lots of projects need to see the ones that need a look
+    if result.conflicts:
+        sys.exit(1)
+
+@click.command()
+@click.option("--socket", "socket_path", type=click.Path(dir_okay=False), help="Unix domain socket to listen on. Default is $XDG_RUNTIME_DIR/nasti-<uid>.sock")
+@click.option("--port", type=click.IntRange(min=1, max=65535), help="Listen for HTTP on this localhost port instead of a socket.")
+@click.option("--token-file", type=click.Path(dir_okay=False), help="Where the token HTTP clients must send is written. Default is $XDG_RUNTIME_DIR/nasti-<uid>.token")
+@copy_mode_option
+@git_cache_options
+@nastifile_cache_option
+def serve(socket_path, port, token_file, copy_mode, git_cache, git_cache_dir, git_cache_size, nastifile_cache):
+    """
+    Keep templates warm and generate projects for clients.
+    """
+    from nasti.server import NastiServer, default_socket_path, default_token_path
+
+    server = NastiServer({
+        "help_text": cli.get_help(click.Context(cli)),
+        "os_dep": os,
+        "open_dep": open,
+        "copy_mode": copy_mode,
+        "git_cache": get_git_cache(git_cache, git_cache_dir, git_cache_size),
+        "config_cache": get_config_cache(nastifile_cache),
+    })
+    try:
+        if port:
+            token_file = token_file or default_token_path()
+            server.listen_http(port, token_file)
+            rich.print(f"[blue]NASTI is listening on http://127.0.0.1:{port}/jobs[/blue]")
+            rich.print(f"[blue]Send the token in {token_file} as Authorization: Bearer <token>[/blue]")
+        else:
+            socket_path = socket_path or default_socket_path()
+            server.listen_unix(socket_path)
+            rich.print(f"[blue]NASTI is listening on {socket_path}[/blue]")
+        server.serve()
+    except KeyboardInterrupt:
+        rich.print("[gray][italic]   Stopping.[/italic][/gray]")
 
 @click.command()
 @click.argument("path", required=False)
-def validate(path):
+@click.option("--jobs", "-j", type=click.IntRange(min=1), default=1, help="Number of files to scan at once. Default is 1.")
+@click.option("--processes", "-p", help="Scan files in worker processes instead of threads. Default is False", is_flag=True, default=False)
+@nastifile_cache_option
+@click.option("--index", "use_index", help="Keep an index in the template's .nasti-cache directory so only files that changed are read next time. Default is False", is_flag=True, default=False)
+@click.option("--watch", "-w", help="Keep checking the template and print a new report whenever its files change. Default is False", is_flag=True, default=False)
+@click.option("--poll", help="Watch by checking for changes every half second instead of with inotify. Default is False", is_flag=True, default=False)
+def validate(path, jobs, processes, nastifile_cache, use_index, watch, poll):
+    from nasti.nastifile import NastiFile
     if not path:
         path = "."
     try:
@@ -131,7 +336,14 @@ def validate(path):
             "path": path,
             "os_dep": os,
             "open_dep": open,
+            "jobs": jobs,
+            "use_processes": processes,
+            "config_cache": get_config_cache(nastifile_cache),
+            "use_index": use_index,
         })
+        if watch:
+            watch_template(nasti_file, poll)
+            return
         nasti_file.load()
         nasti_file.validate_mutations()
         rich.print("[green]:heavy_check_mark: Nastifile is valid.[/green]")
@@ -139,9 +351,34 @@ def validate(path):
         rich.print("[red]:x: Nastifile is invalid.[/red]")
         rich.print(e)
 
+# Checks the template once and then again every time files in it change
+# until the user stops it
+def watch_template(nasti_file, poll):
+    from nasti.checker import TemplateChecker
+    from nasti.watcher import make_watcher
+    # Watching starts first so nothing changed during the first check is missed
+    watcher = make_watcher(nasti_file.get_dir(), os, poll)
+    try:
+        checker = TemplateChecker(nasti_file)
+        checker.check_all()
+        rich.print(checker.get_report())
+        rich.print("[blue]Watching for changes, press Ctrl+C to stop.[/blue]")
+        while True:
+            if checker.check_changes(watcher.wait()):
+                rich.print(checker.get_report())
+    except KeyboardInterrupt:
+        rich.print("[gray][italic]   Stopping.[/italic][/gray]")
+    finally:
+        watcher.close()
+
 @click.command()
 @click.argument("path", required=False)
-def find(path):
+@click.option("--jobs", "-j", type=click.IntRange(min=1), default=1, help="Number of files to scan at once. Default is 1.")
+@click.option("--processes", "-p", help="Scan files in worker processes instead of threads. Default is False", is_flag=True, default=False)
+@nastifile_cache_option
+@click.option("--index", "use_index", help="Keep an index in the template's .nasti-cache directory so only files that changed are read next time. Default is False", is_flag=True, default=False)
+def find(path, jobs, processes, nastifile_cache, use_index):
+    from nasti.nastifile import NastiFile
     rich.print("[blue]Searching for files that match mutations but aren't mentioned in Nastifile...[/blue]")
     if not path:
         path = "."
@@ -151,6 +388,10 @@ def find(path):
             "path": path,
             "os_dep": os,
             "open_dep": open,
+            "jobs": jobs,
+            "use_processes": processes,
+            "config_cache": get_config_cache(nastifile_cache),
+            "use_index": use_index,
         })
         unmentioned_files = nasti_file.find_unmentioned_files()
         rich.print(unmentioned_files.get_report())
@@ -158,5 +399,8 @@ def find(path):
         rich.print(e)
 
 cli.add_command(process)
+cli.add_command(batch)
+cli.add_command(update)
+cli.add_command(serve)
 cli.add_command(validate)
 cli.add_command(find)
\ No newline at end of file
@@ -0,0 +1,108 @@
+import os
+import copy
+import json
+import hashlib
+import yaml
+
+# The C loader is many times faster than the pure Python one, but is only
+# there if PyYAML was built against libyaml
+SAFE_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# NastiFileCache keeps parsed nastifiles so the same file is only parsed
+# and validated once however many times it's loaded. Entries are keyed by
+# the sha256 of the file's contents, so an edited nastifile is always
+# parsed again. Entries are held in memory for the life of the process and
+# written to cache_dir as JSON if one is given, so they outlive it too.
+# Configs JSON can't hold exactly, like ones with dates in them, are only
+# kept in memory.
+class NastiFileCache:
+    # Bump this if the shape of a cache entry changes
+    VERSION = 2
+    ENTRY_SUFFIX = ".json"
+
+    def __init__(self, cache_dir=None, os_dep=os, open_dep=open):
+        # Dependency injection
+        self.os_dep = os_dep
+        self.open_dep = open_dep
+        self.cache_dir = cache_dir
+        self.entries = {}
+
+    # The on disk cache lives in the user's cache directory by default
+    @classmethod
+    def default_cache_dir(cls, os_dep=os):
+        cache_home = os_dep.environ.get("XDG_CACHE_HOME") or os_dep.path.expanduser("~/.cache")
+        return cache_home + "/nasti/nastifiles"
+
+    def get_key(self, data):
+        return hashlib.sha256(data).hexdigest()
+
+    # Returns the parsed config for the file contents in data
+    # Every caller gets its own copy so changes made to it don't leak
+    # into the cache
+    # Raises yaml.YAMLError if data isn't valid YAML
+    def load(self, data):
+        entry = self.__get_entry(self.get_key(data))
+        if entry is None:
+            entry = {"config": yaml.load(data, Loader=SAFE_LOADER), "validated": False}
+            self.__put_entry(self.get_key(data), entry)
+        return copy.deepcopy(entry["config"])
+
+    # Whether the config with this key has already passed validation
+    def is_validated(self, key):
+        entry = self.__get_entry(key)
+        return bool(entry and entry["validated"])
+
+    def set_validated(self, key):
+        entry = self.__get_entry(key)
+        if entry and not entry["validated"]:
+            entry["validated"] = True
+            self.__put_entry(key, entry)
+
+    def __get_entry(self, key):
+        if key not in self.entries and self.cache_dir:
+            entry = self.__read_entry(key)
+            if entry is not None:
+                self.entries[key] = entry
+        return self.entries.get(key)
+
+    def __put_entry(self, key, entry):
+        self.entries[key] = entry
+        if self.cache_dir:
+            self.__write_entry(key, entry)
+
+    def __read_entry(self, key):
+        try:
+            with self.open_dep(self.__get_entry_path(key), 'r') as f:
+                data = json.load(f)
+            if data["version"] != self.VERSION:
+                return None
+            return data["entry"]
+        except Exception:
+            # Missing, unreadable or from another version of NASTI
+            # all mean the file gets parsed again
+            return None
+
+    # The cache is only ever an optimisation so failing to write it
+    # is never an error
+    def __write_entry(self, key, entry):
+        entry_path = self.__get_entry_path(key)
+        tmp_path = f"{entry_path}.{self.os_dep.getpid()}.tmp"
+        try:
+            data = {"version": self.VERSION, "entry": entry}
+            text = json.dumps(data)
+            # Keys that aren't strings would come back as strings
+            if json.loads(text) != data:
+                return
+            self.os_dep.makedirs(self.cache_dir, exist_ok=True)
+            with self.open_dep(tmp_path, 'w') as f:
+                f.write(text)
+            # Readers never see a half written entry
+            self.os_dep.replace(tmp_path, entry_path)
+        except Exception:
+            pass
+
+    def __get_entry_path(self, key):
+        return self.cache_dir + "/" + key + self.ENTRY_SUFFIX
+
+# Shared by every NastiFile in the process that isn't given its own cache
+memory_cache = NastiFileCache()
@@ -0,0 +1,144 @@
+import os
+import shutil
+import fcntl
+import stat
+import nasti.exceptions as exceptions
+from nasti.index import SKIP_NAMES
+
+# TemplateCopier copies a template's source directory into the output
+# directory without shelling out. Files no mutation will touch can be
+# reflinked or hardlinked instead of copied byte for byte. Hardlinked files
+# are the template's own files, so anything that edits them in place later
+# edits the template too.
+class TemplateCopier:
+    COPY_MODE = "copy"
+    REFLINK_MODE = "reflink"
+    HARDLINK_MODE = "hardlink"
+    MODES = [COPY_MODE, REFLINK_MODE, HARDLINK_MODE]
+
+    # Linux ioctl that clones a file's extents on copy-on-write filesystems
+    FICLONE = 0x40049409
+
+    # Copies happen in chunks of this size when the kernel copies for us
+    CHUNK_SIZE = 1024 * 1024 * 8
+
+    def __init__(self, source_dir, output_dir, os_dep=os, open_dep=open, mode=COPY_MODE, jobs=None):
+        if mode not in self.MODES:
+            raise exceptions.TemplateCopierUnknownModeException(f"Error: Unknown copy mode {mode}. Expected one of {', '.join(self.MODES)}.")
+        # Dependency injection
+        self.os_dep = os_dep
+        self.open_dep = open_dep
+        self.source_dir = source_dir
+        self.output_dir = output_dir
+        self.mode = mode
+        # Lots of small files copy faster with a few threads going at once
+        self.jobs = jobs if jobs else min(32, (self.os_dep.cpu_count() or 1) + 4)
+
+    # Copy the whole source directory into the output directory
+    # copy_files is a collection of paths relative to the source directory
+    # that must always get their own copy, such as files mutations will
+    # rewrite, no matter what mode the copier is in
+    # skip_files is a collection of paths that are left out entirely because
+    # something else writes them, their directories are still created
+    # Returns the files that were copied
+    def copy(self, copy_files=[], skip_files=[]):
+        copy_files = set(copy_files)
+        skip_files = set(skip_files)
+        files = []
+        try:
+            self.__copy_dir("", files)
+            files = [file for file in files if file not in skip_files]
+            self.__map(lambda file: self.__copy_file(file, file in copy_files), files)
+        except OSError as e:
+            raise exceptions.TemplateCopierCopyFailedException(f"Error: Unable to copy template files: {e}")
+        return files
+
+    # Creates the directory tree and symlinks as it walks
+    # and adds the regular files it finds to files to be copied afterwards
+    def __copy_dir(self, relative_dir, files):
+        with self.os_dep.scandir(self.__source_path(relative_dir)) as entries:
+            entries = sorted(entries, key=lambda entry: entry.name)
+        for entry in entries:
+            if entry.name in SKIP_NAMES:
+                continue
+            relative_path = self.__join(relative_dir, entry.name)
+            if entry.is_symlink():
+                self.os_dep.symlink(self.os_dep.readlink(entry.path), self.__output_path(relative_path))
+            elif entry.is_dir():
+                self.os_dep.makedirs(self.__output_path(relative_path), exist_ok=True)
+                self.__copy_dir(relative_path, files)
+            else:
+                files.append(relative_path)
+
+    def __copy_file(self, file, must_copy):
+        source = self.__source_path(file)
+        output = self.__output_path(file)
+        if not must_copy and self.mode == self.HARDLINK_MODE:
+            try:
+                self.os_dep.link(source, output)
+                return
+            except OSError:
+                # Crossing filesystems, fall back to a copy
+                pass
+        with self.open_dep(source, 'rb') as source_file, self.open_dep(output, 'wb') as output_file:
+            if not must_copy and self.mode == self.REFLINK_MODE and self.__reflink(source_file, output_file):
+                pass
+            else:
+                self.__copy_bytes(source_file, output_file)
+        self.os_dep.chmod(output, stat.S_IMODE(self.os_dep.stat(source).st_mode))
+
+    def __reflink(self, source_file, output_file):
+        try:
+            fcntl.ioctl(output_file.fileno(), self.FICLONE, source_file.fileno())
+            return True
+        except OSError:
+            # The filesystem doesn't support reflinks
+            return False
+
+    # Let the kernel move the bytes where it can, falling back to
+    # a plain userspace copy
+    def __copy_bytes(self, source_file, output_file):
+        source_fd = source_file.fileno()
+        output_fd = output_file.fileno()
+        for kernel_copy in [self.__copy_file_range, self.__sendfile]:
+            try:
+                kernel_copy(source_fd, output_fd)
+                return
+            except (AttributeError, OSError):
+                # Not supported here, rewind anything partially copied
+                source_file.seek(0)
+                output_file.seek(0)
+                output_file.truncate()
+        shutil.copyfileobj(source_file, output_file, self.CHUNK_SIZE)
+
+    def __copy_file_range(self, source_fd, output_fd):
+        while self.os_dep.copy_file_range(source_fd, output_fd, self.CHUNK_SIZE) > 0:
+            pass
+
+    def __sendfile(self, source_fd, output_fd):
+        offset = 0
+        while True:
+            sent = self.os_dep.sendfile(output_fd, source_fd, offset, self.CHUNK_SIZE)
+            if sent == 0:
+                break
+            offset += sent
+
+    def __map(self, func, items):
+        if self.jobs <= 1 or len(items) <= 1:
+            return list(map(func, items))
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            return list(executor.map(func, items))
+
+    def __source_path(self, relative_path):
+        return self.__join(self.source_dir, relative_path)
+
+    def __output_path(self, relative_path):
+        return self.__join(self.output_dir, relative_path)
+
+    def __join(self, directory, name):
+        if not directory:
+            return name
+        if not name:
+            return directory
+        return directory + '/' + name
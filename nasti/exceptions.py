@@ -72,4 +72,69 @@ class HooksScriptNotFound(Exception):
 class HooksScriptExecutionFailed(Exception):
     pass
 class HooksCleanupFailed(Exception):
-    pass
\ No newline at end of file
+    pass
+
+class TemplateCopierUnknownModeException(Exception):
+    pass
+
+class TemplateCopierCopyFailedException(Exception):
+    pass
+
+class GitMirrorCacheDirCreationException(Exception):
+    pass
+
+class GitMirrorCacheCloneException(Exception):
+    pass
+
+class GitHandlerInvalidSourceException(Exception):
+    pass
+
+class GitHandlerSubdirNotFoundException(Exception):
+    pass
+
+class ArchiveHandlerSourceNotFileException(Exception):
+    pass
+
+class ArchiveHandlerTmpDirCreationException(Exception):
+    pass
+
+class ArchiveHandlerNastiFileNotFoundException(Exception):
+    pass
+
+class ArchiveHandlerUnsafeEntryException(Exception):
+    pass
+
+class ArchiveHandlerUnsupportedFormatException(Exception):
+    pass
+
+class ArchiveHandlerUnsupportedEntryException(Exception):
+    pass
+
+class NastiOutputDirCreationException(Exception):
+    pass
+
+class NastiBatchAnswersInvalidException(Exception):
+    pass
+
+class NastiBatchOutputDirExistsException(Exception):
+    pass
+
+class NastiBatchInputRequiredException(Exception):
+    pass
+
+class NastiServerInvalidJobException(Exception):
+    pass
+
+class LockfileNotFoundException(Exception):
+    pass
+
+class LockfileInvalidException(Exception):
+    pass
+
+class GitWriterUnsupportedException(Exception):
+    pass
+
+# The exceptions above already say what went wrong, so code that wraps
+# other errors in one of them re-raises these as they are
+def is_nasti_exception(e):
+    return type(e).__module__ == __name__
@@ -0,0 +1,129 @@
+import os
+import fcntl
+import shlex
+import hashlib
+import nasti.exceptions as exceptions
+
+# GitMirrorCache keeps a bare mirror of every template repo NASTI has cloned
+# so later runs only fetch what changed instead of cloning from scratch.
+# Mirrors are keyed by remote URL and evicted least recently used first
+# once the cache grows past its size limit.
+class GitMirrorCache:
+    DEFAULT_MAX_SIZE = 1024 * 1024 * 1024
+    MIRROR_SUFFIX = ".git"
+    LOCK_SUFFIX = ".lock"
+
+    def __init__(self, cache_dir=None, max_size=DEFAULT_MAX_SIZE, os_dep=os):
+        # Dependency injection
+        self.os_dep = os_dep
+        # Hooks change the working directory, which mustn't move the cache
+        self.cache_dir = self.os_dep.path.abspath(cache_dir) if cache_dir else self.default_cache_dir()
+        self.max_size = max_size
+
+    # The cache lives in the user's cache directory unless told otherwise
+    def default_cache_dir(self):
+        cache_home = self.os_dep.environ.get("XDG_CACHE_HOME") or self.os_dep.path.expanduser("~/.cache")
+        return cache_home + "/nasti/git"
+
+    # Clone the repo at url into dest_dir through the cache
+    # The mirror is created on first use and fetched on every use after that
+    # ref optionally picks the branch, tag or commit to check out and
+    # subdir limits the checkout to the files in that directory
+    def checkout(self, url, dest_dir, ref=None, subdir=None):
+        self.__create_cache_dir()
+        mirror_path = self.get_mirror_path(url)
+        with open(self.__get_lock_path(url), 'a') as lock:
+            # Only one process updates or clones from a mirror at a time
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.__update_mirror(url, mirror_path)
+            # A local clone hard links the mirror's objects, so it's cheap
+            if not self.__clone_mirror(mirror_path, dest_dir, ref, subdir):
+                raise exceptions.GitMirrorCacheCloneException(f"Error: Unable to clone {url} from the cache.")
+            # Record when the mirror was last used for eviction
+            self.os_dep.utime(lock.name)
+        self.evict()
+
+    def get_mirror_path(self, url):
+        return self.cache_dir + "/" + self.__get_key(url) + self.MIRROR_SUFFIX
+
+    # Remove the least recently used mirrors until the cache fits in max_size
+    # The mirror that was used most recently is always kept
+    # Mirrors another process is using are skipped
+    def evict(self):
+        mirrors = self.get_mirrors()
+        total_size = sum(size for _, _, size in mirrors)
+        for mirror_path, _, size in mirrors[:-1]:
+            if total_size <= self.max_size:
+                break
+            if self.__remove_mirror(mirror_path):
+                total_size -= size
+
+    # Returns a list of (mirror path, last used time, size in bytes)
+    # ordered from least to most recently used
+    def get_mirrors(self):
+        if not self.os_dep.path.isdir(self.cache_dir):
+            return []
+        mirrors = []
+        for name in self.os_dep.listdir(self.cache_dir):
+            if not name.endswith(self.MIRROR_SUFFIX):
+                continue
+            mirror_path = self.cache_dir + "/" + name
+            lock_path = mirror_path[:-len(self.MIRROR_SUFFIX)] + self.LOCK_SUFFIX
+            last_used = self.os_dep.path.getmtime(lock_path) if self.os_dep.path.exists(lock_path) else 0
+            mirrors.append((mirror_path, last_used, self.__get_dir_size(mirror_path)))
+        mirrors.sort(key=lambda mirror: mirror[1])
+        return mirrors
+
+    def __update_mirror(self, url, mirror_path):
+        if self.os_dep.path.isdir(mirror_path):
+            # Fetch only what changed since the last run
+            # If the remote can't be reached the cached mirror is used as is
+            self.__git(f"--git-dir={shlex.quote(mirror_path)} fetch -q --prune origin")
+            return
+        if self.__git(f"clone -q --mirror {shlex.quote(url)} {shlex.quote(mirror_path)}") != 0:
+            # Don't leave a half cloned mirror behind
+            self.os_dep.system(f"rm -rf {shlex.quote(mirror_path)}")
+            raise exceptions.GitMirrorCacheCloneException(f"Error: Unable to mirror {url} into the cache.")
+
+    def __clone_mirror(self, mirror_path, dest_dir, ref, subdir):
+        if self.__git(f"clone -q --no-checkout {shlex.quote(mirror_path)} {shlex.quote(dest_dir)}") != 0:
+            return False
+        dest_git = f"-C {shlex.quote(dest_dir)}"
+        if subdir and self.__git(f"{dest_git} sparse-checkout set --no-cone {shlex.quote('/' + subdir + '/')}") != 0:
+            return False
+        ref_arg = shlex.quote(ref) if ref else ""
+        return self.__git(f"{dest_git} checkout -q {ref_arg}") == 0
+
+    def __remove_mirror(self, mirror_path):
+        lock_path = mirror_path[:-len(self.MIRROR_SUFFIX)] + self.LOCK_SUFFIX
+        with open(lock_path, 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return False
+            self.os_dep.system(f"rm -rf {shlex.quote(mirror_path)}")
+        # The lock file is left in place in case another process is
+        # already waiting on it
+        return True
+
+    def __get_dir_size(self, path):
+        size = 0
+        for dir_path, _, files in self.os_dep.walk(path):
+            for file in files:
+                size += self.os_dep.path.getsize(dir_path + "/" + file)
+        return size
+
+    def __create_cache_dir(self):
+        try:
+            self.os_dep.makedirs(self.cache_dir, exist_ok=True)
+        except OSError as e:
+            raise exceptions.GitMirrorCacheDirCreationException(f"Error: Unable to create cache directory {self.cache_dir}: {e}")
+
+    def __get_key(self, url):
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def __get_lock_path(self, url):
+        return self.cache_dir + "/" + self.__get_key(url) + self.LOCK_SUFFIX
+
+    def __git(self, args):
+        return self.os_dep.system(f"git {args}")
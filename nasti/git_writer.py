@@ -0,0 +1,459 @@
+import os
+import re
+import stat
+import time
+import zlib
+import struct
+import hashlib
+import nasti.exceptions as exceptions
+
+# GitRepoWriter creates a git repo with a single commit of everything in a
+# directory without running git. Every file is read once, hashed and
+# compressed into one packfile, then the trees, the commit, the index and
+# the branch are written next to it. The result is the same repo
+# git init && git add -A && git commit would make, without git having to
+# read every file NASTI just wrote again.
+#
+# Anything the writer can't do exactly like git raises
+# GitWriterUnsupportedException before the repo is created so the caller
+# can fall back to running git: identities or settings that come from
+# included config files, signed commits, hooks, template directories,
+# .gitattributes and nested repos.
+class GitRepoWriter:
+    DEFAULT_BRANCH = "master"
+
+    # Files are read this many bytes at a time
+    READ_SIZE = 1024 * 1024
+
+    # The same level git uses for loose objects, packs are recompressed
+    # whenever the user runs git gc
+    COMPRESSION_LEVEL = 1
+
+    # repo_dir is the directory the repo is created in
+    # environ and home default to the process environment and home
+    # directory and are used to find the user's git config and identity
+    def __init__(self, repo_dir, os_dep=os, open_dep=open, environ=None, home=None):
+        # Dependency injection
+        self.os_dep = os_dep
+        self.open_dep = open_dep
+        self.repo_dir = repo_dir
+        self.environ = environ if environ is not None else self.os_dep.environ
+        self.home = home if home else self.os_dep.path.expanduser("~")
+
+    # Create the repo and commit every file in repo_dir that isn't ignored
+    # Returns the hex id of the commit
+    def commit(self, message):
+        config = self.read_config()
+        self.__check_config(config)
+        author = self.__get_identity(config, "AUTHOR")
+        committer = self.__get_identity(config, "COMMITTER")
+        ignore_rules = IgnoreRules()
+        excludes_file = config.get("core.excludesfile") or self.__xdg_config_home() + "/git/ignore"
+        ignore_rules.add_file(self.os_dep.path.expanduser(excludes_file), "", self.os_dep, self.open_dep)
+        files = []
+        self.__walk("", ignore_rules, files)
+        files.sort(key=lambda file: file[0].encode())
+
+        git_dir = self.repo_dir + "/.git"
+        branch = config.get("init.defaultbranch") or self.DEFAULT_BRANCH
+        self.__init_git_dir(git_dir, branch)
+        pack = PackWriter(git_dir + "/objects/pack", self.os_dep, self.open_dep, self.COMPRESSION_LEVEL)
+        try:
+            entries = []
+            for path, st in files:
+                entries.append((path, st, self.__add_blob(pack, path, st)))
+            tree = self.__add_trees(pack, entries)
+            commit = pack.add_object("commit", self.__format_commit(tree, author, committer, message))
+            pack.finish()
+        except Exception:
+            pack.abort()
+            raise
+        self.__write_index(git_dir, entries)
+        self.__write_file(git_dir + "/refs/heads/" + branch, (commit + "\n").encode())
+        return commit
+
+    # Returns the settings the writer cares about from the user's git config
+    # as a dictionary of lower case "section.key" to value. Later files
+    # override earlier ones the same way they do for git
+    def read_config(self):
+        config = {}
+        for path in self.__config_files():
+            if not self.os_dep.path.isfile(path):
+                continue
+            with self.open_dep(path, 'r', errors='replace') as f:
+                config.update(parse_git_config(f.read()))
+        return config
+
+    def __config_files(self):
+        files = []
+        if not self.environ.get("GIT_CONFIG_NOSYSTEM"):
+            files.append("/etc/gitconfig")
+        if self.environ.get("GIT_CONFIG_GLOBAL"):
+            files.append(self.environ["GIT_CONFIG_GLOBAL"])
+        else:
+            files.append(self.__xdg_config_home() + "/git/config")
+            files.append(self.home + "/.gitconfig")
+        return files
+
+    def __xdg_config_home(self):
+        return self.environ.get("XDG_CONFIG_HOME") or self.home + "/.config"
+
+    def __check_config(self, config):
+        for key in self.environ:
+            if key.startswith("GIT_CONFIG") and key not in ("GIT_CONFIG_NOSYSTEM", "GIT_CONFIG_GLOBAL"):
+                raise exceptions.GitWriterUnsupportedException(f"Error: {key} is set.")
+        if config.get("include"):
+            raise exceptions.GitWriterUnsupportedException("Error: The git config includes other files.")
+        if parse_git_bool(config.get("commit.gpgsign")):
+            raise exceptions.GitWriterUnsupportedException("Error: Commits are signed.")
+        if config.get("core.hookspath"):
+            raise exceptions.GitWriterUnsupportedException("Error: Commits run hooks.")
+        # Templates can add hooks, config and excludes to every new repo
+        if config.get("init.templatedir") or self.environ.get("GIT_TEMPLATE_DIR"):
+            raise exceptions.GitWriterUnsupportedException("Error: New repos are created from a git template directory.")
+        if config.get("core.autocrlf") not in (None, "false") or config.get("core.eol"):
+            raise exceptions.GitWriterUnsupportedException("Error: Line endings are converted.")
+
+    # Identities come from the environment first, then the config, like git
+    def __get_identity(self, config, role):
+        name = self.environ.get(f"GIT_{role}_NAME") or config.get("user.name")
+        email = self.environ.get(f"GIT_{role}_EMAIL") or self.environ.get("EMAIL") or config.get("user.email")
+        if not name or not email:
+            raise exceptions.GitWriterUnsupportedException("Error: No git identity is configured.")
+        return f"{name} <{email}>"
+
+    def __walk(self, relative_dir, ignore_rules, files):
+        full_dir = self.repo_dir + "/" + relative_dir if relative_dir else self.repo_dir
+        with self.os_dep.scandir(full_dir) as entries:
+            entries = list(entries)
+        names = {entry.name for entry in entries}
+        if ".gitattributes" in names:
+            raise exceptions.GitWriterUnsupportedException(f"Error: {full_dir}/.gitattributes can change what's committed.")
+        if relative_dir and ".git" in names:
+            raise exceptions.GitWriterUnsupportedException(f"Error: {full_dir} is a nested git repo.")
+        if ".gitignore" in names:
+            ignore_rules = ignore_rules.child()
+            ignore_rules.add_file(full_dir + "/.gitignore", relative_dir, self.os_dep, self.open_dep)
+        for entry in entries:
+            if entry.name == ".git":
+                continue
+            relative_path = relative_dir + "/" + entry.name if relative_dir else entry.name
+            is_dir = entry.is_dir(follow_symlinks=False)
+            if ignore_rules.is_ignored(relative_path, is_dir):
+                continue
+            if is_dir:
+                self.__walk(relative_path, ignore_rules, files)
+                continue
+            st = entry.stat(follow_symlinks=False)
+            if stat.S_ISREG(st.st_mode) or stat.S_ISLNK(st.st_mode):
+                files.append((relative_path, st))
+
+    def __add_blob(self, pack, path, st):
+        full_path = self.repo_dir + "/" + path
+        if stat.S_ISLNK(st.st_mode):
+            return pack.add_object("blob", self.os_dep.fsencode(self.os_dep.readlink(full_path)))
+        with self.open_dep(full_path, 'rb') as f:
+            if st.st_size <= self.READ_SIZE:
+                return pack.add_object("blob", f.read())
+            return pack.add_stream("blob", st.st_size, iter(lambda: f.read(self.READ_SIZE), b""))
+
+    # Builds a tree for every directory, deepest first
+    # Returns the id of the root tree
+    def __add_trees(self, pack, entries):
+        # Maps a directory to its (name, mode, binary id) entries
+        dirs = {"": []}
+        for path, st, object_id in entries:
+            parent, _, name = path.rpartition("/")
+            self.__add_dir(dirs, parent)
+            dirs[parent].append((name, get_file_mode(st.st_mode), bytes.fromhex(object_id)))
+        tree_ids = {}
+        for directory in sorted(dirs, key=lambda directory: directory.count("/") if directory else -1, reverse=True):
+            tree_entries = dirs[directory]
+            tree_entries.sort(key=lambda entry: entry[0].encode() + (b"/" if entry[1] == "40000" else b""))
+            data = b"".join(mode.encode() + b" " + name.encode() + b"\0" + object_id for name, mode, object_id in tree_entries)
+            tree_ids[directory] = pack.add_object("tree", data)
+            if directory:
+                parent, _, name = directory.rpartition("/")
+                dirs[parent].append((name, "40000", bytes.fromhex(tree_ids[directory])))
+        return tree_ids[""]
+
+    def __add_dir(self, dirs, directory):
+        while directory not in dirs:
+            dirs[directory] = []
+            directory = directory.rpartition("/")[0]
+
+    def __format_commit(self, tree, author, committer, message):
+        timestamp = int(time.time())
+        offset = time.localtime(timestamp).tm_gmtoff // 60
+        date = "%d %s%02d%02d" % (timestamp, "-" if offset < 0 else "+", abs(offset) // 60, abs(offset) % 60)
+        return f"tree {tree}\nauthor {author} {date}\ncommitter {committer} {date}\n\n{message}\n".encode()
+
+    def __init_git_dir(self, git_dir, branch):
+        for directory in ("objects/info", "objects/pack", "refs/heads", "refs/tags", "info"):
+            self.os_dep.makedirs(git_dir + "/" + directory, exist_ok=True)
+        self.__write_file(git_dir + "/HEAD", f"ref: refs/heads/{branch}\n".encode())
+        self.__write_file(git_dir + "/config", b"[core]\n\trepositoryformatversion = 0\n\tfilemode = true\n\tbare = false\n\tlogallrefupdates = true\n")
+        self.__write_file(git_dir + "/description", b"Unnamed repository; edit this file 'description' to name the repository.\n")
+
+    # Index version 2 with one entry per file and no extensions
+    def __write_index(self, git_dir, entries):
+        data = [b"DIRC" + struct.pack(">II", 2, len(entries))]
+        for path, st, object_id in entries:
+            name = path.encode()
+            entry = struct.pack(
+                ">10I20sH",
+                st.st_ctime_ns // 1000000000 & 0xFFFFFFFF, st.st_ctime_ns % 1000000000,
+                st.st_mtime_ns // 1000000000 & 0xFFFFFFFF, st.st_mtime_ns % 1000000000,
+                st.st_dev & 0xFFFFFFFF, st.st_ino & 0xFFFFFFFF,
+                int(get_file_mode(st.st_mode), 8),
+                st.st_uid & 0xFFFFFFFF, st.st_gid & 0xFFFFFFFF, st.st_size & 0xFFFFFFFF,
+                bytes.fromhex(object_id), min(len(name), 0xFFF),
+            ) + name
+            # Entries are NUL padded to a multiple of 8 bytes
+            data.append(entry + b"\0" * (8 - len(entry) % 8))
+        data = b"".join(data)
+        self.__write_file(git_dir + "/index", data + hashlib.sha1(data).digest())
+
+    def __write_file(self, path, data):
+        self.os_dep.makedirs(self.os_dep.path.dirname(path), exist_ok=True)
+        with self.open_dep(path, 'wb') as f:
+            f.write(data)
+
+# PackWriter writes objects into a single version 2 packfile and its index
+# Objects are written whole, without deltas, and each one is only written once
+class PackWriter:
+    TYPES = {"commit": 1, "tree": 2, "blob": 3}
+
+    def __init__(self, pack_dir, os_dep=os, open_dep=open, compression_level=zlib.Z_DEFAULT_COMPRESSION):
+        # Dependency injection
+        self.os_dep = os_dep
+        self.open_dep = open_dep
+        self.pack_dir = pack_dir
+        self.compression_level = compression_level
+        self.temp_path = pack_dir + "/tmp_pack.nasti"
+        self.file = self.open_dep(self.temp_path, 'w+b')
+        # The object count is filled in once every object is written
+        self.file.write(b"PACK" + struct.pack(">II", 2, 0))
+        # Maps a binary object id to its (offset, crc32)
+        self.objects = {}
+
+    # Returns the hex id of the object
+    def add_object(self, object_type, data):
+        return self.add_stream(object_type, len(data), [data])
+
+    # The same as add_object for an iterable of byte chunks
+    # size has to be the total size of the chunks
+    def add_stream(self, object_type, size, chunks):
+        offset = self.file.tell()
+        hasher = hashlib.sha1(b"%s %d\0" % (object_type.encode(), size))
+        compressor = zlib.compressobj(self.compression_level)
+        header = self.__object_header(self.TYPES[object_type], size)
+        crc = zlib.crc32(header)
+        self.file.write(header)
+        for chunk in chunks:
+            hasher.update(chunk)
+            compressed = compressor.compress(chunk)
+            crc = zlib.crc32(compressed, crc)
+            self.file.write(compressed)
+        compressed = compressor.flush()
+        crc = zlib.crc32(compressed, crc)
+        self.file.write(compressed)
+        object_id = hasher.digest()
+        if object_id in self.objects:
+            # The same contents are already in the pack
+            self.file.seek(offset)
+            self.file.truncate()
+        else:
+            self.objects[object_id] = (offset, crc)
+        return object_id.hex()
+
+    # Fills in the header, checksums the pack and writes its index
+    def finish(self):
+        self.file.seek(8)
+        self.file.write(struct.pack(">I", len(self.objects)))
+        self.file.seek(0)
+        hasher = hashlib.sha1()
+        for chunk in iter(lambda: self.file.read(GitRepoWriter.READ_SIZE), b""):
+            hasher.update(chunk)
+        checksum = hasher.digest()
+        self.file.write(checksum)
+        self.file.close()
+        name = self.pack_dir + "/pack-" + checksum.hex()
+        index = self.__format_index(checksum)
+        with self.open_dep(name + ".idx", 'wb') as f:
+            f.write(index)
+        self.os_dep.replace(self.temp_path, name + ".pack")
+
+    def abort(self):
+        self.file.close()
+        if self.os_dep.path.exists(self.temp_path):
+            self.os_dep.remove(self.temp_path)
+
+    # Index version 2, offsets past 2GB go in the large offset table
+    def __format_index(self, checksum):
+        object_ids = sorted(self.objects)
+        fanout = [0] * 256
+        for object_id in object_ids:
+            fanout[object_id[0]] += 1
+        for i in range(1, 256):
+            fanout[i] += fanout[i - 1]
+        offsets = []
+        large_offsets = []
+        for object_id in object_ids:
+            offset = self.objects[object_id][0]
+            if offset < 0x80000000:
+                offsets.append(offset)
+            else:
+                offsets.append(0x80000000 | len(large_offsets))
+                large_offsets.append(offset)
+        data = b"".join([
+            b"\xfftOc" + struct.pack(">I", 2),
+            struct.pack(">256I", *fanout),
+            b"".join(object_ids),
+            struct.pack(f">{len(object_ids)}I", *(self.objects[object_id][1] for object_id in object_ids)),
+            struct.pack(f">{len(offsets)}I", *offsets),
+            struct.pack(f">{len(large_offsets)}Q", *large_offsets),
+            checksum,
+        ])
+        return data + hashlib.sha1(data).digest()
+
+    # The type and size of an object packed into a variable length integer
+    def __object_header(self, object_type, size):
+        byte = (object_type << 4) | (size & 0x0F)
+        size >>= 4
+        header = bytearray()
+        while size:
+            header.append(byte | 0x80)
+            byte = size & 0x7F
+            size >>= 7
+        header.append(byte)
+        return bytes(header)
+
+# The mode git records for a file
+def get_file_mode(st_mode):
+    if stat.S_ISLNK(st_mode):
+        return "120000"
+    if st_mode & stat.S_IXUSR:
+        return "100755"
+    return "100644"
+
+# Returns a dictionary of lower case "section.key" to value for a git
+# config file. Subsections are kept in the key, any include or includeIf
+# section is recorded as "include"
+def parse_git_config(text):
+    config = {}
+    section = ""
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line[0] in "#;":
+            continue
+        if line.startswith("["):
+            header = line[1:line.index("]")] if "]" in line else line[1:]
+            name, _, subsection = header.partition(" ")
+            section = name.lower()
+            if section in ("include", "includeif"):
+                config["include"] = "true"
+            if subsection:
+                section += "." + subsection.strip().strip('"')
+            continue
+        key, has_value, value = line.partition("=")
+        value = value.strip() if has_value else "true"
+        # Strip a trailing comment unless it's quoted
+        if not value.startswith('"'):
+            value = re.split(r"\s[#;]", value)[0].strip()
+        config[section + "." + key.strip().lower()] = value.strip('"')
+    return config
+
+def parse_git_bool(value):
+    return value is not None and value.lower() in ("true", "yes", "on", "1")
+
+# IgnoreRules matches paths against .gitignore patterns the same way git does
+# Each directory with a .gitignore gets a child of its parent's rules, and
+# rules in deeper directories take precedence
+class IgnoreRules:
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        # Ordered list of (base directory, regex, negated, directories only)
+        self.patterns = []
+
+    def child(self):
+        return IgnoreRules(self)
+
+    def add_file(self, path, base_dir, os_dep=os, open_dep=open):
+        if not os_dep.path.isfile(path):
+            return
+        with open_dep(path, 'r', errors='replace') as f:
+            for line in f.read().splitlines():
+                self.add_pattern(line, base_dir)
+
+    def add_pattern(self, line, base_dir=""):
+        line = line.rstrip()
+        if not line or line.startswith("#"):
+            return
+        negated = line.startswith("!")
+        if negated:
+            line = line[1:]
+        elif line.startswith("\\"):
+            line = line[1:]
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        if not line:
+            return
+        # A pattern with a slash in it is relative to its .gitignore,
+        # one without matches a name in any directory below it
+        anchored = "/" in line
+        regex = glob_to_regex(line.lstrip("/"))
+        if not anchored:
+            regex = "(?:.*/)?" + regex
+        self.patterns.append((base_dir, re.compile(regex, re.DOTALL), negated, dir_only))
+
+    # The last pattern that matches decides, patterns in deeper directories first
+    def is_ignored(self, path, is_dir):
+        rules = self
+        while rules:
+            for base_dir, regex, negated, dir_only in reversed(rules.patterns):
+                if dir_only and not is_dir:
+                    continue
+                if base_dir:
+                    if not path.startswith(base_dir + "/"):
+                        continue
+                    relative_path = path[len(base_dir) + 1:]
+                else:
+                    relative_path = path
+                if regex.fullmatch(relative_path):
+                    return not negated
+            rules = rules.parent
+        return False
+
+# Converts a .gitignore glob into a regular expression
+def glob_to_regex(pattern):
+    regex = ""
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i) and (i == 0 or pattern[i - 1] == "/"):
+            regex += "(?:.*/)?"
+            i += 3
+        elif pattern.startswith("**", i) and i + 2 == len(pattern) and (i == 0 or pattern[i - 1] == "/"):
+            regex += ".*"
+            i += 2
+        elif pattern[i] == "*":
+            regex += "[^/]*"
+            i += 1
+        elif pattern[i] == "?":
+            regex += "[^/]"
+            i += 1
+        elif pattern[i] == "[" and "]" in pattern[i + 2:]:
+            end = pattern.index("]", i + 2)
+            group = pattern[i + 1:end]
+            if group.startswith("!"):
+                group = "^" + group[1:]
+            regex += "[" + group.replace("\\", "\\\\") + "]"
+            i = end + 1
+        elif pattern[i] == "\\" and i + 1 < len(pattern):
+            regex += re.escape(pattern[i + 1])
+            i += 2
+        else:
+            regex += re.escape(pattern[i])
+            i += 1
+    return regex
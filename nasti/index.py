@@ -0,0 +1,127 @@
+import os
+import json
+import time
+
+# TemplateIndex remembers which mutation tokens each file in a template
+# contains so validate and find only have to read the files that changed
+# since the last run. It's kept in .nasti-cache/index.json inside the
+# template, which has its own .gitignore so it's never committed.
+#
+# A file is looked up by its mtime, size and inode. Any change to those
+# and it's read again. Entries record every token the file was searched
+# for, so removing or renaming back to an earlier token never causes a
+# read. Adding a new token reads the files once more.
+#
+# Files modified within RACY_NS of being indexed aren't recorded, because
+# the file could change again within the filesystem's timestamp
+# resolution without its mtime changing.
+class TemplateIndex:
+    DIR_NAME = ".nasti-cache"
+    FILE_NAME = "index.json"
+    VERSION = 1
+    RACY_NS = 2 * 1000 * 1000 * 1000
+
+    def __init__(self, template_dir, os_dep=os, open_dep=open):
+        # Dependency injection
+        self.os_dep = os_dep
+        self.open_dep = open_dep
+        self.template_dir = template_dir
+        self.path = template_dir + "/" + self.DIR_NAME + "/" + self.FILE_NAME
+        # Maps a file relative to the template to its entry
+        self.entries = {}
+        self.changed = False
+        self.loaded = False
+
+    # An index that's missing, unreadable or from another version is
+    # treated as empty
+    def load(self):
+        if self.loaded:
+            return
+        self.loaded = True
+        if not self.os_dep.path.isfile(self.path):
+            return
+        try:
+            with self.open_dep(self.path, 'r') as f:
+                data = json.load(f)
+            if data["version"] == self.VERSION:
+                self.entries = data["files"]
+        except (OSError, ValueError, KeyError, TypeError):
+            self.entries = {}
+
+    # Written to a temporary file first so a run that's interrupted or
+    # another run at the same time never leaves a broken index
+    def save(self):
+        if not self.changed:
+            return
+        cache_dir = self.template_dir + "/" + self.DIR_NAME
+        self.os_dep.makedirs(cache_dir, exist_ok=True)
+        gitignore_path = cache_dir + "/.gitignore"
+        if not self.os_dep.path.exists(gitignore_path):
+            with self.open_dep(gitignore_path, 'w') as f:
+                f.write("*\n")
+        temp_path = f"{self.path}.{self.os_dep.getpid()}.tmp"
+        with self.open_dep(temp_path, 'w') as f:
+            f.write(json.dumps({"version": self.VERSION, "files": self.entries}, separators=(",", ":")))
+        self.os_dep.replace(temp_path, self.path)
+        self.changed = False
+
+    # Returns the stat of a file to look it up and record it by
+    def stat(self, file):
+        return self.os_dep.stat(self.template_dir + "/" + file)
+
+    # Returns the tokens found in a file, None if the file is binary and
+    # binary files are skipped, or False if the file has to be read
+    # tokens is the set of tokens being searched for
+    # If strict is set the file must have been seen to decode as text
+    def lookup(self, file, st, tokens, skip_binary=False, strict=False):
+        entry = self.entries.get(file)
+        if entry is None or not self.__is_fresh(entry, st):
+            return False
+        if skip_binary and entry["binary"]:
+            return None
+        if strict and not entry.get("decodes"):
+            return False
+        if not tokens.issubset(entry["searched"]):
+            return False
+        return tokens.intersection(entry["found"])
+
+    # Records the tokens found in a file that was searched for tokens
+    # found is None if the file was found to be binary and not searched
+    # decodes is set if the file was also checked to decode as text
+    def update(self, file, st, tokens, found, decodes=False):
+        if time.time_ns() - st.st_mtime_ns < self.RACY_NS:
+            self.__remove(file)
+            return
+        entry = self.entries.get(file)
+        if entry is None or not self.__is_fresh(entry, st):
+            entry = {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "ino": st.st_ino, "binary": False, "decodes": False, "searched": [], "found": []}
+        if decodes:
+            entry["decodes"] = True
+        if found is None:
+            entry["binary"] = True
+        else:
+            # Tokens searched for before are still known for an unchanged file
+            entry["searched"] = sorted(set(entry["searched"]) | tokens)
+            entry["found"] = sorted((set(entry["found"]) - tokens) | found)
+        self.entries[file] = entry
+        self.changed = True
+
+    # Forgets every file that isn't in files
+    def prune(self, files):
+        files = set(files)
+        for file in [file for file in self.entries if file not in files]:
+            self.__remove(file)
+
+    def __remove(self, file):
+        if file in self.entries:
+            del self.entries[file]
+            self.changed = True
+
+    def __is_fresh(self, entry, st):
+        return entry["mtime_ns"] == st.st_mtime_ns and entry["size"] == st.st_size and entry["ino"] == st.st_ino
+
+# Directories in a template that aren't part of it, its git history and its
+# scan index. They're never copied, extracted, hashed, reported or watched,
+# so a template turns out the same project whether or not it has been
+# cloned or indexed, and NASTI writing its index doesn't set off a check.
+SKIP_NAMES = [".git", TemplateIndex.DIR_NAME]
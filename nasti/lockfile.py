@@ -0,0 +1,127 @@
+import os
+import json
+import hashlib
+import nasti.exceptions as exceptions
+from nasti.index import SKIP_NAMES
+
+# Lockfile records how a project was generated so it can be updated when its
+# template changes without generating it again from scratch. It's written to
+# the root of the project and holds:
+#   source    the template the project came from
+#   revision  the template's git commit, or a hash of its archive
+#   answers   the value of every global and mutation
+#   files     for every template file, a hash of its inputs, the template
+#             file and the replacements applied to it, and a hash of what
+#             was written to the project
+# A file whose inputs hash the same as last time doesn't need writing again.
+# Answers are stored as they were given, in plain text, and recording one
+# reads every file in the project, which is why projects only get one
+# when asked for.
+class Lockfile:
+    FILE_NAME = ".nasti.lock"
+    VERSION = 1
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, source, revision=None, answers={}, files=None):
+        self.source = source
+        self.revision = revision
+        self.answers = answers
+        # Maps a template file to {"input": hash, "output": hash}
+        # output is None when the file isn't in the project
+        self.files = files if files is not None else {}
+
+    def add_file(self, file, input_hash, output_hash):
+        self.files[file] = {"input": input_hash, "output": output_hash}
+
+    def get_file(self, file):
+        return self.files.get(file)
+
+    # Records a freshly generated project
+    # template_files yields (file, mode, read) for every file in the
+    # template. Files no mutation changes are the same in the template and
+    # the project unless a hook ran, so only their copy in the project is read
+    def record(self, plan, template_files, output_dir, read_template=False, os_dep=os, open_dep=open):
+        for file, _, read in template_files:
+            replacements = plan.files.get(file, [])
+            output_path = output_dir + "/" + file
+            if not os_dep.path.isfile(output_path) or os_dep.path.islink(output_path):
+                # A hook removed it
+                self.add_file(file, hash_input(read(), replacements), None)
+                continue
+            output_hasher = hash_file(output_path, open_dep)
+            if replacements or read_template:
+                input_hash = hash_input(read(), replacements)
+            else:
+                input_hash = get_input_hash(output_hasher, replacements)
+            self.add_file(file, input_hash, output_hasher.hexdigest())
+
+    def save(self, project_dir, os_dep=os, open_dep=open):
+        path = project_dir + "/" + self.FILE_NAME
+        tmp_path = path + ".tmp"
+        with open_dep(tmp_path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2, sort_keys=True)
+            f.write("\n")
+        os_dep.replace(tmp_path, path)
+
+    def to_dict(self):
+        return {
+            "version": self.VERSION,
+            "source": self.source,
+            "revision": self.revision,
+            "answers": self.answers,
+            "files": self.files,
+        }
+
+    @classmethod
+    def load(cls, project_dir, os_dep=os, open_dep=open):
+        path = project_dir + "/" + cls.FILE_NAME
+        if not os_dep.path.isfile(path):
+            raise exceptions.LockfileNotFoundException(f"Error: {project_dir} has no {cls.FILE_NAME}, it wasn't generated by NASTI or was generated without one.")
+        try:
+            with open_dep(path, 'r') as f:
+                data = json.load(f)
+            if data["version"] != cls.VERSION:
+                raise exceptions.LockfileInvalidException(f"Error: {path} is version {data['version']}, expected {cls.VERSION}.")
+            return cls(data["source"], data["revision"], data["answers"], data["files"])
+        except (ValueError, KeyError, TypeError) as e:
+            raise exceptions.LockfileInvalidException(f"Error: Unable to read {path}: {e}")
+
+# Yields (file, mode, read) for every file in a template directory in order,
+# read returns the file's bytes
+# The nastifile, symlinks and SKIP_NAMES are left out
+def walk_template_dir(source_dir, os_dep=os, open_dep=open):
+    for dir_path, dir_names, file_names in os_dep.walk(source_dir):
+        dir_names[:] = sorted(name for name in dir_names if name not in SKIP_NAMES)
+        for name in sorted(file_names):
+            full_path = dir_path + "/" + name
+            file = os_dep.path.relpath(full_path, source_dir)
+            if file == "nasti.yaml" or os_dep.path.islink(full_path):
+                continue
+            yield file, os_dep.stat(full_path).st_mode & 0o777, lambda full_path=full_path: read_file(full_path, open_dep)
+
+def read_file(path, open_dep=open):
+    with open_dep(path, 'rb') as f:
+        return f.read()
+
+# Returns a sha256 hasher that has read the file at path
+def hash_file(path, open_dep=open):
+    hasher = hashlib.sha256()
+    with open_dep(path, 'rb') as f:
+        while chunk := f.read(Lockfile.CHUNK_SIZE):
+            hasher.update(chunk)
+    return hasher
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+# The inputs of a file are its contents in the template and the
+# (replace, value) pairs applied to it
+def hash_input(data, replacements):
+    return get_input_hash(hashlib.sha256(data), replacements)
+
+# Finishes an input hash from a hasher that has read the template file
+# The hasher is left as it was so it can still give the file's own hash
+def get_input_hash(content_hasher, replacements):
+    hasher = content_hasher.copy()
+    hasher.update(b"\0" + json.dumps([list(pair) for pair in replacements]).encode("utf-8"))
+    return hasher.hexdigest()
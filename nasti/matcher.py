@@ -0,0 +1,268 @@
+import re
+import codecs
+import locale
+
+# TokenMatcher finds every mutation replacement token in a single scan of
+# the text. All of the tokens are compiled once into a single literal
+# alternation so the scan runs inside the regex engine rather than once per
+# token in Python. Tokens are always matched literally, never as regexes.
+class TokenMatcher:
+    BYTE_ENCODINGS = ["utf-8", "ascii"]
+    # Bytes are checked this many at a time by check_decodes
+    DECODE_SIZE = 1024 * 1024
+
+    def __init__(self, tokens):
+        # Empty tokens can't be matched and duplicates add nothing
+        self.tokens = list(dict.fromkeys(token for token in tokens if token))
+        self.pattern = None
+        # Text this long can hold any token, streams keep this much
+        # between chunks so tokens split across chunks still match
+        self.max_len = max((len(token) for token in self.tokens), default=0)
+        if self.tokens:
+            # Longest tokens first so the longest token wins at a position
+            alternatives = sorted(self.tokens, key=len, reverse=True)
+            self.pattern = re.compile("|".join(re.escape(token) for token in alternatives))
+        # If two tokens can overlap each other one of them can hide the
+        # other from a single non-overlapping scan
+        self.overlapping = self.__tokens_can_overlap()
+        # If no two matches can ever overlap, including two of the same
+        # token, every match is found wherever a scan starts
+        self.matches_can_overlap = self.overlapping or any(has_border(token) for token in self.tokens)
+        # The tokens encoded the way files are decoded so files can be
+        # searched without decoding them, None when that isn't safe
+        self.encoding = codecs.lookup(locale.getpreferredencoding(False)).name
+        self.byte_tokens = self.__encode_tokens()
+        self.byte_pattern = None
+        if self.byte_tokens:
+            alternatives = sorted(self.byte_tokens, key=len, reverse=True)
+            self.byte_pattern = re.compile(b"|".join(re.escape(token) for token in alternatives))
+            self.byte_token_names = dict(zip(self.byte_tokens, self.tokens))
+
+    # Returns the set of tokens that appear in the text
+    def find(self, text):
+        if not self.pattern:
+            return set()
+        if self.overlapping:
+            return {token for token in self.tokens if token in text}
+        found = set()
+        for match in self.pattern.finditer(text):
+            found.add(match.group(0))
+            if len(found) == len(self.tokens):
+                break
+        return found
+
+    # Whether find_bytes can be used instead of find
+    def can_find_bytes(self):
+        return self.byte_tokens is not None
+
+    # Raises the UnicodeDecodeError reading the bytes as text would
+    # Searching bytes finds the tokens without decoding, this is for when
+    # a file also has to be readable as text
+    def check_decodes(self, data):
+        decoder = codecs.getincrementaldecoder(self.encoding)()
+        for start in range(0, len(data), self.DECODE_SIZE):
+            decoder.decode(data[start:start + self.DECODE_SIZE])
+        decoder.decode(b"", final=True)
+
+    # The same as find for the undecoded bytes of a file
+    # data can be anything bytes-like, including an mmap. Nothing is copied
+    # and the search stops as soon as every token has been found
+    def find_bytes(self, data):
+        if not self.byte_tokens:
+            return set()
+        if len(self.byte_tokens) == 1 or self.overlapping:
+            return {token for token, byte_token in zip(self.tokens, self.byte_tokens) if data.find(byte_token) != -1}
+        found = set()
+        for match in self.byte_pattern.finditer(data):
+            found.add(self.byte_token_names[match.group(0)])
+            if len(found) == len(self.tokens):
+                break
+        return found
+
+    # Replaces every token in the text with its value in a single scan
+    # values is a dictionary of token to replacement value
+    def replace(self, text, values):
+        if not self.pattern:
+            return text
+        # str.replace is the same for one token and much quicker
+        if len(self.tokens) == 1:
+            return text.replace(self.tokens[0], values[self.tokens[0]])
+        return self.pattern.sub(lambda match: values[match.group(0)], text)
+
+    # Returns the set of tokens that appear in an iterable of text chunks
+    # Stops reading chunks once every token has been found
+    def find_stream(self, chunks):
+        finder = StreamFinder(self)
+        for chunk in chunks:
+            finder.feed(chunk)
+            if len(finder.found) == len(self.tokens):
+                break
+        return finder.found
+
+    # The same as replace for an iterable of text chunks
+    # Yields the replaced text in chunks, joining them gives the same result
+    # as replacing the whole text at once. Only text that no later chunk can
+    # change is yielded, so at most a chunk and a token are held at a time
+    def replace_stream(self, chunks, values):
+        if not self.pattern:
+            yield from chunks
+            return
+        buffer = ""
+        for chunk in chunks:
+            buffer += chunk
+            # A match that starts a token's length from the end is final,
+            # anything after that might still become part of a longer match
+            safe_end = len(buffer) - self.max_len + 1
+            if safe_end <= 0:
+                continue
+            if self.matches_can_overlap:
+                output, position = self.__replace_until(buffer, values, safe_end)
+            else:
+                position = self.__get_cut(buffer, safe_end)
+                output = self.replace(buffer[:position], values)
+            buffer = buffer[position:]
+            if output:
+                yield output
+        if buffer:
+            yield self.replace(buffer, values)
+
+    # Where the text can be split so that no match is cut in two
+    # Only works when matches can't overlap, then the first match that
+    # runs past safe_end is the only one that can
+    def __get_cut(self, text, safe_end):
+        match = self.pattern.search(text, max(0, safe_end - self.max_len + 1))
+        if match and match.start() < safe_end:
+            return match.start()
+        return safe_end
+
+    # Replaces matches one at a time up to safe_end, the same way a single
+    # scan of the whole text would
+    # Returns the replaced text and the position it stopped at
+    def __replace_until(self, text, values, safe_end):
+        output = []
+        position = 0
+        while True:
+            match = self.pattern.search(text, position)
+            if not match or match.start() >= safe_end:
+                break
+            output.append(text[position:match.start()])
+            output.append(values[match.group(0)])
+            position = match.end()
+        if safe_end > position:
+            output.append(text[position:safe_end])
+            position = safe_end
+        return "".join(output), position
+
+    # Searching bytes finds the same tokens as searching the decoded text
+    # when the encoding is UTF-8 or ASCII, because no character's bytes can
+    # appear inside another's. Tokens with line breaks are left to the
+    # text search since reading text turns \r\n into \n
+    def __encode_tokens(self):
+        if self.encoding not in self.BYTE_ENCODINGS:
+            return None
+        if any("\r" in token or "\n" in token for token in self.tokens):
+            return None
+        return [token.encode(self.encoding) for token in self.tokens]
+
+    def __tokens_can_overlap(self):
+        for i, token in enumerate(self.tokens):
+            for other in self.tokens[i + 1:]:
+                if strings_overlap(token, other):
+                    return True
+        return False
+
+# ReplacementSet applies an ordered list of (replace, value) pairs to text
+# The result is always the same as calling str.replace for each pair in
+# order. When none of the tokens and values can interact with each other
+# that's done in a single scan with a TokenMatcher, otherwise it falls back
+# to replacing one pair at a time.
+class ReplacementSet:
+    def __init__(self, replacements):
+        self.replacements = list(replacements)
+        self.matcher = TokenMatcher([replace for replace, _ in self.replacements])
+        # The first mutation to replace a token wins, later ones find nothing left
+        self.values = {}
+        for replace, value in self.replacements:
+            if replace not in self.values:
+                self.values[replace] = value
+        self.single_pass = self.__is_single_pass_safe()
+
+    def apply(self, text):
+        if self.single_pass:
+            return self.matcher.replace(text, self.values)
+        for replace, value in self.replacements:
+            text = text.replace(replace, value)
+        return text
+
+    # The same as apply for an iterable of text chunks, see
+    # TokenMatcher.replace_stream. Replacing one pair at a time chains one
+    # stream per pair so the text still only passes through once
+    def apply_stream(self, chunks):
+        if self.single_pass:
+            return self.matcher.replace_stream(chunks, self.values)
+        for replace, value in self.replacements:
+            chunks = TokenMatcher([replace]).replace_stream(chunks, {replace: value})
+        return chunks
+
+    # Empty tokens are replaced between every character, which
+    # can only be done with the whole text
+    def can_stream(self):
+        return all(replace for replace, _ in self.replacements)
+
+    # A single pass is only safe if applying the replacements one at a time
+    # can never produce a different result, which means:
+    #   * no token can overlap another token
+    #   * no value inserted by a mutation can form, or be part of, a token
+    #     replaced by a later mutation
+    #   * no mutation removes text entirely, which could join its neighbours
+    #     into a token replaced by a later mutation
+    def __is_single_pass_safe(self):
+        # A lone str.replace is already a single scan and beats the regex engine
+        if len(self.replacements) < 2:
+            return False
+        if any(replace == "" for replace, _ in self.replacements):
+            return False
+        if self.matcher.overlapping:
+            return False
+        for i, (_, value) in enumerate(self.replacements):
+            for later_replace, _ in self.replacements[i + 1:]:
+                if value == "" or strings_overlap(value, later_replace):
+                    return False
+        return True
+
+# StreamFinder finds a TokenMatcher's tokens in text that arrives in chunks
+# The end of each chunk is kept and searched again with the next one so a
+# token split between two chunks is still found
+class StreamFinder:
+    def __init__(self, matcher):
+        self.matcher = matcher
+        self.found = set()
+        self.tail = ""
+
+    def feed(self, chunk):
+        if len(self.found) == len(self.matcher.tokens):
+            return
+        text = self.tail + chunk
+        self.found |= self.matcher.find(text)
+        self.tail = text[max(0, len(text) - self.matcher.max_len + 1):]
+
+    # Passes chunks through unchanged, finding tokens on the way
+    def watch(self, chunks):
+        for chunk in chunks:
+            self.feed(chunk)
+            yield chunk
+
+# Returns True if one string contains the other or the end of one is the
+# start of the other
+def strings_overlap(a, b):
+    if a in b or b in a:
+        return True
+    for size in range(1, min(len(a), len(b))):
+        if a.endswith(b[:size]) or b.endswith(a[:size]):
+            return True
+    return False
+
+# Returns True if the end of a string is also its start, so two copies
+# of it can overlap
+def has_border(a):
+    return any(a[:size] == a[-size:] for size in range(1, len(a)))
@@ -1,9 +1,10 @@
 import os
-import re
 from nasti.validation import Validation
+from nasti.matcher import TokenMatcher
+from nasti.scanner import TemplateScanner, find_tokens_in_file
+from nasti.plan import MutationPlan
 import nasti.exceptions as exceptions
-from jinja2 import Template, Environment
-import jinja2.exceptions as jinja2_exceptions
+from nasti.renderer import TemplateRenderer
 
 
 class Mutation:
@@ -25,7 +26,7 @@ class Mutation:
     DEFAULT_KEY = "default"
     GLOBALS_KEY = "globals"
 
-    def __init__(self, mutation_config: dict, path, os_dep=os, open_dep=open, input_dep=input, print_dep=print, accept_defaults=False, silent_mode=False, silent_opts={}):
+    def __init__(self, mutation_config: dict, path, os_dep=os, open_dep=open, input_dep=input, print_dep=print, accept_defaults=False, silent_mode=False, silent_opts={}, renderer=None):
         # Dependency injection
         self.os_dep = os_dep
         self.open_dep = open_dep
@@ -34,6 +35,9 @@ class Mutation:
         self.accept_defaults = accept_defaults
         self.silent_mode = silent_mode
         self.silent_opts = silent_opts
+        # Mutations in the same nastifile share a renderer so
+        # default templates are compiled and rendered once
+        self.renderer = renderer if renderer else TemplateRenderer()
         # Required fields
         try:
             self.name        = mutation_config[self.NAME_KEY]
@@ -56,88 +60,66 @@ class Mutation:
                 raise e(f"Error: Invalid vaidation config in mutation: {mutation_config} {e}")
         self.path = path
 
-    # Recursively find all files in the directory that contain the text to be replaced
+    # Find all files in the directory that contain the text to be replaced
     # and are not mentioned in the mutation
-    # Returns a list of file paths relative to the working directory
+    # Returns a list of file paths relative to the directory
     def find_unmentioned_files(self, root_dir):
         if not root_dir:
             root_dir = self.path
+        scanner = TemplateScanner(root_dir, self.os_dep, self.open_dep)
+        file_tokens = scanner.scan(TokenMatcher([self.replace]))
+        return self.get_unmentioned_files(file_tokens)
+
+    # Given a dictionary of file to the set of tokens found in it
+    # returns the files that contain the text to be replaced
+    # but aren't in the mutation file list
+    def get_unmentioned_files(self, file_tokens):
         unmentioned_files = []
-        # list all files in the directory
-        files_in_dir = self.os_dep.listdir(root_dir)
-        # for each file in the directory
-        for file_in_dir in files_in_dir:
-            # skip the nastifile
-            if file_in_dir == 'nasti.yaml':
-                continue
-            # if the file starts with a dot skip it
-            if file_in_dir.startswith('.'):
-                continue
-            # The file path is relative to the working directory
-            # so we need to construct fill file path
-            file_full_path = root_dir + '/' + file_in_dir
-
-            # if the file is a directory recurse
-            if self.os_dep.path.isdir(file_full_path):
-                unmentioned_files += self.find_unmentioned_files(file_full_path)
-                continue
-            
-            # Determine if the file is in the mutation file list and if it is we'll skip it
-            # this code is kind of hard to read so I'll explain it
-            # We split the full file path by the working directory path
-            # this gives us a list with elements: the working directory, the relative path to the file
-            file_path_split = file_full_path.split(self.path)
-            # remove the working directory from the list because we don't need it
-            # as files in a mutation are relative to the working directory
-            file_path_split.pop(0)
-            # now we have a list with one element: the relative path to the file
-            # we get the first element and remove the leading slash
-            relative_file_path = file_path_split[0].lstrip('/')
-            # the end result of all this is that a path like this:
-            # /home/user/projects/nasti/nasti.yaml
-            # with a working directory of:
-            # /home/user/projects/nasti
-            # becomes this:
-            # nasti.yaml
-            # which is the same format as the files in the mutation file list
-            # so we can just check if the file is in the list and if it is we skip it
-            if relative_file_path in self.files:
-                continue
-
-            # look into the file and see if the text to be replaced is there
-            with self.open_dep(file_full_path, 'r', errors='replace') as f:
-                if re.search(self.replace, f.read()):
-                    # if the text to be replaced is there add it to the list
-                    unmentioned_files.append(relative_file_path)
+        files = set(self.files)
+        for file, tokens in file_tokens.items():
+            if self.replace in tokens and file not in files:
+                unmentioned_files.append(file)
         return unmentioned_files
 
     # Validate the nastifile syntax
     # Raises exceptions if there are any problems
-    def validate(self):
+    # file_tokens optionally maps files to the set of tokens already found
+    # in them so files shared between mutations don't need to be re-read
+    # check_files can be turned off when the files aren't on disk yet and
+    # will be checked as they're written
+    def validate(self, file_tokens={}, check_files=True):
         # verify files isn't empty
         if len(self.files) == 0:
             raise exceptions.MutationEmptyFilesException(f"Error: mutation {self.name} does not contain any files.")
         # If there's a default template verify it renders
         if self.default:
             self.validate_default_template()
+        if not check_files:
+            return
         for file in self.files:
             # verify file exists
             file_with_path = self.__get_file_full_path(file)
             if not self.os_dep.path.isfile(file_with_path):
                 raise exceptions.MutationFileDoesNotExistException(f"Error: mutation: {self.name} file: {file} at: {file_with_path} does not exist.")
             # verify the file contains the text to be replaced
-            with self.open_dep(file_with_path, 'r') as f:
-                # search for at least one instance of the text to be replaced
-                if not re.search(self.replace, f.read()):
-                    raise exceptions.MutationFileDoesNotContainReplacementStringException(f"Error: mutation {self.name} file: {file} at: {file_with_path} does not contain {self.replace} ")
+            if not self.__file_contains_replace(file, file_with_path, file_tokens):
+                raise exceptions.MutationFileDoesNotContainReplacementStringException(f"Error: mutation {self.name} file: {file} at: {file_with_path} does not contain {self.replace} ")
+
+    def __file_contains_replace(self, file, file_with_path, file_tokens):
+        if file in file_tokens:
+            return self.replace in file_tokens[file]
+        # search for at least one instance of the text to be replaced
+        tokens, error = find_tokens_in_file(file_with_path, TokenMatcher([self.replace]), self.open_dep, None, os_dep=self.os_dep)
+        if error:
+            raise error
+        return self.replace in tokens
 
     def validate_default_template(self):
         default_value = ""
         if not self.default:
             return
         try:
-            env = Environment()
-            env.parse(self.default)
+            self.renderer.compile(self.default)
         except Exception as e:
             raise exceptions.MutationDefaultTemplateInvalidException(f"Error: Unable to render default template: {e}")
         return default_value
@@ -147,23 +129,37 @@ class Mutation:
         if not self.default:
             return
         try:
-            template = Template(self.default)
-            default_value = template.render(**self.globals)
+            default_value = self.renderer.render(self.default, self.globals)
         except Exception as e:
             raise exceptions.MutationDefaultTemplateInvalidException(f"Error: Unable to render default template: {e}")
         return default_value
         
 
     def run(self):
+        new_value = self.resolve()
+        # Errors writing an accepted default are raised as they are
+        if self.__accepts_default():
+            self.__replace_text_in_files(new_value)
+            return
+        try:
+            self.__replace_text_in_files(new_value)
+        except Exception as e:
+            if exceptions.is_nasti_exception(e):
+                raise
+            raise exceptions.MutationTextReplacementFailedException(f"Error: Unable to replace text in files: {e}")
+
+    # Work out the value this mutation will replace its text with
+    # Prompts the user unless running in silent or accept defaults mode
+    # Does not touch any files
+    def resolve(self):
         # Handle silent mode
         if self.silent_mode:
-            self.__run_silent()
-            return
+            return self.__resolve_silent()
         # Handle accept defaults
-        if self.accept_defaults and self.default:
-            self.print_dep(f"[green]:heavy_check_mark:[/green] Using [green]{self.render_default_template()}[/green] for [blue]{self.name}[/blue] ")
-            self.__replace_text_in_files(self.render_default_template())
-            return
+        if self.__accepts_default():
+            default_value = self.render_default_template()
+            self.print_dep(f"[green]:heavy_check_mark:[/green] Using [green]{default_value}[/green] for [blue]{self.name}[/blue] ")
+            return default_value
         # Prompt the user for input
         self.print_dep(f"{self.prompt}")
         if self.help:
@@ -171,13 +167,9 @@ class Mutation:
         # If there is a default value, print it
         if self.default:
             self.print_dep(f"[italic]Press enter for Default:[/italic] [blue]{self.render_default_template()}[/blue]")
-        user_input = self.__get_user_input()
-        try:
-            self.__replace_text_in_files(user_input)
-        except Exception as e:
-            raise exceptions.MutationTextReplacementFailedException(f"Error: Unable to replace text in files: {e}")
+        return self.__get_user_input()
 
-    def __run_silent(self):
+    def __resolve_silent(self):
         # if there is no default and no silent opts, raise an exception
         if not self.default and not self.name in self.silent_opts:
             raise exceptions.MutationSilentModeException(f"Silent mode enabled but no default value or silent opts found for mutation: {self.name}")
@@ -190,11 +182,11 @@ class Mutation:
         # Validate the new value
         if not self.__is_input_valid(new_value):
             raise exceptions.MutationSilentModeException(f"Invalid value found for mutation: {self.name}")
-        try:
-            self.__replace_text_in_files(new_value)
-        except Exception as e:
-            raise exceptions.MutationTextReplacementFailedException(f"Error: Unable to replace text in files: {e}")
+        return new_value
         
+    def __accepts_default(self):
+        return not self.silent_mode and self.accept_defaults and self.default
+
     def __get_user_input(self):
         tries = 0
         max_tries = 3
@@ -213,14 +205,10 @@ class Mutation:
         return user_input
 
     def __replace_text_in_files(self, user_input):
-        # Replace the text in the files
-        for file in self.files:
-            file_with_path = self.__get_file_full_path(file)
-            with self.open_dep(file_with_path, 'r') as f:
-                file_text = f.read()
-            file_text = file_text.replace(self.replace, user_input)
-            with self.open_dep(file_with_path, 'w') as f:
-                f.write(file_text)
+        # Replace the text in the files, big files are streamed
+        plan = MutationPlan(self.path, self.os_dep, self.open_dep)
+        plan.add(self, user_input)
+        plan.apply()
     
     def __is_input_valid(self, user_input):
         # If there is no validation, the input is valid
@@ -1,7 +1,14 @@
+import shutil
 import subprocess
 
-from nasti.source_handlers import SourceHandlerResolver
+from nasti.source_handlers import SourceHandlerResolver, ArchiveHandler
 from nasti.nastifile import NastiFile
+from nasti.copier import TemplateCopier
+from nasti.report import PlanReport
+from nasti.lockfile import Lockfile, walk_template_dir
+from nasti.git_writer import GitRepoWriter
+from nasti.profiler import null_profiler
+import nasti.exceptions as exceptions
 
 class Nasti:
     
@@ -17,6 +24,11 @@ class Nasti:
         self.print_dep = opts["print_dep"]
         self.output_dir = opts["output_dir"]
         self.git_init = opts["git_init"]
+        # Create the repo without running git when the user's git setup
+        # allows it, otherwise git is run as usual
+        self.native_git = False
+        if "native_git" in opts:
+            self.native_git = opts["native_git"]
         self.accept_defaults = False
 
         self.silent_opts = {}
@@ -27,42 +39,216 @@ class Nasti:
             self.silent_mode = opts["silent_mode"]
         if "accept_defaults" in opts:
             self.accept_defaults = opts["accept_defaults"]
+        # How files no mutation touches are copied into the output dir
+        self.copy_mode = TemplateCopier.COPY_MODE
+        self.copy_jobs = None
+        if "copy_mode" in opts:
+            self.copy_mode = opts["copy_mode"]
+        if "copy_jobs" in opts:
+            self.copy_jobs = opts["copy_jobs"]
+        # Lazy mode reads mutated files straight from the template and
+        # only writes the rewritten result to the output dir
+        self.lazy = False
+        if "lazy" in opts:
+            self.lazy = opts["lazy"]
+        # Optional GitMirrorCache for git sources
+        self.git_cache = None
+        if "git_cache" in opts:
+            self.git_cache = opts["git_cache"]
+        # Optional NastiFileCache parsed nastifiles are shared through
+        self.config_cache = None
+        if "config_cache" in opts:
+            self.config_cache = opts["config_cache"]
+        # Optional TemplateRenderer shared with other runs of the same template
+        self.renderer = None
+        if "renderer" in opts:
+            self.renderer = opts["renderer"]
+        # A source handler that has already been run can be passed in so
+        # several projects can be generated from one copy of the source
+        # The caller is then responsible for cleaning it up
+        self.owns_handler = True
+        if "handler" in opts:
+            self.handler = opts["handler"]
+            self.owns_handler = False
+        # Mutations can be validated once up front by the caller instead
+        self.validate = True
+        if "validate" in opts:
+            self.validate = opts["validate"]
+        # Write a lockfile into the project so nasti update can apply
+        # template changes to it later. It's off by default because it
+        # hashes every file in the project and holds every answer in
+        # plain text
+        self.lock = False
+        if "lock" in opts:
+            self.lock = opts["lock"]
+        # Optional Profiler every phase of the run is recorded with
+        self.profiler = null_profiler
+        if "profiler" in opts:
+            self.profiler = opts["profiler"]
 
     def run(self):
         try:
-            self.__get_source()
-            self.__create_output_dir()
-            self.__copy_source_files()
-            self.__load_nasti_file()
-            self.nasti_file.validate_mutations()
+            if self.owns_handler:
+                self.__phase("get_source", self.__get_source)
+            self.__phase("create_output_dir", self.__create_output_dir)
+            if isinstance(self.handler, ArchiveHandler):
+                self.__phase("extract_archive", self.__extract_archive)
+            elif self.lazy:
+                self.__load_nasti_file(self.handler.source_dir)
+                self.__phase("validate_mutations", self.__validate_mutations)
+                self.__copy_source_files()
+            else:
+                self.__copy_source_files()
+                self.__load_nasti_file(self.output_dir)
+                self.__phase("validate_mutations", self.__validate_mutations)
             self.nasti_file.run()
-            self.__clean_up()
-            self.__git_init()
+            self.__phase("write_lockfile", self.__write_lockfile)
+            self.__phase("clean_up", self.__clean_up)
+            self.__phase("git_init", self.__git_init)
+        except Exception as e:
+            self.delete_output_dir()
+            # Print a pretty error
+            self.print_dep(f"An error ocurred processing the template: ")
+            raise e
+        finally:
+            # The project has everything it needs from the source by now
+            if self.owns_handler and self.handler:
+                self.handler.clean_up()
+
+    # Works out what run would do without writing anything
+    # The answers are collected as usual, then every file in the template
+    # is read once and nothing is copied or rewritten. Hooks aren't run
+    # Returns a PlanReport
+    def plan(self):
+        try:
+            if self.owns_handler:
+                self.__get_source()
+            self.__load_nasti_file(self.handler.source_dir)
+            # The files are checked as they're read
+            if self.validate:
+                self.nasti_file.validate_mutations(check_files=False)
+            self.nasti_file.run_globals()
+            report = PlanReport(self.source, self.nasti_file.plan_mutations(), self.nasti_file.hooks)
+            if isinstance(self.handler, ArchiveHandler):
+                self.handler.plan(report)
+            else:
+                report.add_dir(self.handler.source_dir, self.os_dep, self.open_dep)
+            report.verify_complete()
+            return report
+        finally:
+            if self.owns_handler and self.handler:
+                self.handler.clean_up()
+
+    # The same as run but overlaps work that doesn't depend on each other
+    # The template is copied while the nastifile is validated and the user
+    # answers its prompts, and the mutated files are written at the same time
+    async def run_async(self):
+        # asyncio is only imported by callers that use it
+        import asyncio
+        copy_task = None
+        try:
+            if self.owns_handler:
+                await asyncio.to_thread(self.__phase, "get_source", self.__get_source)
+            self.__phase("create_output_dir", self.__create_output_dir)
+            if isinstance(self.handler, ArchiveHandler):
+                await asyncio.to_thread(self.__phase, "extract_archive", self.__extract_archive)
+            else:
+                # The copies are the same as the template until a hook runs
+                # so the template can be validated while it's copied
+                await asyncio.to_thread(self.__load_nasti_file, self.handler.source_dir)
+                copy_task = asyncio.create_task(asyncio.to_thread(self.__copy_source_files))
+                await asyncio.to_thread(self.__phase, "validate_mutations", self.__validate_mutations)
+            await self.nasti_file.run_async(copy_task)
+            await asyncio.to_thread(self.__phase, "write_lockfile", self.__write_lockfile)
+            await asyncio.to_thread(self.__phase, "clean_up", self.__clean_up)
+            await asyncio.to_thread(self.__phase, "git_init", self.__git_init)
         except Exception as e:
-            self.handler.clean_up()
+            # Don't delete the output dir out from under the copy
+            if copy_task:
+                await asyncio.gather(copy_task, return_exceptions=True)
             self.delete_output_dir()
             # Print a pretty error
             self.print_dep(f"An error ocurred processing the template: ")
             raise e
+        finally:
+            if self.owns_handler and self.handler:
+                self.handler.clean_up()
+
+    # Runs func as a phase of the run
+    def __phase(self, name, func, *args):
+        with self.profiler.phase(name):
+            return func(*args)
+
+    # Archives are streamed straight into the output dir
+    # Unless a before hook needs to see the files first the mutations are
+    # applied as the files are extracted, so the archive is only read once
+    def __extract_archive(self):
+        self.__load_nasti_file(self.handler.source_dir)
+        if self.nasti_file.is_lazy():
+            if self.validate:
+                self.nasti_file.validate_mutations(check_files=False)
+            self.nasti_file.plan_applier = lambda plan: self.handler.extract(self.output_dir, plan)
+            return
+        self.handler.extract(self.output_dir)
+        self.__load_nasti_file(self.output_dir)
+        self.__validate_mutations()
+
+    # Hooks can change any file so the template has to be read for all of
+    # them, otherwise only the files mutations changed are
+    def __write_lockfile(self):
+        if not self.lock:
+            return
+        hooks = self.nasti_file.hooks
+        source = self.source
+        if self.os_dep.path.exists(source):
+            # The project can be updated from anywhere
+            source = self.os_dep.path.abspath(source)
+        lockfile = Lockfile(source, self.handler.get_revision(), self.nasti_file.get_answers(self.nasti_file.plan))
+        lockfile.record(self.nasti_file.plan, self.__template_files(), self.output_dir, bool(hooks.before or hooks.after), self.os_dep, self.open_dep)
+        lockfile.save(self.output_dir, self.os_dep, self.open_dep)
+
+    def __template_files(self):
+        if isinstance(self.handler, ArchiveHandler):
+            return self.handler.files()
+        return walk_template_dir(self.handler.source_dir, self.os_dep, self.open_dep)
+
+    def __validate_mutations(self):
+        if self.validate:
+            self.nasti_file.validate_mutations()
 
     def __clean_up(self):
         #delete the nastifile
-        self.os_dep.system(f"rm {self.output_dir}/nasti.yaml")
+        nasti_file_path = self.output_dir + "/nasti.yaml"
+        if self.os_dep.path.exists(nasti_file_path):
+            self.os_dep.remove(nasti_file_path)
         # delete the git repo
-        self.os_dep.system(f"rm -rf {self.output_dir}/.git")
+        shutil.rmtree(self.output_dir + "/.git", ignore_errors=True)
 
     def __git_init(self):
         if self.git_init:
+            if self.native_git:
+                try:
+                    GitRepoWriter(self.output_dir, self.os_dep, self.open_dep).commit("Initial commit")
+                    return
+                except exceptions.GitWriterUnsupportedException:
+                    pass
+            # Each step only runs if the one before it worked
             with self.open_dep(self.os_dep.devnull, 'w') as devnull:
-                return subprocess.run(f"cd {self.output_dir} && git init && git add -A && git commit -am 'Initial commit'", stdout=devnull, stderr=devnull, shell=True)
+                for args in [["git", "init"], ["git", "add", "-A"], ["git", "commit", "-am", "Initial commit"]]:
+                    result = subprocess.run(args, cwd=self.output_dir, stdout=devnull, stderr=devnull)
+                    if result.returncode != 0:
+                        break
+                return result
 
 
+    # Silent mode, which batches and the server run in, never prompts for
+    # another directory and fails instead
     def __create_output_dir(self):
         attemps = 0
         max_attempts = 3
         while True:
             if not self.output_dir:
-                self.output_dir = input("Enter an output directory name: ")
+                self.output_dir = self.input_dep("Enter an output directory name: ")
             try:
                 # Attempt to create the directory
                 self.os_dep.makedirs(self.output_dir)
@@ -70,26 +256,57 @@ class Nasti:
                     self.print_dep(f"Directory '{self.output_dir}' created successfully.")
                 break
             except OSError as e:
+                output_dir = self.output_dir
+                # It isn't ours so it mustn't be deleted when this fails
+                self.output_dir = None
+                if self.silent_mode:
+                    raise exceptions.NastiOutputDirCreationException(f"Error: Unable to create output directory {output_dir}: {e}")
                 # Handle error if directory creation fails
                 self.print_dep(f"Error: {e}")
                 self.print_dep("Please check the directory name and try again.")
-                self.output_dir = None
                 attemps += 1
                 if attemps >= max_attempts:
-                    raise Exception("Error: Something really weird is up. ")
+                    raise exceptions.NastiOutputDirCreationException("Error: Something really weird is up. ")
 
     def delete_output_dir(self):
-        self.os_dep.system(f"rm -rf {self.output_dir}")
+        if not self.output_dir:
+            return
+        shutil.rmtree(self.output_dir, ignore_errors=True)
 
     def __copy_source_files(self):
         # Copy the files from the source to the output dir
-        self.os_dep.system(f"cp -r {self.handler.source_dir}/* {self.output_dir}")
+        with self.profiler.phase("copy_source_files") as span:
+            copier = TemplateCopier(self.handler.source_dir, self.output_dir, self.os_dep, self.open_dep, self.copy_mode, self.copy_jobs)
+            span.add_files(len(copier.copy(self.__get_mutation_files(), self.__get_lazy_files())))
 
-    def __load_nasti_file(self):
+    # Files that mutations rewrite always get their own copy
+    # so linking can never change the template itself
+    def __get_mutation_files(self):
+        if self.copy_mode == TemplateCopier.COPY_MODE:
+            return []
+        if self.lazy:
+            return self.nasti_file.get_mutation_files()
+        source_nasti_file = NastiFile(self.__with_shared_caches({
+            "path": self.handler.source_dir,
+            "os_dep": self.os_dep,
+            "open_dep": self.open_dep,
+        }))
+        source_nasti_file.load()
+        return source_nasti_file.get_mutation_files()
+
+    # Files the mutations write straight to the output dir
+    # don't need to be copied first
+    def __get_lazy_files(self):
+        if not self.lazy or not self.nasti_file.is_lazy():
+            return []
+        return self.nasti_file.get_mutation_files()
+
+    def __load_nasti_file(self, path):
         if not self.handler:
             raise Exception("Error: No source handler found.")
-        self.nasti_file = NastiFile({
-            "path": self.output_dir,
+        self.nasti_file = NastiFile(self.__with_shared_caches({
+            "path": path,
+            "output_path": self.output_dir,
             "os_dep": self.os_dep,
             "open_dep": self.open_dep,
             "print_dep": self.print_dep,
@@ -97,11 +314,19 @@ class Nasti:
             "accept_defaults": self.accept_defaults,
             "silent_mode": self.silent_mode,
             "silent_opts": self.silent_opts,
-        })
+            "profiler": self.profiler,
+        }))
         self.nasti_file.load()
 
+    def __with_shared_caches(self, nasti_file_opts):
+        if self.config_cache:
+            nasti_file_opts["config_cache"] = self.config_cache
+        if self.renderer:
+            nasti_file_opts["renderer"] = self.renderer
+        return nasti_file_opts
+
     def __get_source(self):
-        resolver = SourceHandlerResolver(self.source, self.help_text, self.os_dep, self.print_dep)
+        resolver = SourceHandlerResolver(self.source, self.help_text, self.os_dep, self.print_dep, self.git_cache)
         self.handler = resolver.resolve()
         self.handler.run()
 
@@ -3,9 +3,17 @@ import re
 import yaml
 
 from nasti.mutation import Mutation
+from nasti.plan import MutationPlan
+from nasti.matcher import TokenMatcher
+from nasti.scanner import TemplateScanner
+from nasti.classifier import FileClassifier
+from nasti.index import TemplateIndex
 from nasti.globals import Global
+from nasti.renderer import TemplateRenderer
 import nasti.exceptions as exceptions
 from nasti.hooks import Hooks
+import nasti.config_cache as config_cache
+from nasti.profiler import null_profiler
 
 # This class is used to store the results of the find command
 class UnmentionedFilesResult:
@@ -60,6 +68,7 @@ class NastiFile:
     GLOBALS_KEY="globals"
     GREETING_KEY="greeting"
     HOOKS_KEY="hooks"
+    BINARY_EXTENSIONS_KEY="binary_extensions"
 
     # This is a dictionary of global variables
     # This is set by running the globals
@@ -88,46 +97,163 @@ class NastiFile:
             self.silent_opts = opts["silent_opts"]
         if "silent_mode" in opts:
             self.silent_mode = opts["silent_mode"]
+        # Number of files to scan at once during validate and find
+        self.jobs = 1
+        self.use_processes = False
+        if "jobs" in opts:
+            self.jobs = opts["jobs"]
+        if "use_processes" in opts:
+            self.use_processes = opts["use_processes"]
+        # When set the nastifile is read from path but the project is
+        # written to output_path instead of being rewritten in place
+        self.output_path = None
+        if "output_path" in opts:
+            self.output_path = opts["output_path"]
+        # Called with the MutationPlan to write the mutated files
+        # Defaults to rewriting the files on disk
+        self.plan_applier = None
+        if "plan_applier" in opts:
+            self.plan_applier = opts["plan_applier"]
+        # Parsed nastifiles are shared through a cache so loading the same
+        # file again doesn't parse it again
+        self.config_cache = config_cache.memory_cache
+        if "config_cache" in opts:
+            self.config_cache = opts["config_cache"]
+        self.config_key = None
+        # One renderer for every mutation's default template
+        # Batches share one across every nastifile they generate
+        self.renderer = TemplateRenderer()
+        if "renderer" in opts:
+            self.renderer = opts["renderer"]
+        # Each nastifile gets its own globals so batches can run
+        # several at once
+        self.globals = {}
+        # The MutationPlan the mutations were applied with
+        self.plan = None
+        # Remembers which files are binary for every scan in this run
+        self.classifier = None
+        if "classifier" in opts:
+            self.classifier = opts["classifier"]
+        # Keep an index of the tokens in each file in the template so
+        # validate and find only read the files that changed since
+        self.use_index = False
+        if "use_index" in opts:
+            self.use_index = opts["use_index"]
+        self.index = None
+        # Optional Profiler the steps of a run are recorded with
+        self.profiler = null_profiler
+        if "profiler" in opts:
+            self.profiler = opts["profiler"]
         self.working_dir = opts["path"]
         self.__set_path(opts["path"])
         
 
     def load(self):
-        self.__verify_exists()
-        self.init_config()
-        self.init_hooks()
+        with self.profiler.phase("load_nastifile", path=self.path):
+            self.__verify_exists()
+            self.init_config()
+            self.init_hooks()
 
     def run(self):
         self.load()
         self.run_greeting()
-        self.hooks.run_before()
-        self.run_globals()
+        with self.profiler.phase("before_hook"):
+            self.hooks.run_before()
+        with self.profiler.phase("run_globals"):
+            self.run_globals()
         self.run_mutations()
-        self.hooks.run_after()
+        with self.profiler.phase("after_hook"):
+            self.hooks.run_after()
+
+    # The same as run but lets the caller overlap other work with it
+    # files_ready is an optional task that finishes once the template's files
+    # are in the output directory. The user answers the prompts while it
+    # runs unless a before script needs to see the files first
+    async def run_async(self, files_ready=None):
+        import asyncio
+        self.load()
+        self.run_greeting()
+        if self.hooks.before:
+            await self.__wait_for(files_ready)
+            await asyncio.to_thread(self.__phase, "before_hook", self.hooks.run_before)
+        await asyncio.to_thread(self.__phase, "run_globals", self.run_globals)
+        plan = await asyncio.to_thread(self.plan_mutations)
+        self.plan = plan
+        # The copy mustn't overwrite the mutated files afterwards
+        await self.__wait_for(files_ready)
+        try:
+            with self.profiler.phase("apply_mutations") as span:
+                span.add_files(len(plan.files))
+                if self.plan_applier:
+                    await asyncio.to_thread(self.plan_applier, plan)
+                else:
+                    await plan.apply_async()
+        except Exception as e:
+            if exceptions.is_nasti_exception(e):
+                raise
+            raise exceptions.MutationTextReplacementFailedException(f"Error: Unable to replace text in files: {e}")
+        await asyncio.to_thread(self.__phase, "after_hook", self.hooks.run_after)
+
+    def __phase(self, name, func):
+        with self.profiler.phase(name):
+            return func()
+
+    async def __wait_for(self, task):
+        if task:
+            await task
 
     def init_hooks(self):
         if self.HOOKS_KEY in self.config:
             hooks_opts = self.config[self.HOOKS_KEY]
-            hooks_opts["working_dir"] = self.working_dir
+            hooks_opts["working_dir"] = self.output_path if self.output_path else self.working_dir
             self.hooks = Hooks(self.config[self.HOOKS_KEY])
 
     def init_config(self):
-        with self.open_dep(self.path, 'r') as file:
-            try:
-                self.config = yaml.load(file, Loader=yaml.SafeLoader)
-            except yaml.YAMLError as e:
-                raise exceptions.NastiFileInvalidYamlException(f"Error: Unable to load {self.path}.")
+        with self.open_dep(self.path, 'rb') as file:
+            data = file.read()
+        try:
+            self.config = self.config_cache.load(data)
+        except yaml.YAMLError as e:
+            raise exceptions.NastiFileInvalidYamlException(f"Error: Unable to load {self.path}.")
+        self.config_key = self.config_cache.get_key(data)
 
     def run_greeting(self):
         if self.GREETING_KEY in self.config and not self.silent_mode:
             self.print_dep(self.config[self.GREETING_KEY])
 
     def run_mutations(self):
+        plan = self.plan_mutations()
+        self.plan = plan
+        try:
+            with self.profiler.phase("apply_mutations") as span:
+                span.add_files(len(plan.files))
+                if self.plan_applier:
+                    self.plan_applier(plan)
+                else:
+                    plan.apply()
+        except Exception as e:
+            if exceptions.is_nasti_exception(e):
+                raise
+            raise exceptions.MutationTextReplacementFailedException(f"Error: Unable to replace text in files: {e}")
+
+    # Resolve the value of every mutation up front and group the
+    # replacements by file so each file is only rewritten once
+    def plan_mutations(self):
         working_dir = self.get_dir()
-        for mutation_config in self.config[self.MUTATIONS_KEY]:
-            mutation_config["globals"] = self.globals
-            mutation = Mutation(mutation_config, working_dir, os, open, self.input_dep, self.print_dep, self.accept_defaults, self.silent_mode, self.silent_opts)
-            mutation.run()
+        output_dir = self.get_output_dir()
+        # A before script might change files after they were copied so
+        # in that case mutations read the copies instead of the template
+        read_dir = working_dir if self.is_lazy() else output_dir
+        with self.profiler.phase("plan_mutations"):
+            plan = MutationPlan(read_dir, os, open, output_dir, self.profiler)
+            for mutation_config in self.config[self.MUTATIONS_KEY]:
+                mutation_config["globals"] = self.globals
+                mutation = Mutation(mutation_config, working_dir, os, open, self.input_dep, self.print_dep, self.accept_defaults, self.silent_mode, self.silent_opts, self.renderer)
+                # Prompting for the value and rendering its default
+                with self.profiler.phase(mutation.name, "mutation", files=len(mutation.files or [])):
+                    value = mutation.resolve()
+                plan.add(mutation, value)
+        return plan
 
     def run_globals(self):
         if self.GLOBALS_KEY in self.config:
@@ -136,44 +262,117 @@ class NastiFile:
                 global_obj.populate()
                 self.globals[global_obj.get_name()] = global_obj.get_value()
 
+    # Returns the value of every global and every mutation in a plan by
+    # name, in the same shape as silent opts so they can be given again
+    def get_answers(self, plan):
+        answers = dict(self.globals)
+        for mutation, value in plan.mutations:
+            answers[mutation.name] = value
+        return answers
+
     def get_global(self, name):
         if name in self.globals:
             return self.globals[name]
         raise exceptions.NastiFileGlobalNotFoundException(f"Error: Global {name} not found.")
 
+    # Get every file referenced by any mutation without validating the config
+    def get_mutation_files(self):
+        files = []
+        for mutation_config in self.config.get(self.MUTATIONS_KEY) or []:
+            files += mutation_config.get(self.FILES_KEY) or []
+        return list(dict.fromkeys(files))
+
+    # Lazy nastifiles read mutated files from the template and only write
+    # the rewritten files to the output directory
+    def is_lazy(self):
+        return bool(self.output_path) and not self.hooks.before
+
+    # Get the absolute path of the directory the project is written to
+    def get_output_dir(self):
+        if self.output_path:
+            return self.os_dep.path.abspath(self.output_path)
+        return self.get_dir()
+
     # Get the abolute path of the directory containing the nasti file
     def get_dir(self):
         return self.os_dep.path.dirname(self.os_dep.path.abspath(self.path))
     
     # Validate the mutations in the nastifile
-    def validate_mutations(self):
-        for mutation in self.__mutations():
-             mutation.validate()
+    # If check_files is off only the mutation configs are validated
+    def validate_mutations(self, check_files=True):
+        mutations = self.__mutations()
+        file_tokens = self.__find_tokens_in_mutation_files(mutations) if check_files else {}
+        for mutation in mutations:
+             mutation.validate(file_tokens, check_files)
+
+    # Read every file referenced by a mutation once and find all of the
+    # mutation tokens in it with a single shared matcher
+    # Returns a dictionary of file to the set of tokens found in it
+    def __find_tokens_in_mutation_files(self, mutations):
+        matcher = TokenMatcher([mutation.replace for mutation in mutations])
+        files = []
+        for mutation in mutations:
+            files += mutation.files
+        files = list(dict.fromkeys(files))
+        # Files that can't be read are left out so the mutation that
+        # references them reports the problem, in nastifile order
+        return self.__scanner().scan_files(matcher, files, ignore_errors=True)
     
     # Find files that are not mentioned in the nastifile
+    # The template is walked and each file read once for all mutations
     def find_unmentioned_files(self):
         unmentioned_files = UnmentionedFilesResult()
-        for mutation in self.__mutations():
-            mutation_unmentioned_files = mutation.find_unmentioned_files(self.get_dir())
-            unmentioned_files.add(mutation, mutation_unmentioned_files)
+        mutations = self.__mutations()
+        matcher = TokenMatcher([mutation.replace for mutation in mutations])
+        file_tokens = self.__scanner().scan(matcher)
+        for mutation in mutations:
+            unmentioned_files.add(mutation, mutation.get_unmentioned_files(file_tokens))
         return unmentioned_files
 
+    # Get the mutations in the nastifile, validating their config
+    def get_mutations(self):
+        return self.__mutations()
+
+    # Get a scanner for the template that shares this nastifile's
+    # classifier and index with validate and find
+    def get_scanner(self):
+        return self.__scanner()
+
+    def __scanner(self):
+        return TemplateScanner(self.get_dir(), self.os_dep, self.open_dep, self.jobs, self.use_processes, self.__classifier(), self.__index())
+
+    def __index(self):
+        if self.use_index and self.index is None:
+            self.index = TemplateIndex(self.get_dir(), self.os_dep, self.open_dep)
+        return self.index
+
+    # Files ending in one of the nastifile's binary_extensions are never
+    # scanned, as well as the usual binary formats
+    def __classifier(self):
+        if self.classifier is None:
+            self.classifier = FileClassifier(self.config.get(self.BINARY_EXTENSIONS_KEY) or [])
+        return self.classifier
+
     # Get a list of mutation objects from the config
     # Does some validation on the config
     def __mutations(self):
         mutations = []
         self.load()
+        # A nastifile that's been validated before doesn't need it again
+        validated = self.config_cache.is_validated(self.config_key)
         # verify there are mutations
-        if not self.MUTATIONS_KEY in self.config:
+        if not validated and not self.MUTATIONS_KEY in self.config:
             raise exceptions.NastiFileNoMutationsException(f"Error: {self.path} does not contain any mutations.")
         working_dir = self.get_dir()
         for mutation_config in self.config[self.MUTATIONS_KEY]:
             # verify each mutation is valid
             # throws an exception if there is a problem
-            self.__validate_mutation_config_keys(mutation_config)
+            if not validated:
+                self.__validate_mutation_config_keys(mutation_config)
             # create a mutation object and add it to the list
-            mutation = Mutation(mutation_config, working_dir)
+            mutation = Mutation(mutation_config, working_dir, renderer=self.renderer)
             mutations.append(mutation)
+        self.config_cache.set_validated(self.config_key)
         return mutations
 
     def __validate_mutation_config_keys(self, mutation_config):
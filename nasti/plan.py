@@ -0,0 +1,175 @@
+import io
+import os
+import shutil
+from nasti.matcher import ReplacementSet, TokenMatcher, StreamFinder
+from nasti.profiler import null_profiler
+import nasti.exceptions as exceptions
+
+# MutationPlan collects the resolved value of every mutation before anything
+# is written to disk. Replacements are grouped by file so each file is read
+# and written exactly once, no matter how many mutations reference it.
+#
+# Files are read from path and written to output_path. When those differ the
+# template is read directly and only the rewritten files are written out.
+#
+# Files of STREAM_SIZE bytes or more are streamed through in CHUNK_SIZE
+# pieces rather than read whole, so memory stays the same however big
+# the file is.
+class MutationPlan:
+    STREAM_SIZE = 16 * 1024 * 1024
+    # In characters
+    CHUNK_SIZE = 1024 * 1024
+
+    # profiler records each file as it's rewritten
+    def __init__(self, path, os_dep=os, open_dep=open, output_path=None, profiler=null_profiler):
+        # Dependency injection
+        self.os_dep = os_dep
+        self.open_dep = open_dep
+        self.profiler = profiler
+        self.path = path
+        self.output_path = output_path if output_path else path
+        # Ordered list of (mutation, value) pairs in the order they were added
+        self.mutations = []
+        # Maps a file path to an ordered list of (replace, value) pairs
+        self.files = {}
+        # Maps a file path to the mutations that reference it
+        self.file_mutations = {}
+        # Files that share the same replacements share a ReplacementSet
+        self.replacement_sets = {}
+
+    # Add a resolved mutation to the plan
+    # Mutations must be added in the order they appear in the nastifile
+    # because that is the order the replacements are applied in
+    def add(self, mutation, value):
+        self.mutations.append((mutation, value))
+        for file in mutation.files:
+            if file not in self.files:
+                self.files[file] = []
+                self.file_mutations[file] = []
+            self.files[file].append((mutation.replace, value))
+            self.file_mutations[file].append(mutation)
+
+    def get_files(self):
+        return list(self.files.keys())
+
+    def get_replacements(self, file):
+        return self.files[file]
+
+    # Rewrite every file in the plan once with all of its replacements applied
+    def apply(self):
+        for file in self.files:
+            self.__rewrite_file(file)
+
+    # The same as apply but every file is rewritten at once on worker threads
+    async def apply_async(self):
+        import asyncio
+        await asyncio.gather(*(asyncio.to_thread(self.__rewrite_file, file) for file in self.files))
+
+    # Returns the text of a file in the plan with all of its replacements applied
+    # Replacements are applied as if each mutation ran on its own, in
+    # order, so later mutations see the output of earlier ones
+    def rewrite_text(self, file, text):
+        return self.__get_replacement_set(self.files[file]).apply(text)
+
+    # The same as rewrite_text for an iterable of text chunks
+    # Yields the rewritten text in chunks
+    def rewrite_stream(self, file, chunks):
+        return self.__get_replacement_set(self.files[file]).apply_stream(chunks)
+
+    # Whether a file of this many bytes should be streamed
+    def should_stream(self, file, size):
+        return size >= self.STREAM_SIZE and self.__get_replacement_set(self.files[file]).can_stream()
+
+    # Works out what rewriting a file would do without writing anything
+    # Returns a list of (mutation, number of times its text is replaced)
+    # in mutation order, and the rewritten text
+    def preview_text(self, file, text):
+        occurrences = []
+        for mutation, (replace, value) in zip(self.file_mutations[file], self.files[file]):
+            occurrences.append((mutation, text.count(replace)))
+            text = text.replace(replace, value)
+        return occurrences, text
+
+    # Raises the same exception validating the mutations would if the text
+    # of a file in the plan is missing the text a mutation replaces
+    # Used when files are checked as they're written rather than up front
+    def validate_text(self, file, text):
+        for mutation in self.file_mutations[file]:
+            if mutation.replace not in text:
+                self.__raise_missing_replace(file, mutation)
+
+    # The same as validate_text for an iterable of text chunks
+    # Yields the chunks unchanged and raises once they've all been seen
+    def validate_stream(self, file, chunks):
+        mutations = self.file_mutations[file]
+        finder = StreamFinder(TokenMatcher([mutation.replace for mutation in mutations]))
+        yield from finder.watch(chunks)
+        for mutation in mutations:
+            if mutation.replace not in finder.found:
+                self.__raise_missing_replace(file, mutation)
+
+    def __raise_missing_replace(self, file, mutation):
+        raise exceptions.MutationFileDoesNotContainReplacementStringException(f"Error: mutation {mutation.name} file: {file} does not contain {mutation.replace} ")
+
+    def __rewrite_file(self, file):
+        with self.profiler.phase(file, "file", mutations=[mutation.name for mutation in self.file_mutations[file]]) as span:
+            span.add_files(1)
+            self.__write_file(file)
+
+    def __write_file(self, file):
+        file_with_path = self.__get_file_full_path(file)
+        output_file_with_path = self.__get_output_file_full_path(file)
+        if self.should_stream(file, self.os_dep.path.getsize(file_with_path)):
+            self.__stream_file(file, file_with_path, output_file_with_path)
+        else:
+            with self.open_dep(file_with_path, 'r') as f:
+                file_text = f.read()
+            file_text = self.rewrite_text(file, file_text)
+            with self.open_dep(output_file_with_path, 'w') as f:
+                f.write(file_text)
+        # A new file needs the template file's permissions, scripts in
+        # particular need to stay executable
+        if output_file_with_path != file_with_path:
+            shutil.copymode(file_with_path, output_file_with_path)
+
+    # A file rewritten in place is streamed into a new file next to it
+    # which then replaces it
+    def __stream_file(self, file, file_with_path, output_file_with_path):
+        in_place = output_file_with_path == file_with_path
+        write_path = output_file_with_path + ".nasti-tmp" if in_place else output_file_with_path
+        try:
+            with self.open_dep(file_with_path, 'r') as f, self.open_dep(write_path, 'w') as output:
+                for chunk in self.rewrite_stream(file, iter(lambda: f.read(self.CHUNK_SIZE), "")):
+                    output.write(chunk)
+            if in_place:
+                shutil.copymode(file_with_path, write_path)
+                self.os_dep.replace(write_path, output_file_with_path)
+        except Exception:
+            if in_place and self.os_dep.path.exists(write_path):
+                self.os_dep.remove(write_path)
+            raise
+
+    def __get_replacement_set(self, replacements):
+        key = tuple(replacements)
+        if key not in self.replacement_sets:
+            self.replacement_sets[key] = ReplacementSet(replacements)
+        return self.replacement_sets[key]
+
+    def __get_file_full_path(self, file):
+        return self.path + '/' + file
+
+    def __get_output_file_full_path(self, file):
+        return self.output_path + '/' + file
+
+# Decode and encode the same way open() does, so rewriting a template
+# file that was read into memory gives the same result as rewriting a
+# copy of it on disk
+def decode_text(data):
+    return io.TextIOWrapper(io.BytesIO(data)).read()
+
+def encode_text(text):
+    output = io.BytesIO()
+    wrapper = io.TextIOWrapper(output)
+    wrapper.write(text)
+    wrapper.flush()
+    return output.getvalue()
@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import threading
+
+# Profiler records how long each phase of a run takes, what it read and
+# wrote, how many files it handled and the peak memory use at its end.
+# Phases are recorded with phase(), which returns a Span to use as a
+# context manager, and can be nested. Each finished Span is passed to
+# every hook, so callers can watch a run as it happens, and is kept so
+# the whole run can be saved as JSON or as Chrome trace events.
+#
+# Bytes read and written come from /proc/self/io and are counted for the
+# whole process, so phases that run at the same time on different threads
+# each see the other's I/O. Where /proc isn't available they're None.
+class Profiler:
+    JSON_FORMAT = "json"
+    TRACE_FORMAT = "trace"
+    FORMATS = [JSON_FORMAT, TRACE_FORMAT]
+
+    enabled = True
+
+    # hooks is a list of functions called with each Span as it finishes
+    def __init__(self, hooks=[]):
+        self.hooks = list(hooks)
+        self.spans = []
+        self.start_ns = time.perf_counter_ns()
+        self.lock = threading.Lock()
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    # category groups spans, such as "phase", "mutation" or "file"
+    # args are recorded with the span as they are
+    def phase(self, name, category="phase", **args):
+        return Span(self, name, category, args)
+
+    def finish(self, span):
+        with self.lock:
+            self.spans.append(span)
+        for hook in self.hooks:
+            hook(span)
+
+    # Returns every span in the order they started
+    def to_dict(self):
+        spans = sorted(self.spans, key=lambda span: span.start_ns)
+        return {"spans": [span.to_dict(self.start_ns) for span in spans]}
+
+    # Returns the spans as Chrome trace events, which chrome://tracing
+    # and Perfetto can open
+    def to_trace(self):
+        pid = os.getpid()
+        events = []
+        for span in sorted(self.spans, key=lambda span: span.start_ns):
+            span_dict = span.to_dict(self.start_ns)
+            args = {key: value for key, value in span_dict.items() if key not in ("name", "category", "start", "duration")}
+            events.append({
+                "name": span.name,
+                "cat": span.category,
+                "ph": "X",
+                # Microseconds
+                "ts": (span.start_ns - self.start_ns) / 1000,
+                "dur": span.duration_ns / 1000,
+                "pid": pid,
+                "tid": span.thread_id,
+                "args": args,
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save(self, path, format=JSON_FORMAT, open_dep=open):
+        data = self.to_trace() if format == self.TRACE_FORMAT else self.to_dict()
+        with open_dep(path, 'w') as f:
+            json.dump(data, f, indent=2)
+
+# A phase being recorded by a Profiler
+class Span:
+    def __init__(self, profiler, name, category, args):
+        self.profiler = profiler
+        self.name = name
+        self.category = category
+        self.args = args
+        self.files = None
+        self.start_ns = None
+        self.duration_ns = None
+        self.bytes_read = None
+        self.bytes_written = None
+        self.peak_rss = None
+        self.thread_id = None
+
+    # Count files the phase handled
+    def add_files(self, count):
+        self.files = (self.files or 0) + count
+
+    def __enter__(self):
+        self.thread_id = threading.get_ident()
+        self.start_io = read_io()
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.duration_ns = time.perf_counter_ns() - self.start_ns
+        end_io = read_io()
+        if self.start_io and end_io:
+            self.bytes_read = end_io[0] - self.start_io[0]
+            self.bytes_written = end_io[1] - self.start_io[1]
+        self.peak_rss = get_peak_rss()
+        self.profiler.finish(self)
+        return False
+
+    # Times are in seconds from when the profiler was created
+    def to_dict(self, start_ns=0):
+        return {
+            "name": self.name,
+            "category": self.category,
+            "start": (self.start_ns - start_ns) / 1e9,
+            "duration": self.duration_ns / 1e9,
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "files": self.files,
+            "peak_rss": self.peak_rss,
+            **self.args,
+        }
+
+# NullProfiler is used when profiling is off so nothing has to check
+# whether it's on. Every phase shares one span that does nothing
+class NullProfiler:
+    enabled = False
+
+    def phase(self, name, category="phase", **args):
+        return NULL_SPAN
+
+class NullSpan:
+    def add_files(self, count):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+NULL_SPAN = NullSpan()
+
+# The one NullProfiler everything shares
+null_profiler = NullProfiler()
+
+# Returns the (bytes read, bytes written) of this process so far, or None
+def read_io():
+    try:
+        with open("/proc/self/io", "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    counters = dict(line.split(b": ") for line in data.splitlines())
+    return int(counters[b"rchar"]), int(counters[b"wchar"])
+
+# Returns the peak resident set size of this process so far in bytes
+# or None where it can't be measured
+def get_peak_rss():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes and macOS bytes
+    return peak if os.uname().sysname == "Darwin" else peak * 1024
@@ -0,0 +1,59 @@
+import threading
+from collections import OrderedDict
+
+# TemplateRenderer renders mutation default templates through one shared
+# jinja2 Environment. Each template is compiled the first time it's seen and
+# each rendered value is kept, keyed by the template and a snapshot of the
+# variables it was rendered with, so asking for the same default again
+# doesn't compile or render it again. The variables are snapshotted rather
+# than compared by identity because globals are filled in as they run.
+# Every run's answers make new keys, so only the max_rendered most recently
+# used values are kept for renderers shared by many runs.
+# jinja2 is slow to import so it isn't imported until a template is compiled.
+class TemplateRenderer:
+    MAX_RENDERED = 1024
+
+    def __init__(self, environment=None, max_rendered=MAX_RENDERED):
+        self.environment = environment
+        self.templates = {}
+        self.rendered = OrderedDict()
+        self.max_rendered = max_rendered
+        # Server jobs share a renderer across threads
+        self.rendered_lock = threading.Lock()
+
+    # Returns the compiled template for source
+    # Raises jinja2's TemplateSyntaxError if source isn't a valid template
+    def compile(self, source):
+        if source not in self.templates:
+            self.templates[source] = self.get_environment().from_string(source)
+        return self.templates[source]
+
+    def get_environment(self):
+        if self.environment is None:
+            from jinja2 import Environment
+            self.environment = Environment()
+        return self.environment
+
+    def render(self, source, variables={}):
+        key = self.__get_key(source, variables)
+        if key is None:
+            # Variables that can't be hashed are never memoized
+            return self.compile(source).render(**variables)
+        with self.rendered_lock:
+            if key in self.rendered:
+                self.rendered.move_to_end(key)
+                return self.rendered[key]
+        value = self.compile(source).render(**variables)
+        with self.rendered_lock:
+            self.rendered[key] = value
+            while len(self.rendered) > self.max_rendered:
+                self.rendered.popitem(last=False)
+        return value
+
+    def __get_key(self, source, variables):
+        key = (source, tuple(sorted(variables.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
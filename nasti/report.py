@@ -0,0 +1,99 @@
+import os
+import locale
+import nasti.exceptions as exceptions
+from nasti.index import SKIP_NAMES
+
+# PlanReport describes what processing a template would do without doing
+# it: the files each mutation changes, how many times it replaces its text
+# in each of them, the values it replaces it with, and the bytes that
+# would be written. The caller reads each file once and hands it over, so
+# building a report never writes anything.
+class PlanReport:
+    NASTIFILE_NAME = "nasti.yaml"
+
+    def __init__(self, source, plan, hooks=None):
+        self.source = source
+        self.plan = plan
+        self.hooks = hooks
+        # Maps each mutated file to what happens to it
+        self.files = {}
+        self.copied_files = 0
+        self.copied_bytes = 0
+        # Files are written with open's default encoding
+        self.encoding = locale.getpreferredencoding(False)
+
+    def is_planned(self, file):
+        return file in self.plan.files
+
+    # Adds a file a mutation changes, text is its contents and size is
+    # its size on disk in bytes
+    # Raises the same exceptions validating the mutations would
+    def add_file(self, file, text, size):
+        self.plan.validate_text(file, text)
+        occurrences, new_text = self.plan.preview_text(file, text)
+        self.files[file] = {
+            "occurrences": occurrences,
+            "bytes_read": size,
+            "bytes_written": len(new_text.encode(self.encoding)),
+        }
+
+    # Adds a file that's copied as is
+    def add_copied_file(self, size):
+        self.copied_files += 1
+        self.copied_bytes += size
+
+    # Reads every file in a template directory, once
+    def add_dir(self, source_dir, os_dep=os, open_dep=open):
+        for dir_path, dir_names, file_names in os_dep.walk(source_dir):
+            dir_names[:] = sorted(name for name in dir_names if name not in SKIP_NAMES)
+            for name in sorted(file_names):
+                full_path = dir_path + "/" + name
+                file = os_dep.path.relpath(full_path, source_dir)
+                if file == self.NASTIFILE_NAME or os_dep.path.islink(full_path):
+                    continue
+                size = os_dep.path.getsize(full_path)
+                if self.is_planned(file):
+                    with open_dep(full_path, 'r') as f:
+                        self.add_file(file, f.read(), size)
+                else:
+                    self.add_copied_file(size)
+
+    # Raises if a file a mutation changes was never added
+    def verify_complete(self):
+        for file in self.plan.get_files():
+            if file not in self.files:
+                raise exceptions.MutationFileDoesNotExistException(f"Error: file: {file} does not exist in {self.source}.")
+
+    def to_dict(self):
+        mutations = []
+        for mutation, value in self.plan.mutations:
+            files = {}
+            for file in mutation.files:
+                if file in self.files:
+                    files[file] = sum(count for other, count in self.files[file]["occurrences"] if other is mutation)
+            mutations.append({
+                "name": mutation.name,
+                "replace": mutation.replace,
+                "value": value,
+                "files": files,
+            })
+        files = {}
+        for file, result in self.files.items():
+            files[file] = {
+                "occurrences": sum(count for _, count in result["occurrences"]),
+                "bytes_read": result["bytes_read"],
+                "bytes_written": result["bytes_written"],
+            }
+        mutated_bytes = sum(result["bytes_written"] for result in self.files.values())
+        return {
+            "source": self.source,
+            "mutations": mutations,
+            "files": files,
+            "copied_files": self.copied_files,
+            "copied_bytes": self.copied_bytes,
+            "bytes_written": mutated_bytes + self.copied_bytes,
+            "hooks": {
+                "before_script": self.hooks.before if self.hooks else False,
+                "after_script": self.hooks.after if self.hooks else False,
+            },
+        }
@@ -0,0 +1,200 @@
+import os
+import mmap
+from functools import partial
+from nasti.classifier import FileClassifier, is_binary_data, SNIFF_SIZE
+
+# TemplateScanner walks a template directory once and reads each file once
+# no matter how many mutations need to be checked against it
+class TemplateScanner:
+    NASTIFILE_NAME = "nasti.yaml"
+
+    # Files are handed to process workers in batches to cut down on pickling
+    PROCESS_CHUNK_SIZE = 64
+
+    # Files are read this many characters at a time so big files
+    # don't have to fit in memory
+    READ_SIZE = 1024 * 1024
+
+    # Files this big or bigger are memory mapped rather than read when
+    # they're searched as bytes, smaller ones are quicker to just read
+    MMAP_SIZE = 64 * 1024
+
+    # jobs is the number of files read and searched at the same time
+    # use_processes spreads the work across processes instead of threads,
+    # which lets the token searches use more than one core
+    # classifier is a FileClassifier, share one between scanners of the
+    # same template so files are only classified once
+    # index is an optional TemplateIndex of the tokens found in each file
+    # by earlier runs, only files that changed since are read
+    def __init__(self, path, os_dep=os, open_dep=open, jobs=1, use_processes=False, classifier=None, index=None):
+        # Dependency injection
+        self.os_dep = os_dep
+        self.open_dep = open_dep
+        self.path = path
+        self.jobs = jobs
+        self.use_processes = use_processes
+        self.classifier = classifier if classifier else FileClassifier()
+        self.index = index
+        # Maps each file looked up in the index to its stat
+        self.stats = {}
+        self.files = None
+
+    # Returns a sorted list of every file in the template relative to the
+    # template directory. Dot files, dot directories and nastifiles are skipped
+    # The directory is only walked the first time this is called
+    def list_files(self):
+        if self.files is None:
+            self.files = []
+            self.__walk("")
+        return self.files
+
+    # Reads every file in the template and finds the tokens in it
+    # Returns a dictionary of relative file path to the set of tokens found
+    # Files with no tokens in them and binary files are left out
+    def scan(self, matcher):
+        files = [file for file in self.list_files() if not self.classifier.is_binary(file)]
+        file_tokens = self.scan_files(matcher, files, errors='replace', skip_binary=True)
+        if self.index:
+            # Files that were deleted since are forgotten
+            self.index.prune(self.list_files())
+            self.__save_index()
+        return {file: tokens for file, tokens in file_tokens.items() if tokens}
+
+    # Reads the given files and finds the tokens in them
+    # errors is passed to open and controls how undecodable bytes are
+    # handled. Without it a file that can't be decoded is an error even
+    # when it's searched as bytes, like it is for the mutations that
+    # rewrite it
+    # If ignore_errors is set files that can't be read are left out, otherwise
+    # the error for the first unreadable file in the list is raised
+    # If skip_binary is set files that turn out to be binary are left out
+    # The result is always in the same order as files, however many jobs ran
+    def scan_files(self, matcher, files, errors=None, ignore_errors=False, skip_binary=False):
+        strict = errors is None
+        results = self.__lookup_files(matcher, files, skip_binary, strict)
+        read_files = [file for file in files if results[file] is False]
+        find_tokens = partial(find_tokens_in_file, matcher=matcher, open_dep=self.open_dep, errors=errors, sniff=skip_binary)
+        if not self.use_processes:
+            # Modules can't be sent to process workers so they use os
+            find_tokens = partial(find_tokens, os_dep=self.os_dep)
+        full_paths = [self.get_full_path(file) for file in read_files]
+        for file, result in zip(read_files, self.__map(find_tokens, full_paths)):
+            results[file] = result
+            self.__update_index(matcher, file, result, strict)
+        self.__save_index()
+        file_tokens = {}
+        for file in files:
+            tokens, error = results[file]
+            if error:
+                if ignore_errors:
+                    continue
+                raise error
+            if tokens is None:
+                self.classifier.set_binary(file)
+                continue
+            file_tokens[file] = tokens
+        return file_tokens
+
+    # Returns a dictionary of file to a (tokens, error) result for the files
+    # the index has, and to False for the files that have to be read
+    # The index is only used when files are searched as bytes, because
+    # then how they would have been decoded doesn't matter, except that
+    # strict lookups need the file to have been decoded before
+    def __lookup_files(self, matcher, files, skip_binary, strict):
+        results = {file: False for file in files}
+        if not self.index or not matcher.can_find_bytes():
+            return results
+        self.index.load()
+        tokens = set(matcher.tokens)
+        # Files are stat'ed before they're read so a change made while
+        # they're read is picked up next time
+        for file in files:
+            try:
+                self.stats[file] = self.index.stat(file)
+            except OSError:
+                continue
+            tokens_found = self.index.lookup(file, self.stats[file], tokens, skip_binary, strict)
+            if tokens_found is not False:
+                results[file] = (tokens_found, None)
+        return results
+
+    def __update_index(self, matcher, file, result, strict):
+        tokens, error = result
+        if not self.index or not matcher.can_find_bytes() or error or file not in self.stats:
+            return
+        self.index.update(file, self.stats[file], set(matcher.tokens), tokens, strict and tokens is not None)
+
+    # The index only saves time, a template that can't be written to
+    # is scanned without it
+    def __save_index(self):
+        if not self.index:
+            return
+        try:
+            self.index.save()
+        except OSError:
+            pass
+
+    def get_full_path(self, file):
+        return self.path + '/' + file
+
+    def __walk(self, relative_dir):
+        full_dir = self.get_full_path(relative_dir) if relative_dir else self.path
+        # Sort the entries so results are the same on every machine
+        with self.os_dep.scandir(full_dir) as entries:
+            entries = sorted(entries, key=lambda entry: entry.name)
+        for entry in entries:
+            if entry.name.startswith('.') or entry.name == self.NASTIFILE_NAME:
+                continue
+            relative_path = relative_dir + '/' + entry.name if relative_dir else entry.name
+            if entry.is_dir():
+                self.__walk(relative_path)
+                continue
+            self.files.append(relative_path)
+
+    def __map(self, func, items):
+        if self.jobs <= 1 or len(items) <= 1:
+            return list(map(func, items))
+        from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+        if self.use_processes:
+            with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+                return list(executor.map(func, items, chunksize=self.PROCESS_CHUNK_SIZE))
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            return list(executor.map(func, items))
+
+# Finds the tokens in a single file
+# This lives outside the scanner so it can be sent to process workers
+# If sniff is set the start of the file is checked first and binary files
+# aren't searched
+# Without errors a file searched as bytes must also decode
+# Returns a tuple of the tokens found, or None for a binary file, and the
+# error raised reading the file
+def find_tokens_in_file(full_path, matcher, open_dep, errors, sniff=False, os_dep=os):
+    try:
+        if matcher.can_find_bytes():
+            with open_dep(full_path, 'rb') as f:
+                return find_tokens_in_bytes(f, matcher, sniff, errors is None, os_dep), None
+        if sniff:
+            with open_dep(full_path, 'rb') as f:
+                if is_binary_data(f.read(SNIFF_SIZE)):
+                    return None, None
+        with open_dep(full_path, 'r', errors=errors) as f:
+            return matcher.find_stream(iter(lambda: f.read(TemplateScanner.READ_SIZE), "")), None
+    except Exception as e:
+        return None, e
+
+# Finds the tokens in an open binary file without decoding it
+# The bytes that were read are sniffed as they are, no more is read
+# If strict is set the bytes are checked to decode once tokens are found
+def find_tokens_in_bytes(f, matcher, sniff=False, strict=False, os_dep=os):
+    if os_dep.fstat(f.fileno()).st_size < TemplateScanner.MMAP_SIZE:
+        return search_bytes(f.read(), matcher, sniff, strict)
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return search_bytes(data, matcher, sniff, strict)
+
+def search_bytes(data, matcher, sniff, strict):
+    if sniff and is_binary_data(data):
+        return None
+    tokens = matcher.find_bytes(data)
+    if strict:
+        matcher.check_decodes(data)
+    return tokens
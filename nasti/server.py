@@ -0,0 +1,390 @@
+import os
+import hmac
+import json
+import time
+import secrets
+import threading
+import socketserver
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from nasti.source_handlers import SourceHandlerResolver, ArchiveHandler, LocalDirectoryHandler, HelpHandler
+from nasti.nastifile import NastiFile
+from nasti.nasti import Nasti
+from nasti.copier import TemplateCopier
+from nasti.renderer import TemplateRenderer
+import nasti.config_cache as config_cache
+import nasti.exceptions as exceptions
+
+# NastiServer generates projects for clients over a Unix domain socket or
+# localhost HTTP so they don't pay for starting Python and fetching the
+# template on every project. Templates that had to be fetched, from git or
+# an archive, stay ready in memory along with their parsed nastifiles and
+# compiled default templates. Only the most recently used max_sources stay
+# warm, older ones are removed once no job is using them.
+#
+# A job is a JSON object:
+#   {"source": "/abs/path or url", "output_dir": "/abs/path", "answers": {...}}
+# with optional "git": false to skip creating a repo and "refresh": true to
+# fetch the template again. Progress is streamed back as one JSON event
+# per line, ending with a "done" event.
+class NastiServer:
+    SOURCE_KEY = "source"
+    OUTPUT_DIR_KEY = "output_dir"
+    ANSWERS_KEY = "answers"
+    GIT_KEY = "git"
+    REFRESH_KEY = "refresh"
+    MAX_SOURCES = 32
+
+    def __init__(self, opts={}):
+        # Dependency injection
+        self.os_dep = opts["os_dep"]
+        self.open_dep = opts["open_dep"]
+        self.help_text = opts["help_text"]
+
+        self.copy_mode = TemplateCopier.COPY_MODE
+        if "copy_mode" in opts:
+            self.copy_mode = opts["copy_mode"]
+        self.git_cache = None
+        if "git_cache" in opts:
+            self.git_cache = opts["git_cache"]
+        self.config_cache = config_cache.memory_cache
+        if "config_cache" in opts:
+            self.config_cache = opts["config_cache"]
+        self.max_sources = self.MAX_SOURCES
+        if "max_sources" in opts:
+            self.max_sources = opts["max_sources"]
+        # Maps a source to its WarmSource, least recently used first
+        self.sources = OrderedDict()
+        # Sources replaced by a refresh or pushed out by newer ones that
+        # are still in use by a job, they're removed when the last one ends
+        self.retired_sources = []
+        # Each source is fetched under its own lock so a slow fetch
+        # doesn't hold up jobs for templates that are already warm
+        self.source_locks = {}
+        self.sources_lock = threading.Lock()
+        # Hooks change the working directory of the whole process
+        # so jobs for templates with hooks run one at a time. Jobs without
+        # hooks still run alongside them, which is safe because every path
+        # a job gives has to be absolute
+        self.hooks_lock = threading.Lock()
+        self.server = None
+        self.socket_path = None
+        self.server_address = None
+        # HTTP clients have to send this in an Authorization header
+        self.token = None
+        self.token_path = None
+
+    # Runs a job, calling emit with each progress event as it happens
+    # Returns True if the project was generated
+    def run_job(self, job, emit):
+        start = time.monotonic()
+        warm_source = None
+        try:
+            source, output_dir, answers = self.__parse_job(job)
+            emit({"event": "resolving", "source": source})
+            warm_source, warm = self.__get_source(source, job.get(self.REFRESH_KEY, False))
+            emit({"event": "resolved", "source": source, "warm": warm})
+            emit({"event": "generating", "output_dir": output_dir})
+            nasti = Nasti({
+                "source": source,
+                "handler": warm_source.handler,
+                "validate": False,
+                "print_dep": lambda text: emit({"event": "message", "text": str(text)}),
+                "git_init": job.get(self.GIT_KEY, True),
+                "help_text": self.help_text,
+                "os_dep": self.os_dep,
+                "open_dep": self.open_dep,
+                "input_dep": self.__no_input,
+                "output_dir": output_dir,
+                "silent_mode": True,
+                "silent_opts": answers,
+                "copy_mode": self.copy_mode,
+                "lazy": True,
+                "config_cache": self.config_cache,
+                "renderer": warm_source.renderer,
+            })
+            if warm_source.has_hooks:
+                with self.hooks_lock:
+                    nasti.run()
+            else:
+                nasti.run()
+        except Exception as e:
+            emit({"event": "error", "type": type(e).__name__, "message": str(e)})
+            emit({"event": "done", "ok": False, "elapsed_ms": self.__elapsed_ms(start)})
+            return False
+        finally:
+            if warm_source:
+                self.__release_source(warm_source)
+        emit({"event": "done", "ok": True, "output_dir": output_dir, "elapsed_ms": self.__elapsed_ms(start)})
+        return True
+
+    # Listens on a Unix domain socket
+    # Clients send a job as one line of JSON and read events until the
+    # socket closes
+    def listen_unix(self, socket_path):
+        socket_path = self.os_dep.path.abspath(socket_path)
+        if self.os_dep.path.exists(socket_path):
+            # Left behind by a server that didn't shut down cleanly
+            self.os_dep.remove(socket_path)
+        self.server = NastiUnixServer(socket_path, NastiUnixRequestHandler)
+        self.server.nasti_server = self
+        self.socket_path = socket_path
+        # Only the user running the server can send it jobs
+        self.os_dep.chmod(socket_path, 0o600)
+
+    # Listens for HTTP on localhost
+    # Clients POST a job to /jobs and read events from the response body
+    # A port of 0 picks a free port, server_address has the one picked
+    # Any process or web page on the machine can reach localhost, so every
+    # request needs "Authorization: Bearer <token>" with a token made up
+    # for this server. It's written to token_path, which only the user
+    # running the server can read
+    def listen_http(self, port, token_path=None):
+        self.token = secrets.token_urlsafe(32)
+        if token_path:
+            self.token_path = self.os_dep.path.abspath(token_path)
+            if self.os_dep.path.exists(self.token_path):
+                self.os_dep.remove(self.token_path)
+            fd = self.os_dep.open(self.token_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with self.open_dep(fd, "w") as f:
+                f.write(self.token + "\n")
+        self.server = NastiHTTPServer(("127.0.0.1", port), NastiHTTPRequestHandler)
+        self.server.nasti_server = self
+        self.server_address = self.server.server_address
+
+    # Whether the value of a request's Authorization header has this
+    # server's token
+    def is_authorized(self, authorization):
+        if not self.token or not authorization:
+            return False
+        return hmac.compare_digest(authorization.encode("utf-8"), f"Bearer {self.token}".encode("utf-8"))
+
+    # Handles jobs until shutdown is called, then cleans up
+    def serve(self):
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            if self.socket_path:
+                self.os_dep.remove(self.socket_path)
+            if self.token_path:
+                self.os_dep.remove(self.token_path)
+            self.close()
+
+    def shutdown(self):
+        if self.server:
+            self.server.shutdown()
+
+    # Removes every template the server fetched
+    def close(self):
+        with self.sources_lock:
+            for warm_source in list(self.sources.values()) + self.retired_sources:
+                warm_source.handler.clean_up()
+            self.sources = OrderedDict()
+            self.source_locks = {}
+            self.retired_sources = []
+
+    def __parse_job(self, job):
+        if not isinstance(job, dict):
+            raise exceptions.NastiServerInvalidJobException("Error: A job must be a JSON object.")
+        source = job.get(self.SOURCE_KEY)
+        output_dir = job.get(self.OUTPUT_DIR_KEY)
+        answers = job.get(self.ANSWERS_KEY, {})
+        if not source or not isinstance(source, str):
+            raise exceptions.NastiServerInvalidJobException("Error: A job needs a source.")
+        # The server's working directory means nothing to a client, and
+        # changes while a job with hooks runs
+        if not self.__is_absolute_source(source):
+            raise exceptions.NastiServerInvalidJobException("Error: A job's source must be an absolute path or a git URL.")
+        if not output_dir or not isinstance(output_dir, str) or not self.os_dep.path.isabs(output_dir):
+            raise exceptions.NastiServerInvalidJobException("Error: A job needs an absolute output_dir.")
+        if self.os_dep.path.exists(output_dir):
+            raise exceptions.NastiServerInvalidJobException(f"Error: Output directory {output_dir} already exists.")
+        if not isinstance(answers, dict) or not all(isinstance(key, str) and isinstance(val, str) for key, val in answers.items()):
+            raise exceptions.NastiServerInvalidJobException("Error: A job's answers must be key value pairs of strings.")
+        return source, output_dir, answers
+
+    # Paths and file:// URLs have to be absolute, remote git URLs always are
+    def __is_absolute_source(self, source):
+        if source.startswith(ArchiveHandler.FILE_PREFIX):
+            return self.os_dep.path.isabs(source[len(ArchiveHandler.FILE_PREFIX):])
+        if any(source.startswith(prefix) for prefix in SourceHandlerResolver.GIT_PREFIXES):
+            return True
+        return self.os_dep.path.isabs(source)
+
+    # Returns the WarmSource for source and whether it was already warm
+    # The caller has to release it with __release_source once its job ends
+    # Local directories are never kept warm since they can change at any time
+    def __get_source(self, source, refresh):
+        with self.sources_lock:
+            source_lock = self.source_locks.setdefault(source, threading.Lock())
+        with source_lock:
+            with self.sources_lock:
+                warm_source = self.sources.get(source)
+                if warm_source and not refresh:
+                    self.sources.move_to_end(source)
+                    warm_source.jobs += 1
+                    return warm_source, True
+            try:
+                new_source = self.__resolve_source(source)
+            except Exception:
+                with self.sources_lock:
+                    if source not in self.sources:
+                        self.source_locks.pop(source, None)
+                raise
+            unused_sources = []
+            with self.sources_lock:
+                new_source.jobs += 1
+                if source in self.sources:
+                    unused_sources += self.__retire(self.sources.pop(source))
+                if isinstance(new_source.handler, LocalDirectoryHandler):
+                    new_source.retired = True
+                    self.source_locks.pop(source, None)
+                else:
+                    self.sources[source] = new_source
+                while len(self.sources) > self.max_sources:
+                    old_source, old_warm_source = self.sources.popitem(last=False)
+                    self.source_locks.pop(old_source, None)
+                    unused_sources += self.__retire(old_warm_source)
+            for unused_source in unused_sources:
+                unused_source.handler.clean_up()
+            return new_source, False
+
+    # Takes a source out of service, must be called with sources_lock held
+    # Returns the sources no job is using so they can be removed
+    def __retire(self, warm_source):
+        warm_source.retired = True
+        if warm_source.jobs:
+            self.retired_sources.append(warm_source)
+            return []
+        return [warm_source]
+
+    # Removes a retired source once the last job using it has ended
+    def __release_source(self, warm_source):
+        with self.sources_lock:
+            warm_source.jobs -= 1
+            if not warm_source.retired or warm_source.jobs:
+                return
+            if warm_source in self.retired_sources:
+                self.retired_sources.remove(warm_source)
+        warm_source.handler.clean_up()
+
+    def __resolve_source(self, source):
+        handler = SourceHandlerResolver(source, self.help_text, self.os_dep, lambda text: None, self.git_cache).resolve()
+        if isinstance(handler, HelpHandler):
+            raise exceptions.NastiServerInvalidJobException(f"Error: Unable to resolve {source}.")
+        handler.run()
+        try:
+            renderer = TemplateRenderer()
+            nasti_file = NastiFile({
+                "path": handler.source_dir,
+                "os_dep": self.os_dep,
+                "open_dep": self.open_dep,
+                "config_cache": self.config_cache,
+                "renderer": renderer,
+            })
+            nasti_file.load()
+            # Archive files are only checked as they're extracted
+            nasti_file.validate_mutations(check_files=not isinstance(handler, ArchiveHandler))
+        except Exception:
+            handler.clean_up()
+            raise
+        return WarmSource(handler, renderer, bool(nasti_file.hooks.before or nasti_file.hooks.after))
+
+    def __no_input(self, text):
+        raise exceptions.NastiServerInvalidJobException("Error: The server can't prompt for input, every answer must be in the job.")
+
+    def __elapsed_ms(self, start):
+        return round((time.monotonic() - start) * 1000, 1)
+
+# A template that's been fetched, parsed and validated
+# jobs counts the jobs using it, and retired is set once new jobs can't
+class WarmSource:
+    def __init__(self, handler, renderer, has_hooks):
+        self.handler = handler
+        self.renderer = renderer
+        self.has_hooks = has_hooks
+        self.jobs = 0
+        self.retired = False
+
+class NastiUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+# Writes events to a client one JSON object per line
+# A client that goes away doesn't stop the job it sent
+class EventWriter:
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.closed = False
+
+    def __call__(self, event):
+        if self.closed:
+            return
+        try:
+            self.wfile.write((json.dumps(event) + "\n").encode("utf-8"))
+            self.wfile.flush()
+        except OSError:
+            self.closed = True
+
+class NastiUnixRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        emit = EventWriter(self.wfile)
+        try:
+            job = json.loads(self.rfile.readline())
+        except ValueError as e:
+            emit({"event": "error", "type": "NastiServerInvalidJobException", "message": f"Error: Invalid job: {e}"})
+            emit({"event": "done", "ok": False})
+            return
+        self.server.nasti_server.run_job(job, emit)
+
+class NastiHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+class NastiHTTPRequestHandler(BaseHTTPRequestHandler):
+    JOBS_PATH = "/jobs"
+
+    def do_POST(self):
+        if self.path != self.JOBS_PATH:
+            self.send_error(404)
+            return
+        # Browsers send an Origin header with requests web pages make. A
+        # page can't send a JSON Content-Type or an Authorization header
+        # without asking first, which the server never allows
+        if self.headers.get("Origin") is not None:
+            self.send_error(403, "Requests from web pages aren't accepted")
+            return
+        if not self.server.nasti_server.is_authorized(self.headers.get("Authorization")):
+            self.send_error(401, "A valid Authorization: Bearer token is required")
+            return
+        content_type = self.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        if content_type != "application/json":
+            self.send_error(415, "Jobs must be sent as application/json")
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            job = json.loads(self.rfile.read(length))
+        except ValueError as e:
+            self.send_error(400, f"Invalid job: {e}")
+            return
+        # The body is streamed as events happen and ends when the
+        # connection closes
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.server.nasti_server.run_job(job, EventWriter(self.wfile))
+
+    # Requests aren't logged to stderr
+    def log_message(self, format, *args):
+        pass
+
+# Where the server listens when no socket is given
+def default_socket_path(os_dep=os):
+    runtime_dir = os_dep.environ.get("XDG_RUNTIME_DIR") or "/tmp"
+    return f"{runtime_dir}/nasti-{os_dep.getuid()}.sock"
+
+# Where an HTTP server writes its token when no path is given
+def default_token_path(os_dep=os):
+    runtime_dir = os_dep.environ.get("XDG_RUNTIME_DIR") or "/tmp"
+    return f"{runtime_dir}/nasti-{os_dep.getuid()}.token"
@@ -1,53 +1,130 @@
 import os
+import io
+import codecs
+import locale
+import stat
 import uuid
+import shlex
+import shutil
+import subprocess
 import nasti.exceptions as exceptions
+from nasti.index import SKIP_NAMES
+from nasti.plan import decode_text
 
 # SourceHandlerResolver finds the correct source handler for the source input and returns it
 # If no source is provided, it returns the help handler
 class SourceHandlerResolver:
     HELP_KEY = "help"
-    GIT_PREFIX = "git@"
+    GIT_PREFIXES = ["git@", "file://"]
 
-    def __init__(self, source, help_text, os_dep=os, print_dep=print):
+    # git_cache is an optional GitMirrorCache git sources are cloned through
+    def __init__(self, source, help_text, os_dep=os, print_dep=print, git_cache=None):
         self.os_dep = os_dep
         self.source = source
         self.print_dep = print_dep
         self.help_text = help_text
+        self.git_cache = git_cache
 
     def resolve(self):
         if not self.source or self.source.lower() == self.HELP_KEY:
             return HelpHandler(self.source, self.os_dep, self.print_dep, self.help_text)
-        if self.source.startswith(self.GIT_PREFIX):
-            return GitHandler(self.source, self.os_dep)
+        if ArchiveHandler.is_archive(self.source):
+            return ArchiveHandler(self.source, self.os_dep)
+        if any(self.source.startswith(prefix) for prefix in self.GIT_PREFIXES):
+            return GitHandler(self.source, self.os_dep, self.git_cache)
         return LocalDirectoryHandler(self.source, self.os_dep)
 
+# GitHandler clones a template from a git repo
+# The source can pin a ref and pick a subdirectory of the repo:
+#   git@host:org/repo.git#v2:templates/api
+# The ref can be a branch, tag or commit. Only that one commit is fetched,
+# and only the files in the subdirectory are checked out.
 class GitHandler:
     source_dir = ""
+    clone_dir = ""
     TMP_DIR = "/tmp/nasti/"
-    def __init__(self, source, os_dep=os):
+    REF_SEPARATOR = "#"
+    SUBDIR_SEPARATOR = ":"
+
+    def __init__(self, source, os_dep=os, git_cache=None):
         self.source = source
         self.os_dep = os_dep
+        self.git_cache = git_cache
+        self.url, self.ref, self.subdir = self.parse_source(source)
 
     def run(self):
         self.validate_git()
         self.__create_tmp_dir()
         self.clone_repo()
+        self.__use_subdir()
 
     def clean_up(self):
-        self.os_dep.system('rm -rf ' + self.source_dir)
+        self.os_dep.system('rm -rf ' + (self.clone_dir or self.source_dir))
+
+    # Returns the commit the template was checked out at
+    def get_revision(self):
+        result = subprocess.run(["git", "-C", self.clone_dir, "rev-parse", "HEAD"], capture_output=True, text=True)
+        if result.returncode != 0:
+            return None
+        return result.stdout.strip()
     
     def __command_exists(self, command):
         return self.os_dep.system("which " + command + " > /dev/null") == 0
 
+    # Splits a source into its url, ref and subdirectory
+    # ref and subdir are None when they aren't given
+    def parse_source(self, source):
+        url, _, fragment = source.partition(self.REF_SEPARATOR)
+        ref, _, subdir = fragment.partition(self.SUBDIR_SEPARATOR)
+        subdir = subdir.strip('/')
+        if '..' in subdir.split('/'):
+            raise exceptions.GitHandlerInvalidSourceException(f"Error: Invalid subdirectory {subdir} in {source}.")
+        return url, ref or None, subdir or None
+
     # I wouldn't normally make these methods public
     # but it aids in testing these methods
     def validate_git(self):
         if not self.__command_exists('git'):
             raise exceptions.GitHandlerGitMissingException("Error: git is not installed.")
     def clone_repo(self):
-        if self.os_dep.system('git clone ' + self.source + ' ' + self.source_dir) != 0:
+        if self.git_cache:
+            self.git_cache.checkout(self.url, self.clone_dir, self.ref, self.subdir)
+            return
+        if not self.__fetch_commit():
             raise exceptions.GitHandlerCloneException("Error: Unable to clone git repo.")
 
+    # Fetch just the commit we need with no history, then check it out
+    # Sparse checkout limits the files written to the subdirectory and
+    # the blob filter stops the server sending the files outside it
+    def __fetch_commit(self):
+        ref = self.ref if self.ref else "HEAD"
+        fetch_opts = "-q"
+        if self.subdir:
+            fetch_opts += " --filter=blob:none"
+        if self.__git("init -q") != 0:
+            return False
+        if self.__git(f"remote add origin {shlex.quote(self.url)}") != 0:
+            return False
+        if self.subdir and self.__git(f"sparse-checkout set --no-cone {shlex.quote('/' + self.subdir + '/')}") != 0:
+            return False
+        if self.__git(f"fetch {fetch_opts} --depth 1 origin {shlex.quote(ref)}") == 0:
+            return self.__git("checkout -q FETCH_HEAD") == 0
+        # Some servers won't hand out a single commit by hash
+        # so fall back to fetching everything and checking the ref out
+        if self.__git(f"fetch {fetch_opts} origin") != 0:
+            return False
+        return self.__git(f"checkout -q {shlex.quote(ref)}") == 0
+
+    def __git(self, args):
+        return self.os_dep.system(f"git -C {shlex.quote(self.clone_dir)} {args}")
+
+    def __use_subdir(self):
+        if not self.subdir:
+            return
+        self.source_dir = self.clone_dir + '/' + self.subdir
+        if not self.os_dep.path.isdir(self.source_dir):
+            raise exceptions.GitHandlerSubdirNotFoundException(f"Error: {self.subdir} is not a directory in {self.url}.")
+
     def __create_tmp_dir(self):
         tmp_dir_path = self.TMP_DIR
         if not self.os_dep.path.isdir(tmp_dir_path):
@@ -56,12 +133,291 @@ class GitHandler:
             except:
                 raise exceptions.GitHandlerTmpDirCreationException("Error: Unable to create tmp directory.")
         random_dir = str(uuid.uuid4())
-        self.source_dir = tmp_dir_path + random_dir
+        self.clone_dir = tmp_dir_path + random_dir
+        self.source_dir = self.clone_dir
         try:
-            self.os_dep.mkdir(self.source_dir)
+            self.os_dep.mkdir(self.clone_dir)
         except:
             raise exceptions.GitHandlerTmpDirCreationException("Error: Unable to create tmp directory.")
 
+# ArchiveHandler reads templates from .tar.gz, .tar.zst and .zip archives
+# The archive is never extracted to a temporary directory. Only the nastifile
+# is pulled out up front, then every entry is streamed straight into the
+# output directory with mutations applied to files as they pass through.
+#
+# The template root is the directory holding the first nastifile found at
+# the top of the archive or one directory down, so archives with a single
+# top level directory, like the ones git hosts produce, work as is.
+class ArchiveHandler:
+    source_dir = ""
+    TMP_DIR = "/tmp/nasti/"
+    FILE_PREFIX = "file://"
+    NASTIFILE_NAME = "nasti.yaml"
+    TAR_MODES = {
+        ".tar.gz": "r|gz",
+        ".tgz": "r|gz",
+        ".tar": "r|",
+    }
+    ZSTD_SUFFIXES = [".tar.zst", ".tzst"]
+    ZIP_SUFFIXES = [".zip"]
+    CHUNK_SIZE = 1024 * 1024
+
+    @classmethod
+    def is_archive(cls, source):
+        suffixes = list(cls.TAR_MODES.keys()) + cls.ZSTD_SUFFIXES + cls.ZIP_SUFFIXES
+        return any(source.lower().endswith(suffix) for suffix in suffixes)
+
+    def __init__(self, source, os_dep=os):
+        self.source = source
+        self.os_dep = os_dep
+        self.path = source[len(self.FILE_PREFIX):] if source.startswith(self.FILE_PREFIX) else source
+        self.root = ""
+
+    # Finds the template root and extracts the nastifile into a tmp directory
+    # so it can be loaded before anything is written to the output directory
+    def run(self):
+        if not self.os_dep.path.isfile(self.path):
+            raise exceptions.ArchiveHandlerSourceNotFileException("Error: " + self.path + " is not a file.")
+        self.__create_tmp_dir()
+        for name, _, read in self.__entries():
+            if not self.__is_root_nastifile(name):
+                continue
+            self.root = name[:-len(self.NASTIFILE_NAME)]
+            with open(self.source_dir + "/" + self.NASTIFILE_NAME, "wb") as f:
+                f.write(read())
+            return
+        raise exceptions.ArchiveHandlerNastiFileNotFoundException(f"Error: {self.path} does not contain a {self.NASTIFILE_NAME}.")
+
+    def clean_up(self):
+        self.os_dep.system('rm -rf ' + self.source_dir)
+
+    # Returns a hash of the archive, archives don't have a commit to go by
+    def get_revision(self):
+        from nasti.lockfile import hash_file
+        return "sha256:" + hash_file(self.path).hexdigest()
+
+    # Streams every entry under the template root into output_dir
+    # If a MutationPlan is given the files it lists are checked and rewritten
+    # on the way through and every one of them has to be in the archive
+    # Symlinks are only created once every file is written so nothing is
+    # ever written through one, and entries under a symlink are refused
+    def extract(self, output_dir, plan=None):
+        planned_files = set(plan.get_files()) if plan else set()
+        real_output_dir = self.os_dep.path.realpath(output_dir)
+        links = {}
+        for file, info, read in self.__template_entries():
+            self.__check_not_under_link(file, links)
+            output_path = output_dir + "/" + file
+            if info.link_target is not None:
+                self.__check_link_target(file, info.link_target)
+                links[file] = info.link_target
+                continue
+            if info.is_dir:
+                self.__check_inside(real_output_dir, file, output_path)
+                self.os_dep.makedirs(output_path, exist_ok=True)
+                continue
+            self.__check_inside(real_output_dir, file, self.os_dep.path.dirname(output_path))
+            self.os_dep.makedirs(self.os_dep.path.dirname(output_path), exist_ok=True)
+            if file in planned_files:
+                self.__extract_planned_file(plan, file, info, output_path)
+                planned_files.remove(file)
+            else:
+                with open(output_path, "wb") as f:
+                    info.stream_to(f)
+            if info.mode:
+                self.os_dep.chmod(output_path, info.mode)
+        self.__extract_symlinks(real_output_dir, output_dir, links)
+        # Anything left wasn't in the archive
+        for file in plan.get_files() if plan else []:
+            if file in planned_files:
+                raise exceptions.MutationFileDoesNotExistException(f"Error: file: {file} does not exist in {self.path}.")
+
+    # Adds every file in the archive to a PlanReport without extracting
+    # anything, in one pass over the archive
+    def plan(self, report):
+        for file, info, read in self.__template_entries():
+            if info.is_dir or info.link_target is not None or file == self.NASTIFILE_NAME:
+                continue
+            if report.is_planned(file):
+                report.add_file(file, decode_text(read()), info.size)
+            else:
+                report.add_copied_file(info.size)
+
+    # Yields (file, mode, read) for every file under the template root in
+    # one pass over the archive, read returns the file's bytes and has to be
+    # called before moving on to the next file
+    # The nastifile and symlinks are left out
+    def files(self):
+        for file, info, read in self.__template_entries():
+            if info.is_dir or info.link_target is not None or file == self.NASTIFILE_NAME:
+                continue
+            yield file, info.mode, read
+
+    # Big files are decoded, checked and rewritten a chunk at a time
+    def __extract_planned_file(self, plan, file, info, output_path):
+        if plan.should_stream(file, info.size):
+            chunks = plan.validate_stream(file, self.__decode_stream(info.member_file, plan.CHUNK_SIZE))
+            with open(output_path, "w") as f:
+                for chunk in plan.rewrite_stream(file, chunks):
+                    f.write(chunk)
+            return
+        text = decode_text(info.read())
+        plan.validate_text(file, text)
+        with open(output_path, "w") as f:
+            f.write(plan.rewrite_text(file, text))
+
+    # The same as decode_text a chunk at a time, streamed tar members can't
+    # be wrapped in a TextIOWrapper because they can't seek
+    def __decode_stream(self, member_file, chunk_size):
+        decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder(locale.getpreferredencoding(False))(), translate=True)
+        while data := member_file.read(chunk_size):
+            yield decoder.decode(data)
+        yield decoder.decode(b"", final=True)
+
+    # Links are checked again once they all exist, because a link can
+    # resolve through links created after it
+    def __extract_symlinks(self, real_output_dir, output_dir, links):
+        for file, link_target in links.items():
+            output_path = output_dir + "/" + file
+            self.__check_inside(real_output_dir, file, self.os_dep.path.dirname(output_path))
+            if self.os_dep.path.lexists(output_path):
+                raise exceptions.ArchiveHandlerUnsafeEntryException(f"Error: {file} is both a link and a directory.")
+            self.os_dep.makedirs(self.os_dep.path.dirname(output_path), exist_ok=True)
+            self.os_dep.symlink(link_target, output_path)
+        for file in links:
+            self.__check_inside(real_output_dir, file, output_dir + "/" + file)
+
+    def __check_link_target(self, file, link_target):
+        target = self.os_dep.path.normpath(self.os_dep.path.join(self.os_dep.path.dirname(file), link_target))
+        if self.os_dep.path.isabs(link_target) or target.startswith(".."):
+            raise exceptions.ArchiveHandlerUnsafeEntryException(f"Error: {file} links outside the template.")
+
+    def __check_not_under_link(self, file, links):
+        parts = file.split("/")
+        for i in range(1, len(parts)):
+            if "/".join(parts[:i]) in links:
+                raise exceptions.ArchiveHandlerUnsafeEntryException(f"Error: {file} is inside the link {'/'.join(parts[:i])}.")
+
+    # Where a path really ends up once every link on the way is followed,
+    # including links that were in the output directory already
+    def __check_inside(self, real_output_dir, file, path):
+        real_path = self.os_dep.path.realpath(path)
+        if real_path != real_output_dir and not real_path.startswith(real_output_dir + "/"):
+            raise exceptions.ArchiveHandlerUnsafeEntryException(f"Error: {file} is outside the template.")
+
+    # Returns the path of an entry relative to the template root, or None
+    # if the entry should be skipped
+    def __get_relative_path(self, name):
+        name = name.rstrip("/")
+        if not name.startswith(self.root) or name == self.root.rstrip("/"):
+            return None
+        file = name[len(self.root):]
+        parts = file.split("/")
+        if self.os_dep.path.isabs(name) or ".." in parts:
+            raise exceptions.ArchiveHandlerUnsafeEntryException(f"Error: {name} is outside the template.")
+        if parts[0] in SKIP_NAMES:
+            return None
+        return file
+
+    def __is_root_nastifile(self, name):
+        parts = name.split("/")
+        return parts[-1] == self.NASTIFILE_NAME and len(parts) <= 2
+
+    # Yields (file, ArchiveEntryInfo, read) for every entry under the template
+    # root, with file relative to the root
+    # Tar archives are streamed so a hard link's target has already gone by
+    # when the link comes up, they're refused rather than left out
+    def __template_entries(self):
+        for name, info, read in self.__entries():
+            file = self.__get_relative_path(name)
+            if file is None:
+                continue
+            if info.hard_link_target is not None:
+                raise exceptions.ArchiveHandlerUnsupportedEntryException(f"Error: {file} is a hard link to {info.hard_link_target}, archived templates can't contain hard links.")
+            yield file, info, read
+
+    # Yields (name, ArchiveEntryInfo, read) for every entry in the archive in
+    # order, read returns the entry's bytes
+    def __entries(self):
+        lower_path = self.path.lower()
+        if any(lower_path.endswith(suffix) for suffix in self.ZIP_SUFFIXES):
+            yield from self.__zip_entries()
+            return
+        with open(self.path, "rb") as raw_file:
+            if any(lower_path.endswith(suffix) for suffix in self.ZSTD_SUFFIXES):
+                yield from self.__tar_entries(open_zstd(raw_file), "r|")
+                return
+            mode = next(mode for suffix, mode in self.TAR_MODES.items() if lower_path.endswith(suffix))
+            yield from self.__tar_entries(raw_file, mode)
+
+    def __tar_entries(self, fileobj, mode):
+        import tarfile
+        with tarfile.open(fileobj=fileobj, mode=mode) as tar:
+            for member in tar:
+                link_target = member.linkname if member.issym() else None
+                if not (member.isdir() or member.isfile() or member.issym() or member.islnk()):
+                    # Devices and fifos aren't template files
+                    continue
+                member_file = tar.extractfile(member) if member.isfile() else None
+                info = ArchiveEntryInfo(member.isdir(), member.mode & 0o777, link_target, member_file, self.CHUNK_SIZE, member.size)
+                if member.islnk():
+                    info.hard_link_target = member.linkname
+                yield member.name, info, info.read
+
+    def __zip_entries(self):
+        import zipfile
+        with zipfile.ZipFile(self.path) as archive:
+            for member in archive.infolist():
+                # Unix permissions live in the top 16 bits
+                mode = (member.external_attr >> 16) & 0o777
+                is_symlink = stat.S_ISLNK(member.external_attr >> 16)
+                member_file = None if member.is_dir() else archive.open(member)
+                link_target = member_file.read().decode("utf-8") if is_symlink else None
+                info = ArchiveEntryInfo(member.is_dir(), None if is_symlink else mode, link_target, member_file, self.CHUNK_SIZE, member.file_size)
+                yield member.filename, info, info.read
+                if member_file:
+                    member_file.close()
+
+    def __create_tmp_dir(self):
+        try:
+            self.os_dep.makedirs(self.TMP_DIR, exist_ok=True)
+            self.source_dir = self.TMP_DIR + str(uuid.uuid4())
+            self.os_dep.mkdir(self.source_dir)
+        except OSError:
+            raise exceptions.ArchiveHandlerTmpDirCreationException("Error: Unable to create tmp directory.")
+
+# The parts of an archive entry ArchiveHandler needs, whatever the format
+class ArchiveEntryInfo:
+    def __init__(self, is_dir, mode, link_target, member_file, chunk_size, size=0):
+        self.is_dir = is_dir
+        self.size = size
+        self.mode = mode
+        self.link_target = link_target
+        self.member_file = member_file
+        self.chunk_size = chunk_size
+        self.hard_link_target = None
+
+    def read(self):
+        return self.member_file.read()
+
+    def stream_to(self, output_file):
+        shutil.copyfileobj(self.member_file, output_file, self.chunk_size)
+
+# Wraps a file object in a zstd decompressor
+# Python only ships zstd support from 3.14 so the zstandard package is used
+# when it's installed
+def open_zstd(fileobj):
+    try:
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(fileobj)
+    except ImportError:
+        pass
+    try:
+        from compression import zstd
+        return zstd.ZstdFile(fileobj)
+    except ImportError:
+        raise exceptions.ArchiveHandlerUnsupportedFormatException("Error: .tar.zst templates need Python 3.14 or the zstandard package.")
+
 class LocalDirectoryHandler:
     source_dir = ""
     def __init__(self, source, os_dep=os):
@@ -75,6 +431,10 @@ class LocalDirectoryHandler:
     def clean_up(self):
         pass
 
+    # A directory can change at any time so there's nothing to pin it to
+    def get_revision(self):
+        return None
+
     def __validate_source_dir(self):
         if not self.os_dep.path.isdir(self.source):
             raise exceptions.LocalDirHandlerSourceNotDirException("Error: " + self.source + " is not a directory.")
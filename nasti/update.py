@@ -0,0 +1,158 @@
+from nasti.source_handlers import SourceHandlerResolver, ArchiveHandler, HelpHandler
+from nasti.nastifile import NastiFile
+from nasti.plan import decode_text, encode_text
+from nasti.lockfile import Lockfile, walk_template_dir, hash_input, hash_file, hash_bytes
+import nasti.config_cache as config_cache
+import nasti.exceptions as exceptions
+
+# NastiUpdate applies changes to a template to a project generated from it
+# The project's lockfile has the answers it was generated with and a hash of
+# the inputs of every file, so only files whose template contents or
+# replacements changed are written again. A file that's been edited in the
+# project since is a conflict and is left alone unless forced. Hooks aren't
+# run again.
+class NastiUpdate:
+
+    def __init__(self, opts={}):
+        # Dependency injection
+        self.os_dep = opts["os_dep"]
+        self.open_dep = opts["open_dep"]
+        self.print_dep = opts["print_dep"]
+        self.help_text = opts["help_text"]
+
+        self.project_dir = opts["project_dir"]
+        # The template to update from, defaults to the one in the lockfile
+        self.source = None
+        if "source" in opts:
+            self.source = opts["source"]
+        # Answers to add or change, anything else is answered the same
+        # way as last time
+        self.answers = {}
+        if "answers" in opts:
+            self.answers = opts["answers"]
+        # Overwrite files that were edited in the project
+        self.force = False
+        if "force" in opts:
+            self.force = opts["force"]
+        self.git_cache = None
+        if "git_cache" in opts:
+            self.git_cache = opts["git_cache"]
+        self.config_cache = config_cache.memory_cache
+        if "config_cache" in opts:
+            self.config_cache = opts["config_cache"]
+
+    # Returns an UpdateResult
+    def run(self):
+        lockfile = Lockfile.load(self.project_dir, self.os_dep, self.open_dep)
+        source = self.source or lockfile.source
+        answers = dict(lockfile.answers)
+        answers.update(self.answers)
+        handler = SourceHandlerResolver(source, self.help_text, self.os_dep, self.print_dep, self.git_cache).resolve()
+        if isinstance(handler, HelpHandler):
+            raise exceptions.LockfileInvalidException(f"Error: Unable to resolve {source}.")
+        try:
+            handler.run()
+            revision = handler.get_revision()
+            # The same commit with the same answers can't change anything
+            if revision and source == lockfile.source and revision == lockfile.revision and answers == lockfile.answers:
+                return UpdateResult(up_to_date=True)
+            return self.__update(handler, lockfile, Lockfile(source, revision), answers)
+        finally:
+            handler.clean_up()
+
+    def __update(self, handler, old_lockfile, new_lockfile, answers):
+        # Every answer comes from the lockfile or the caller
+        nasti_file = NastiFile({
+            "path": handler.source_dir,
+            "os_dep": self.os_dep,
+            "open_dep": self.open_dep,
+            "print_dep": self.print_dep,
+            "silent_mode": True,
+            "silent_opts": answers,
+            "config_cache": self.config_cache,
+        })
+        nasti_file.load()
+        # The files are checked as they're read
+        nasti_file.validate_mutations(check_files=False)
+        nasti_file.run_globals()
+        plan = nasti_file.plan_mutations()
+        new_lockfile.answers = nasti_file.get_answers(plan)
+        result = UpdateResult()
+        for file, mode, read in self.__template_files(handler):
+            self.__update_file(plan, file, mode, read(), old_lockfile.get_file(file), new_lockfile, result)
+        for file in plan.get_files():
+            if file not in new_lockfile.files:
+                raise exceptions.MutationFileDoesNotExistException(f"Error: file: {file} does not exist in {new_lockfile.source}.")
+        for file, entry in old_lockfile.files.items():
+            if file not in new_lockfile.files:
+                self.__remove_file(file, entry, result)
+        new_lockfile.save(self.project_dir, self.os_dep, self.open_dep)
+        return result
+
+    def __update_file(self, plan, file, mode, data, entry, new_lockfile, result):
+        replacements = plan.files.get(file, [])
+        input_hash = hash_input(data, replacements)
+        if entry and entry["input"] == input_hash:
+            new_lockfile.files[file] = entry
+            return
+        if file in plan.files:
+            text = decode_text(data)
+            plan.validate_text(file, text)
+            data = encode_text(plan.rewrite_text(file, text))
+        output_hash = hash_bytes(data)
+        output_path = self.project_dir + "/" + file
+        current_hash = hash_file(output_path, self.open_dep).hexdigest() if self.os_dep.path.isfile(output_path) else None
+        if not self.force:
+            # Files removed from the project stay removed
+            if entry and current_hash is None:
+                new_lockfile.add_file(file, input_hash, None)
+                return
+            # Edited since it was generated, or not generated by NASTI
+            if current_hash is not None and current_hash != output_hash and (entry is None or current_hash != entry["output"]):
+                result.conflicts.append(file)
+                if entry:
+                    # Tried again next time
+                    new_lockfile.files[file] = entry
+                return
+        new_lockfile.add_file(file, input_hash, output_hash)
+        if current_hash == output_hash:
+            return
+        self.os_dep.makedirs(self.os_dep.path.dirname(output_path), exist_ok=True)
+        with self.open_dep(output_path, 'wb') as f:
+            f.write(data)
+        if mode:
+            self.os_dep.chmod(output_path, mode)
+        if current_hash is None:
+            result.added.append(file)
+        else:
+            result.updated.append(file)
+
+    # Files that are no longer in the template are removed from the project
+    # unless they were edited
+    def __remove_file(self, file, entry, result):
+        output_path = self.project_dir + "/" + file
+        if not self.os_dep.path.isfile(output_path):
+            return
+        if not self.force and hash_file(output_path, self.open_dep).hexdigest() != entry["output"]:
+            result.conflicts.append(file)
+            return
+        self.os_dep.remove(output_path)
+        result.removed.append(file)
+
+    def __template_files(self, handler):
+        if isinstance(handler, ArchiveHandler):
+            return handler.files()
+        return walk_template_dir(handler.source_dir, self.os_dep, self.open_dep)
+
+# What an update changed in the project
+class UpdateResult:
+    def __init__(self, up_to_date=False):
+        self.up_to_date = up_to_date
+        self.added = []
+        self.updated = []
+        self.removed = []
+        # Files that were edited in the project and left alone
+        self.conflicts = []
+
+    def is_changed(self):
+        return bool(self.added or self.updated or self.removed)
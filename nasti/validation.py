@@ -1,4 +1,3 @@
-import validators
 import re
 import nasti.exceptions as exceptions
 
@@ -6,13 +5,15 @@ class Validation:
     regex = False
     kind = False
 
+    # Maps each kind to its function in the validators package
+    # validators is slow to import so it's only imported when a kind is used
     kinds = {
-        "domain":       validators.domain,
-        "email":        validators.email,
-        "ip_address":   validators.ip_address,
-        "slug":         validators.slug,
-        "url":          validators.url,
-        "uuid":         validators.uuid,
+        "domain":       "domain",
+        "email":        "email",
+        "ip_address":   "ip_address",
+        "slug":         "slug",
+        "url":          "url",
+        "uuid":         "uuid",
     }
 
     REGEX_KEY = "regex"
@@ -38,7 +39,8 @@ class Validation:
         return bool(re.match(self.regex, input_text))
     
     def __is_valid_kind(self, input_text):
-        return bool(self.kinds[self.kind](input_text))
+        import validators
+        return bool(getattr(validators, self.kinds[self.kind])(input_text))
 
     def __verify_known_kind(self, kind):
         if not kind in self.kinds:
@@ -0,0 +1,190 @@
+import os
+import time
+import errno
+import select
+import struct
+from nasti.index import SKIP_NAMES
+
+# Watchers wait for files in a template to change and return the paths
+# that changed relative to the template. A path can be a file or a
+# directory, a directory means anything under it may have changed and ""
+# means the whole template might have.
+
+# Returns an InotifyWatcher where inotify is available and a
+# PollingWatcher everywhere else, or if poll is set
+def make_watcher(path, os_dep=os, poll=False, interval=None):
+    if not poll:
+        try:
+            return InotifyWatcher(path, os_dep)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(path, os_dep, interval if interval else PollingWatcher.INTERVAL)
+
+# PollingWatcher stats every file in the template each interval and
+# compares mtime, size and inode with the last time
+class PollingWatcher:
+    INTERVAL = 0.5
+
+    def __init__(self, path, os_dep=os, interval=INTERVAL, sleep_dep=time.sleep):
+        # Dependency injection
+        self.os_dep = os_dep
+        self.sleep_dep = sleep_dep
+        self.path = path
+        self.interval = interval
+        self.snapshot = self.__take_snapshot()
+
+    # Blocks until something changes and returns a set of what did
+    def wait(self):
+        while True:
+            self.sleep_dep(self.interval)
+            snapshot = self.__take_snapshot()
+            changed = set(file for file in snapshot.keys() | self.snapshot.keys() if snapshot.get(file) != self.snapshot.get(file))
+            self.snapshot = snapshot
+            if changed:
+                return changed
+
+    def close(self):
+        pass
+
+    def __take_snapshot(self):
+        snapshot = {}
+        self.__walk("", snapshot)
+        return snapshot
+
+    def __walk(self, relative_dir, snapshot):
+        full_dir = self.path + "/" + relative_dir if relative_dir else self.path
+        # Directories can go away while they're walked
+        try:
+            with self.os_dep.scandir(full_dir) as entries:
+                entries = list(entries)
+        except OSError:
+            return
+        for entry in entries:
+            if entry.name in SKIP_NAMES:
+                continue
+            relative_path = relative_dir + "/" + entry.name if relative_dir else entry.name
+            try:
+                if entry.is_dir():
+                    self.__walk(relative_path, snapshot)
+                    continue
+                st = entry.stat()
+            except OSError:
+                continue
+            snapshot[relative_path] = (st.st_mtime_ns, st.st_size, st.st_ino)
+
+# InotifyWatcher has the Linux kernel report changes as they happen, so
+# nothing is stat'ed between them however big the template is
+# Raises OSError or AttributeError if inotify isn't available
+class InotifyWatcher:
+    IN_MODIFY = 0x2
+    IN_ATTRIB = 0x4
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ONLYDIR = 0x1000000
+    IN_ISDIR = 0x40000000
+    IN_CLOEXEC = 0o2000000
+    MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+
+    # struct inotify_event without its name
+    EVENT = struct.Struct("iIII")
+    READ_SIZE = 64 * 1024
+
+    # Editors often write a file in a few steps, changes are collected
+    # until none have come in for this many seconds
+    SETTLE = 0.05
+
+    def __init__(self, path, os_dep=os, settle=SETTLE):
+        import ctypes
+        import ctypes.util
+        # Dependency injection
+        self.os_dep = os_dep
+        self.path = path
+        self.settle = settle
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.get_errno = ctypes.get_errno
+        self.fd = self.libc.inotify_init1(self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise self.__error("inotify_init1")
+        # Maps each watch descriptor to the directory it watches
+        self.dirs = {}
+        try:
+            self.__watch_tree("")
+        except OSError:
+            self.close()
+            raise
+
+    # Blocks until something changes and returns a set of what did
+    def wait(self):
+        changed = set()
+        while True:
+            ready, _, _ = select.select([self.fd], [], [], self.settle if changed else None)
+            if not ready:
+                return changed
+            changed |= self.__read_events()
+
+    def close(self):
+        if self.fd >= 0:
+            self.os_dep.close(self.fd)
+            self.fd = -1
+
+    def __read_events(self):
+        changed = set()
+        data = self.os_dep.read(self.fd, self.READ_SIZE)
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+            name = self.os_dep.fsdecode(data[offset + self.EVENT.size:offset + self.EVENT.size + length].rstrip(b"\0"))
+            offset += self.EVENT.size + length
+            # Events were dropped so anything could have changed
+            if mask & self.IN_Q_OVERFLOW:
+                changed.add("")
+                continue
+            if mask & self.IN_IGNORED:
+                self.dirs.pop(wd, None)
+                continue
+            if wd not in self.dirs or not name or name in SKIP_NAMES:
+                continue
+            relative_path = self.dirs[wd] + "/" + name if self.dirs[wd] else name
+            if mask & self.IN_ISDIR:
+                if mask & self.IN_MOVED_FROM:
+                    self.__unwatch_tree(relative_path)
+                elif mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    self.__watch_tree(relative_path)
+            changed.add(relative_path)
+        return changed
+
+    # Watches a directory and every directory under it
+    def __watch_tree(self, relative_dir):
+        full_dir = self.path + "/" + relative_dir if relative_dir else self.path
+        wd = self.libc.inotify_add_watch(self.fd, self.os_dep.fsencode(full_dir), self.MASK)
+        if wd < 0:
+            # It was removed again before it could be watched
+            if self.get_errno() in (errno.ENOENT, errno.ENOTDIR):
+                return
+            raise self.__error(full_dir)
+        self.dirs[wd] = relative_dir
+        try:
+            with self.os_dep.scandir(full_dir) as entries:
+                entries = list(entries)
+        except OSError:
+            return
+        for entry in entries:
+            if entry.name not in SKIP_NAMES and entry.is_dir(follow_symlinks=False):
+                self.__watch_tree(relative_dir + "/" + entry.name if relative_dir else entry.name)
+
+    # A directory that was moved away keeps its watches under its old
+    # name, so they're dropped and its new name is watched from scratch
+    def __unwatch_tree(self, relative_dir):
+        for wd, watched_dir in list(self.dirs.items()):
+            if watched_dir == relative_dir or watched_dir.startswith(relative_dir + "/"):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.dirs[wd]
+
+    def __error(self, name):
+        code = self.get_errno()
+        return OSError(code, os.strerror(code), name)
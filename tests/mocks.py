@@ -1,3 +1,11 @@
+import os
+import shutil
+import tarfile
+
+NASTIFILES_DIR = os.path.dirname(os.path.abspath(__file__)) + "/nastifiles"
+# Templates with Python files in them get these when the tests are compiled
+SKIP_NAMES = ["__pycache__"]
+
 class MockPath:
     def __init__(self, opts):
         self.exists_ret = opts["exists"] if "exists" in opts else True
@@ -44,4 +52,62 @@ def mock_input(text):
     pass
 
 def mock_failed_open(path, mode):
-    raise OSError("Error: Unable to open file.")
\ No newline at end of file
+    raise OSError("Error: Unable to open file.")
+
+# Copies a template in tests/nastifiles to path, usually in a temporary
+# directory, so a test can change it without touching the original
+# Returns path
+def copy_template(name, path):
+    shutil.copytree(NASTIFILES_DIR + "/" + name, path, ignore=shutil.ignore_patterns(*SKIP_NAMES))
+    return path
+
+# Returns a dictionary of every file in a template in tests/nastifiles to
+# its text, for tests that build a template somewhere else from it
+def read_template(name):
+    root = NASTIFILES_DIR + "/" + name
+    files = {}
+    for dir_path, dir_names, names in os.walk(root):
+        dir_names[:] = [name for name in dir_names if name not in SKIP_NAMES]
+        for file_name in names:
+            path = dir_path + "/" + file_name
+            with open(path, "r") as f:
+                files[os.path.relpath(path, root)] = f.read()
+    return files
+
+# Writes text to a file under root, creating the directories it's in
+def write_file(root, file, text):
+    path = root + "/" + file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+# Returns the text of the file at path
+def read_file(path):
+    with open(path, "r") as f:
+        return f.read()
+
+# Writes the template at source_dir into a .tar.gz at path under a single
+# top level directory, like the archives git hosts produce
+# Returns path
+def make_archive(source_dir, path):
+    skip = lambda info: None if os.path.basename(info.name) in SKIP_NAMES else info
+    with tarfile.open(path, "w:gz") as tar:
+        tar.add(source_dir, "template", filter=skip)
+    return path
+
+# Opts for a Nasti run that takes every answer from answers and doesn't
+# create a git repo, any other opts given are added to them
+def nasti_opts(source, output_dir, answers, **opts):
+    return {
+        "os_dep": os,
+        "open_dep": open,
+        "input_dep": input,
+        "print_dep": lambda *args: None,
+        "help_text": "",
+        "source": source,
+        "output_dir": output_dir,
+        "git_init": False,
+        "silent_mode": True,
+        "silent_opts": answers,
+        **opts,
+    }
@@ -0,0 +1 @@
+print('great_app')
@@ -0,0 +1,236 @@
+import unittest
+import os
+import io
+import tarfile
+import zipfile
+import tempfile
+from unittest import mock
+from nasti.source_handlers import SourceHandlerResolver, ArchiveHandler
+from nasti.nasti import Nasti
+from nasti.plan import MutationPlan
+from nasti.mutation import Mutation
+import nasti.exceptions as exceptions
+import tests.mocks as mocks
+
+class ArchiveTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.output_dir = self.tmp_dir.name + "/output"
+        self.handler = None
+        self.files = mocks.read_template("archive")
+        # git won't keep a .git directory in tests/nastifiles
+        self.files[".git/HEAD"] = "ref: refs/heads/master\n"
+
+    def tearDown(self):
+        if self.handler and self.handler.source_dir:
+            self.handler.clean_up()
+        self.tmp_dir.cleanup()
+
+    # Writes files into a .tar.gz under a single top level directory
+    # like the archives git hosts produce
+    # links maps symlinks to their targets, files listed after them are
+    # added after them
+    # hard_links maps hard links to the archive member they link to
+    def make_tar(self, files, name="template.tar.gz", prefix="template-main/", links={}, after_links={}, hard_links={}):
+        path = self.tmp_dir.name + "/" + name
+        with tarfile.open(path, "w:gz") as tar:
+            self.add_files(tar, prefix, files)
+            for link, target in links.items():
+                info = tarfile.TarInfo(prefix + link)
+                info.type = tarfile.SYMTYPE
+                info.linkname = target
+                tar.addfile(info)
+            for link, target in hard_links.items():
+                info = tarfile.TarInfo(prefix + link)
+                info.type = tarfile.LNKTYPE
+                info.linkname = prefix + target
+                tar.addfile(info)
+            self.add_files(tar, prefix, after_links)
+        return path
+
+    def add_files(self, tar, prefix, files):
+        for file, text in files.items():
+            data = text.encode("utf-8")
+            info = tarfile.TarInfo(prefix + file)
+            info.size = len(data)
+            info.mode = 0o755 if file.endswith(".sh") else 0o644
+            tar.addfile(info, io.BytesIO(data))
+
+    def make_zip(self, files, name="template.zip"):
+        path = self.tmp_dir.name + "/" + name
+        with zipfile.ZipFile(path, "w") as archive:
+            for file, text in files.items():
+                archive.writestr(file, text)
+        return path
+
+    def make_plan(self):
+        mutation = Mutation({
+            "name": "app_name",
+            "prompt": "App Name",
+            "replace": "example_app",
+            "files": ["main.txt", "nested/config.txt"],
+        }, self.handler.source_dir)
+        plan = MutationPlan(self.handler.source_dir, output_path=self.output_dir)
+        plan.add(mutation, "my_app")
+        return plan
+
+class TestArchiveHandler(ArchiveTestCase):
+    def test_is_archive(self):
+        assert ArchiveHandler.is_archive("template.tar.gz")
+        assert ArchiveHandler.is_archive("file:///tmp/template.TGZ")
+        assert ArchiveHandler.is_archive("template.tar.zst")
+        assert ArchiveHandler.is_archive("template.zip")
+        assert not ArchiveHandler.is_archive("git@github.com:org/repo.git")
+        assert not ArchiveHandler.is_archive("templates/api")
+
+    def test_resolver(self):
+        handler = SourceHandlerResolver("file:///tmp/template.tar.gz", "").resolve()
+        assert isinstance(handler, ArchiveHandler)
+        assert handler.path == "/tmp/template.tar.gz"
+
+    def test_run_extracts_nastifile(self):
+        self.handler = ArchiveHandler(self.make_tar(self.files))
+        self.handler.run()
+        assert self.handler.root == "template-main/"
+        assert os.listdir(self.handler.source_dir) == ["nasti.yaml"]
+
+    def test_run_without_nastifile(self):
+        files = {"main.txt": "example_app\n"}
+        self.handler = ArchiveHandler(self.make_tar(files))
+        with self.assertRaises(exceptions.ArchiveHandlerNastiFileNotFoundException):
+            self.handler.run()
+
+    def test_run_missing_archive(self):
+        handler = ArchiveHandler(self.tmp_dir.name + "/missing.tar.gz")
+        with self.assertRaises(exceptions.ArchiveHandlerSourceNotFileException):
+            handler.run()
+
+    def test_extract(self):
+        files = dict(self.files)
+        files["run.sh"] = "exit 0\n"
+        self.handler = ArchiveHandler(self.make_tar(files))
+        self.handler.run()
+        self.handler.extract(self.output_dir)
+        assert mocks.read_file(self.output_dir + "/main.txt") == "example_app\n"
+        assert mocks.read_file(self.output_dir + "/nested/untouched.txt") == "leave me be\n"
+        assert os.stat(self.output_dir + "/run.sh").st_mode & 0o777 == 0o755
+        assert not os.path.exists(self.output_dir + "/.git")
+
+    def test_extract_with_plan(self):
+        self.handler = ArchiveHandler(self.make_tar(self.files))
+        self.handler.run()
+        self.handler.extract(self.output_dir, self.make_plan())
+        assert mocks.read_file(self.output_dir + "/main.txt") == "my_app\n"
+        assert mocks.read_file(self.output_dir + "/nested/config.txt") == "name=my_app\n"
+        assert mocks.read_file(self.output_dir + "/nested/untouched.txt") == "leave me be\n"
+
+    def test_extract_zip_with_plan(self):
+        self.handler = ArchiveHandler(self.make_zip(self.files))
+        self.handler.run()
+        assert self.handler.root == ""
+        self.handler.extract(self.output_dir, self.make_plan())
+        assert mocks.read_file(self.output_dir + "/main.txt") == "my_app\n"
+        assert mocks.read_file(self.output_dir + "/nested/config.txt") == "name=my_app\n"
+
+    def test_extract_streams_big_files(self):
+        files = dict(self.files)
+        files["main.txt"] = "example_app\n" * 100
+        for archive in [self.make_tar(files), self.make_zip(files)]:
+            self.handler = ArchiveHandler(archive)
+            self.handler.run()
+            with mock.patch.object(MutationPlan, "STREAM_SIZE", 1), mock.patch.object(MutationPlan, "CHUNK_SIZE", 5):
+                self.handler.extract(self.output_dir, self.make_plan())
+            assert mocks.read_file(self.output_dir + "/main.txt") == "my_app\n" * 100
+            assert mocks.read_file(self.output_dir + "/nested/config.txt") == "name=my_app\n"
+            self.handler.clean_up()
+
+    def test_extract_streamed_file_missing_replace(self):
+        files = dict(self.files)
+        files["main.txt"] = "nothing to see here\n" * 100
+        self.handler = ArchiveHandler(self.make_tar(files))
+        self.handler.run()
+        with mock.patch.object(MutationPlan, "STREAM_SIZE", 1):
+            with self.assertRaises(exceptions.MutationFileDoesNotContainReplacementStringException):
+                self.handler.extract(self.output_dir, self.make_plan())
+
+    def test_extract_file_missing_replace(self):
+        files = dict(self.files)
+        files["main.txt"] = "nothing to see here\n"
+        self.handler = ArchiveHandler(self.make_tar(files))
+        self.handler.run()
+        with self.assertRaises(exceptions.MutationFileDoesNotContainReplacementStringException):
+            self.handler.extract(self.output_dir, self.make_plan())
+
+    def test_extract_file_missing(self):
+        files = dict(self.files)
+        del files["nested/config.txt"]
+        self.handler = ArchiveHandler(self.make_tar(files))
+        self.handler.run()
+        with self.assertRaises(exceptions.MutationFileDoesNotExistException):
+            self.handler.extract(self.output_dir, self.make_plan())
+
+    def test_extract_rejects_parent_paths(self):
+        files = dict(self.files)
+        files["../escaped.txt"] = "gotcha\n"
+        self.handler = ArchiveHandler(self.make_tar(files, prefix=""))
+        self.handler.run()
+        with self.assertRaises(exceptions.ArchiveHandlerUnsafeEntryException):
+            self.handler.extract(self.output_dir)
+        assert not os.path.exists(self.tmp_dir.name + "/escaped.txt")
+
+    # sub/up is the output directory and sub/up/l its parent, so writing
+    # through both would put ESCAPED.txt next to the output directory
+    def test_extract_rejects_paths_through_links(self):
+        links = {"sub/up": "..", "sub/up/l": ".."}
+        self.handler = ArchiveHandler(self.make_tar(self.files, links=links, after_links={"sub/up/l/ESCAPED.txt": "gotcha\n"}))
+        self.handler.run()
+        with self.assertRaises(exceptions.ArchiveHandlerUnsafeEntryException):
+            self.handler.extract(self.output_dir)
+        assert not os.path.exists(self.tmp_dir.name + "/ESCAPED.txt")
+        assert not os.path.exists(self.output_dir + "/ESCAPED.txt")
+
+    def test_extract_rejects_writing_through_existing_links(self):
+        os.makedirs(self.output_dir)
+        os.symlink(self.tmp_dir.name, self.output_dir + "/nested")
+        self.handler = ArchiveHandler(self.make_tar(self.files))
+        self.handler.run()
+        with self.assertRaises(exceptions.ArchiveHandlerUnsafeEntryException):
+            self.handler.extract(self.output_dir)
+        assert not os.path.exists(self.tmp_dir.name + "/config.txt")
+
+    def test_extract_links_inside_template(self):
+        self.handler = ArchiveHandler(self.make_tar(self.files, links={"docs/main.txt": "../main.txt"}))
+        self.handler.run()
+        self.handler.extract(self.output_dir)
+        assert os.readlink(self.output_dir + "/docs/main.txt") == "../main.txt"
+        assert mocks.read_file(self.output_dir + "/docs/main.txt") == "example_app\n"
+
+    def test_rejects_hard_links(self):
+        self.handler = ArchiveHandler(self.make_tar(self.files, hard_links={"docs/main.txt": "main.txt"}))
+        self.handler.run()
+        with self.assertRaisesRegex(exceptions.ArchiveHandlerUnsupportedEntryException, "docs/main.txt"):
+            self.handler.extract(self.output_dir)
+        with self.assertRaisesRegex(exceptions.ArchiveHandlerUnsupportedEntryException, "docs/main.txt"):
+            list(self.handler.files())
+
+class TestNastiArchive(ArchiveTestCase):
+    def run_nasti(self, source):
+        nasti = Nasti(mocks.nasti_opts(source, self.output_dir, {"app_name": "my_app"}))
+        nasti.run()
+        return nasti
+
+    def test_run(self):
+        nasti = self.run_nasti(self.make_tar(self.files))
+        assert mocks.read_file(self.output_dir + "/main.txt") == "my_app\n"
+        assert mocks.read_file(self.output_dir + "/nested/config.txt") == "name=my_app\n"
+        assert mocks.read_file(self.output_dir + "/nested/untouched.txt") == "leave me be\n"
+        assert not os.path.exists(self.output_dir + "/nasti.yaml")
+        # The extracted nastifile is cleaned up too
+        assert not os.path.exists(nasti.handler.source_dir)
+
+    def test_run_invalid_template(self):
+        files = dict(self.files)
+        files["main.txt"] = "nothing to see here\n"
+        with self.assertRaises(exceptions.MutationFileDoesNotContainReplacementStringException):
+            self.run_nasti(self.make_tar(files))
+        assert not os.path.exists(self.output_dir)
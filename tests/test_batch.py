@@ -0,0 +1,107 @@
+import unittest
+import os
+import json
+import tempfile
+import asyncio
+from unittest import mock
+import yaml
+from nasti.batch import NastiBatch, load_answer_sets, get_output_dirs
+import nasti.exceptions as exceptions
+import tests.mocks as mocks
+
+ANSWER_SETS = [
+    {"app_name": "First App", "owner": "alice"},
+    {"app_name": "Second App", "owner": "bob"},
+    {"app_name": "Third App", "owner": "carol"},
+]
+
+class TestNastiBatch(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.source_dir = self.tmp_dir.name + "/template"
+        self.dest_dir = self.tmp_dir.name + "/projects"
+        mocks.copy_template("batch", self.source_dir)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def make_batch(self, answer_sets, output_dirs, jobs=2):
+        return NastiBatch({
+            "os_dep": os,
+            "open_dep": open,
+            "print_dep": lambda *args: None,
+            "help_text": "",
+            "source": self.source_dir,
+            "answer_sets": answer_sets,
+            "output_dirs": output_dirs,
+            "git_init": False,
+            "jobs": jobs,
+        })
+
+    def test_run(self):
+        output_dirs = get_output_dirs(ANSWER_SETS, self.dest_dir)
+        with mock.patch("yaml.load", wraps=yaml.load) as load:
+            results = self.make_batch(ANSWER_SETS, output_dirs).run()
+        # The nastifile is only parsed once for the whole batch
+        assert load.call_count <= 1
+        assert results == [(output_dir, None) for output_dir in output_dirs]
+        assert mocks.read_file(self.dest_dir + "/1/main.txt") == "first_app by alice\n"
+        assert mocks.read_file(self.dest_dir + "/2/main.txt") == "second_app by bob\n"
+        assert mocks.read_file(self.dest_dir + "/3/nested/owner.txt") == "carol\n"
+        assert mocks.read_file(self.dest_dir + "/3/untouched.txt") == "leave me be\n"
+        assert not os.path.exists(self.dest_dir + "/1/nasti.yaml")
+        # The template is left alone
+        assert mocks.read_file(self.source_dir + "/main.txt") == "example_slug by example_owner\n"
+
+    def test_run_failed_answer_set(self):
+        answer_sets = [ANSWER_SETS[0], {"app_name": "Missing Owner"}]
+        output_dirs = get_output_dirs(answer_sets, self.dest_dir)
+        results = self.make_batch(answer_sets, output_dirs).run()
+        assert results[0] == (output_dirs[0], None)
+        assert isinstance(results[1][1], exceptions.MutationSilentModeException)
+        assert os.path.exists(output_dirs[0])
+        assert not os.path.exists(output_dirs[1])
+
+    def test_run_invalid_template(self):
+        mocks.write_file(self.source_dir, "main.txt", "nothing to replace\n")
+        output_dirs = get_output_dirs(ANSWER_SETS, self.dest_dir)
+        with self.assertRaises(exceptions.MutationFileDoesNotContainReplacementStringException):
+            self.make_batch(ANSWER_SETS, output_dirs).run()
+        assert not os.path.exists(self.dest_dir)
+
+    def test_run_output_dir_exists(self):
+        output_dirs = get_output_dirs(ANSWER_SETS, self.dest_dir)
+        os.makedirs(output_dirs[1])
+        with self.assertRaises(exceptions.NastiBatchOutputDirExistsException):
+            self.make_batch(ANSWER_SETS, output_dirs).run()
+        assert not os.path.exists(output_dirs[0])
+
+    def test_get_output_dirs(self):
+        assert get_output_dirs(ANSWER_SETS, "out") == ["out/1", "out/2", "out/3"]
+        assert get_output_dirs(ANSWER_SETS, "out", "owner") == ["out/alice", "out/bob", "out/carol"]
+        with self.assertRaises(exceptions.NastiBatchAnswersInvalidException):
+            get_output_dirs([{"owner": "../escape"}], "out", "owner")
+        with self.assertRaises(exceptions.NastiBatchAnswersInvalidException):
+            get_output_dirs([{"app_name": "No Owner"}], "out", "owner")
+
+    def test_load_answer_sets(self):
+        path = self.tmp_dir.name + "/answers.jsonl"
+        with open(path, "w") as f:
+            f.write("\n".join(json.dumps(answers) for answers in ANSWER_SETS) + "\n\n")
+        assert load_answer_sets(path) == ANSWER_SETS
+
+    def test_load_answer_sets_invalid(self):
+        path = self.tmp_dir.name + "/answers.jsonl"
+        for text in ['{"owner": "alice"}\n{"owner": 1}\n', '{"owner": \n', '\n']:
+            with open(path, "w") as f:
+                f.write(text)
+            with self.assertRaises(exceptions.NastiBatchAnswersInvalidException):
+                load_answer_sets(path)
+
+    def test_run_async(self):
+        output_dirs = get_output_dirs(ANSWER_SETS, self.dest_dir, "owner")
+        results = asyncio.run(self.make_batch(ANSWER_SETS, output_dirs).run_async())
+        assert results == [(output_dir, None) for output_dir in output_dirs]
+        assert mocks.read_file(self.dest_dir + "/alice/main.txt") == "first_app by alice\n"
+        assert mocks.read_file(self.dest_dir + "/carol/nested/owner.txt") == "carol\n"
+        assert mocks.read_file(self.dest_dir + "/bob/untouched.txt") == "leave me be\n"
@@ -0,0 +1,78 @@
+import unittest
+import os
+import tempfile
+from benchmarks.generator import TemplateSpec, generate_template, make_bare_repo
+from benchmarks.suite import find_regressions, run_benchmarks, MIN_SLACK
+from nasti.nastifile import NastiFile
+import nasti.config_cache as config_cache
+
+class TestTemplateGenerator(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.template_dir = self.tmp_dir.name + "/template"
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def load_nasti_file(self):
+        nasti_file = NastiFile({
+            "path": self.template_dir,
+            "os_dep": os,
+            "open_dep": open,
+            "print_dep": lambda *args: None,
+            "config_cache": config_cache.NastiFileCache(),
+        })
+        nasti_file.load()
+        return nasti_file
+
+    def test_template_matches_spec(self):
+        spec = TemplateSpec(files=30, file_size=500, mutations=4, fan_out=10, depth=2)
+        generate_template(self.template_dir, spec)
+        files = spec.get_files()
+        assert all(file.count("/") == 2 for file in files)
+        for file in files:
+            assert os.path.getsize(self.template_dir + "/" + file) >= 500
+        nasti_file = self.load_nasti_file()
+        mutations = nasti_file.config["mutations"]
+        assert len(mutations) == 4
+        assert all(len(mutation["files"]) == 10 for mutation in mutations)
+        # Every mutation's token is in every file it references
+        nasti_file.validate_mutations()
+        # And nowhere else
+        assert nasti_file.find_unmentioned_files().get_results() == []
+
+    def test_fan_out_is_capped_at_file_count(self):
+        spec = TemplateSpec().with_axes(files=5, fan_out=50)
+        assert spec.fan_out == 5
+        generate_template(self.template_dir, spec)
+        self.load_nasti_file().validate_mutations()
+
+    def test_bare_repo(self):
+        generate_template(self.template_dir, TemplateSpec(files=3, fan_out=1, mutations=1))
+        url = make_bare_repo(self.template_dir, self.tmp_dir.name + "/template.git")
+        assert url.startswith("file://")
+        assert os.path.isfile(self.tmp_dir.name + "/template.git/HEAD")
+
+class TestSuite(unittest.TestCase):
+    def test_find_regressions(self):
+        baselines = {
+            "fast": {"seconds": 1.0, "calibration": 1.0},
+            "slow": {"seconds": 1.0, "calibration": 1.0},
+            "tiny": {"seconds": 0.001, "calibration": 1.0},
+        }
+        results = {
+            "fast": {"seconds": 1.2, "calibration": 1.0},
+            "slow": {"seconds": 1.6, "calibration": 1.0},
+            "tiny": {"seconds": 0.001 + MIN_SLACK / 2, "calibration": 1.0},
+            "new": {"seconds": 9.0, "calibration": 1.0},
+        }
+        assert find_regressions(results, baselines, 0.5) == ["slow"]
+        # A machine twice as slow is allowed twice the time
+        results["slow"]["calibration"] = 2.0
+        assert find_regressions(results, baselines, 0.5) == []
+
+    def test_run_benchmarks(self):
+        results = run_benchmarks(["base/nastifile_validate"], repeat=1, print_dep=lambda *args: None)
+        assert list(results) == ["base/nastifile_validate"]
+        assert results["base/nastifile_validate"]["seconds"] > 0
+        assert results["base/nastifile_validate"]["calibration"] > 0
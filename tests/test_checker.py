@@ -0,0 +1,126 @@
+import unittest
+import os
+import shutil
+import tempfile
+from nasti.checker import TemplateChecker
+from nasti.nastifile import NastiFile
+import nasti.config_cache as config_cache
+import tests.mocks as mocks
+
+class TestTemplateChecker(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.template_dir = self.tmp_dir.name + "/template"
+        mocks.copy_template("great_app", self.template_dir)
+        self.nastifile = mocks.read_template("great_app")["nasti.yaml"]
+        self.opened = []
+        self.checker = TemplateChecker(NastiFile({
+            "path": self.template_dir,
+            "os_dep": os,
+            "open_dep": self.counting_open,
+            "print_dep": lambda *args: None,
+            "config_cache": config_cache.NastiFileCache(),
+        }))
+        self.checker.check_all()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, file, text):
+        mocks.write_file(self.template_dir, file, text)
+
+    def counting_open(self, path, mode, errors=None):
+        self.opened.append(os.path.relpath(path, self.template_dir))
+        return open(path, mode, errors=errors)
+
+    def check_changes(self, paths):
+        self.opened = []
+        return self.checker.check_changes(set(paths))
+
+    def get_unmentioned(self):
+        return {result.get_mutation().name: result.get_files() for result in self.checker.get_unmentioned_files().get_results()}
+
+    def test_check_all(self):
+        assert self.checker.is_valid()
+        assert self.get_unmentioned() == {}
+        assert self.checker.files_checked == 3
+        assert self.checker.mutations_checked == 2
+        assert "Nastifile is valid" in self.checker.get_report()
+
+    def test_changed_file_is_the_only_one_read(self):
+        self.write("main.py", "print('renamed')\n")
+        assert self.check_changes(["main.py"])
+        assert set(self.opened) == {"main.py"}
+        assert not self.checker.is_valid()
+        assert [error is not None for error in self.checker.errors] == [True, False]
+        assert "does not contain great_app" in self.checker.get_report()
+        # Putting it back fixes it
+        self.write("main.py", "print('great_app')\n")
+        assert self.check_changes(["main.py"])
+        assert self.checker.is_valid()
+
+    def test_only_affected_mutations_are_checked(self):
+        self.write("docs/guide.md", "somedev wrote this\n")
+        assert self.check_changes(["docs/guide.md"])
+        assert self.opened == ["docs/guide.md"]
+        assert self.checker.mutations_checked == 1
+        assert self.get_unmentioned() == {"owner": ["docs/guide.md"]}
+        # And once the token is gone again so is the result
+        self.write("docs/guide.md", "untouched\n")
+        assert self.check_changes(["docs/guide.md"])
+        assert self.get_unmentioned() == {}
+
+    def test_deleted_files(self):
+        os.remove(self.template_dir + "/README.md")
+        assert self.check_changes(["README.md"])
+        assert all(self.checker.errors)
+        assert "does not exist" in self.checker.get_report()
+
+    def test_directories(self):
+        self.write("src/nested/app.py", "great_app\n")
+        assert self.check_changes(["src"])
+        assert self.get_unmentioned() == {"app_name": ["src/nested/app.py"]}
+        shutil.rmtree(self.template_dir + "/src")
+        assert self.check_changes(["src"])
+        assert self.get_unmentioned() == {}
+
+    def test_irrelevant_changes(self):
+        # An editor's temporary file that's already gone and a file no
+        # mutation looks at
+        assert not self.check_changes(["main.py.swp", ".git/HEAD"])
+        assert self.opened == []
+
+    def test_nastifile_change_keeps_known_tokens(self):
+        self.write("nasti.yaml", self.nastifile.replace("      - README.md\n  - name: owner", "  - name: owner"))
+        assert self.check_changes(["nasti.yaml"])
+        assert set(self.opened) == {"nasti.yaml"}
+        assert self.checker.is_valid()
+        assert self.get_unmentioned() == {"app_name": ["README.md"]}
+
+    def test_nastifile_change_with_new_token_checks_everything(self):
+        self.write("nasti.yaml", self.nastifile + "  - name: note\n    prompt: Note\n    replace: untouched\n    files:\n      - docs/guide.md\n")
+        assert self.check_changes(["nasti.yaml"])
+        assert {"main.py", "README.md", "docs/guide.md"}.issubset(self.opened)
+        assert self.checker.is_valid()
+        assert self.checker.mutations_checked == 3
+
+    def test_broken_nastifile(self):
+        self.write("nasti.yaml", "mutations: [")
+        assert self.check_changes(["nasti.yaml"])
+        assert not self.checker.is_valid()
+        assert "Nastifile is invalid" in self.checker.get_report()
+        # Any change checks everything again until it's fixed
+        self.write("nasti.yaml", self.nastifile)
+        assert self.check_changes(["main.py"])
+        assert self.checker.is_valid()
+
+    def test_matches_validate_and_find(self):
+        self.write("docs/guide.md", "great_app\n")
+        self.write("README.md", "# great_app\n")
+        self.check_changes(["docs/guide.md", "README.md"])
+        nasti_file = NastiFile({"path": self.template_dir, "os_dep": os, "open_dep": open, "config_cache": config_cache.NastiFileCache()})
+        with self.assertRaises(Exception) as context:
+            nasti_file.validate_mutations()
+        assert [str(error) for error in self.checker.errors if error] == [str(context.exception)]
+        found = {result.get_mutation().name: result.get_files() for result in nasti_file.find_unmentioned_files().get_results()}
+        assert self.get_unmentioned() == found
@@ -0,0 +1,31 @@
+import unittest
+from nasti.classifier import FileClassifier, is_binary_data, SNIFF_SIZE
+
+class TestFileClassifier(unittest.TestCase):
+    def test_binary_extensions(self):
+        classifier = FileClassifier()
+        assert classifier.is_binary("assets/logo.PNG")
+        assert classifier.is_binary("fonts/body.woff2")
+        assert not classifier.is_binary("src/main.py")
+        assert not classifier.is_binary("assets/logo.svg")
+
+    def test_extra_extensions(self):
+        classifier = FileClassifier([".min.js", ".LOCK"])
+        assert classifier.is_binary("static/app.min.js")
+        assert classifier.is_binary("poetry.lock")
+        assert not classifier.is_binary("static/app.js")
+
+    def test_remembers_binary_files(self):
+        classifier = FileClassifier()
+        assert not classifier.is_binary("data/blob.bin")
+        classifier.set_binary("data/blob.bin")
+        assert classifier.is_binary("data/blob.bin")
+
+    def test_is_binary_data(self):
+        assert is_binary_data(b"text\0with a nul")
+        assert is_binary_data(b"%PDF-1.7 no nul here")
+        assert is_binary_data(memoryview(b"\x7fELF"))
+        assert not is_binary_data(b"plain text example_app\n")
+        assert not is_binary_data("café".encode("utf-8"))
+        # Only the start of the file is sniffed
+        assert not is_binary_data(b"a" * SNIFF_SIZE + b"\0")
@@ -0,0 +1,134 @@
+import unittest
+import os
+import json
+import tempfile
+from unittest import mock
+import yaml
+from nasti.config_cache import NastiFileCache
+from nasti.nastifile import NastiFile
+import nasti.exceptions as exceptions
+
+NASTIFILE = b"""---
+mutations:
+  - name: "app_name"
+    prompt: "App Name"
+    replace: "example_app"
+    files:
+      - "main.txt"
+"""
+
+class TestNastiFileCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = self.tmp_dir.name + "/cache"
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_load_parses_once(self):
+        cache = NastiFileCache()
+        with mock.patch("yaml.load", wraps=yaml.load) as load:
+            first = cache.load(NASTIFILE)
+            second = cache.load(NASTIFILE)
+        assert load.call_count == 1
+        assert first == second
+        assert first["mutations"][0]["name"] == "app_name"
+
+    def test_load_returns_copies(self):
+        cache = NastiFileCache()
+        config = cache.load(NASTIFILE)
+        config["mutations"][0]["globals"] = {"changed": True}
+        assert "globals" not in cache.load(NASTIFILE)["mutations"][0]
+
+    def test_changed_contents_are_parsed_again(self):
+        cache = NastiFileCache()
+        cache.load(NASTIFILE)
+        config = cache.load(NASTIFILE.replace(b"app_name", b"app_title"))
+        assert config["mutations"][0]["name"] == "app_title"
+
+    def test_validated(self):
+        cache = NastiFileCache()
+        key = cache.get_key(NASTIFILE)
+        assert not cache.is_validated(key)
+        cache.load(NASTIFILE)
+        cache.set_validated(key)
+        assert cache.is_validated(key)
+
+    def test_disk_cache(self):
+        cache = NastiFileCache(self.cache_dir)
+        key = cache.get_key(NASTIFILE)
+        cache.load(NASTIFILE)
+        cache.set_validated(key)
+        assert os.listdir(self.cache_dir) == [key + NastiFileCache.ENTRY_SUFFIX]
+        with open(self.cache_dir + "/" + key + NastiFileCache.ENTRY_SUFFIX) as f:
+            assert json.load(f)["version"] == NastiFileCache.VERSION
+        # A new process starts with an empty memory cache
+        fresh_cache = NastiFileCache(self.cache_dir)
+        with mock.patch("yaml.load") as load:
+            config = fresh_cache.load(NASTIFILE)
+        load.assert_not_called()
+        assert config["mutations"][0]["name"] == "app_name"
+        assert fresh_cache.is_validated(key)
+
+    def test_corrupt_disk_cache(self):
+        cache = NastiFileCache(self.cache_dir)
+        os.makedirs(self.cache_dir)
+        with open(self.cache_dir + "/" + cache.get_key(NASTIFILE) + NastiFileCache.ENTRY_SUFFIX, "wb") as f:
+            f.write(b"not json")
+        assert cache.load(NASTIFILE)["mutations"][0]["name"] == "app_name"
+
+    def test_old_version_disk_cache(self):
+        cache = NastiFileCache(self.cache_dir)
+        os.makedirs(self.cache_dir)
+        with open(self.cache_dir + "/" + cache.get_key(NASTIFILE) + NastiFileCache.ENTRY_SUFFIX, "w") as f:
+            json.dump({"version": NastiFileCache.VERSION - 1, "entry": {"config": {}, "validated": True}}, f)
+        assert cache.load(NASTIFILE)["mutations"][0]["name"] == "app_name"
+        assert not cache.is_validated(cache.get_key(NASTIFILE))
+
+    # Dates and keys that aren't strings don't come back from JSON the same
+    def test_configs_json_cant_hold_stay_in_memory(self):
+        for data in [NASTIFILE + b"released: 2024-01-01\n", NASTIFILE + b"ports:\n  8080: web\n"]:
+            cache = NastiFileCache(self.cache_dir)
+            config = cache.load(data)
+            assert not os.path.exists(self.cache_dir + "/" + cache.get_key(data) + NastiFileCache.ENTRY_SUFFIX)
+            assert cache.load(data) == config
+
+    def test_invalid_yaml(self):
+        with self.assertRaises(yaml.YAMLError):
+            NastiFileCache().load(b"mutations: [")
+
+class TestNastiFileConfigCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        with open(self.tmp_dir.name + "/nasti.yaml", "wb") as f:
+            f.write(NASTIFILE)
+        with open(self.tmp_dir.name + "/main.txt", "w") as f:
+            f.write("example_app")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def make_nasti_file(self, cache):
+        return NastiFile({
+            "path": self.tmp_dir.name,
+            "os_dep": os,
+            "open_dep": open,
+            "config_cache": cache,
+        })
+
+    def test_validate_parses_once(self):
+        cache = NastiFileCache()
+        with mock.patch("yaml.load", wraps=yaml.load) as load:
+            nasti_file = self.make_nasti_file(cache)
+            nasti_file.load()
+            nasti_file.validate_mutations()
+            self.make_nasti_file(cache).validate_mutations()
+        assert load.call_count == 1
+
+    def test_invalid_config_is_not_marked_validated(self):
+        with open(self.tmp_dir.name + "/nasti.yaml", "ab") as f:
+            f.write(b"    unknown: key\n")
+        cache = NastiFileCache()
+        for _ in range(2):
+            with self.assertRaises(exceptions.NastiFileUnknownKeysException):
+                self.make_nasti_file(cache).validate_mutations()
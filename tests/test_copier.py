@@ -0,0 +1,81 @@
+import unittest
+import os
+import tempfile
+from nasti.copier import TemplateCopier
+import nasti.exceptions as exceptions
+import tests.mocks as mocks
+
+class TestTemplateCopier(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.source_dir = self.tmp_dir.name + "/source"
+        self.output_dir = self.tmp_dir.name + "/output"
+        os.makedirs(self.source_dir + "/nested/deeper")
+        os.makedirs(self.source_dir + "/.git")
+        os.makedirs(self.output_dir)
+        self.write("nasti.yaml", "mutations: []")
+        self.write(".env", "APP=example_app")
+        self.write("nested/mutated.txt", "example_app")
+        self.write("nested/deeper/asset.bin", "\0asset")
+        self.write("script.sh", "exit 0")
+        self.write(".git/HEAD", "ref: refs/heads/master")
+        os.chmod(self.source_dir + "/script.sh", 0o755)
+        os.symlink("nested/deeper/asset.bin", self.source_dir + "/asset_link")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, file, text):
+        with open(self.source_dir + "/" + file, "w") as f:
+            f.write(text)
+
+    def test_copy(self):
+        copier = TemplateCopier(self.source_dir, self.output_dir)
+        files = copier.copy()
+        assert files == [".env", "nasti.yaml", "nested/deeper/asset.bin", "nested/mutated.txt", "script.sh"]
+        assert mocks.read_file(self.output_dir + "/.env") == "APP=example_app"
+        assert mocks.read_file(self.output_dir + "/nested/deeper/asset.bin") == "\0asset"
+        assert not os.path.exists(self.output_dir + "/.git")
+        assert os.readlink(self.output_dir + "/asset_link") == "nested/deeper/asset.bin"
+        assert os.stat(self.output_dir + "/script.sh").st_mode & 0o777 == 0o755
+        assert os.stat(self.output_dir + "/nested/mutated.txt").st_nlink == 1
+
+    def test_copy_single_job(self):
+        copier = TemplateCopier(self.source_dir, self.output_dir, jobs=1)
+        copier.copy()
+        assert mocks.read_file(self.output_dir + "/nested/mutated.txt") == "example_app"
+
+    def test_open_dep(self):
+        opened = []
+        def counting_open(path, mode):
+            opened.append((os.path.relpath(path, self.tmp_dir.name), mode))
+            return open(path, mode)
+        TemplateCopier(self.source_dir, self.output_dir, os, counting_open, jobs=1).copy()
+        assert ("source/script.sh", "rb") in opened
+        assert ("output/script.sh", "wb") in opened
+        assert os.stat(self.output_dir + "/script.sh").st_mode & 0o777 == 0o755
+
+    def test_hardlink(self):
+        copier = TemplateCopier(self.source_dir, self.output_dir, mode=TemplateCopier.HARDLINK_MODE)
+        copier.copy(["nested/mutated.txt"])
+        asset_stat = os.stat(self.output_dir + "/nested/deeper/asset.bin")
+        assert asset_stat.st_ino == os.stat(self.source_dir + "/nested/deeper/asset.bin").st_ino
+        mutated_stat = os.stat(self.output_dir + "/nested/mutated.txt")
+        assert mutated_stat.st_ino != os.stat(self.source_dir + "/nested/mutated.txt").st_ino
+        assert mocks.read_file(self.output_dir + "/nested/mutated.txt") == "example_app"
+
+    def test_reflink(self):
+        # Filesystems without reflink support fall back to a regular copy
+        copier = TemplateCopier(self.source_dir, self.output_dir, mode=TemplateCopier.REFLINK_MODE)
+        copier.copy(["nested/mutated.txt"])
+        assert mocks.read_file(self.output_dir + "/nested/deeper/asset.bin") == "\0asset"
+        assert mocks.read_file(self.output_dir + "/nested/mutated.txt") == "example_app"
+
+    def test_unknown_mode(self):
+        with self.assertRaises(exceptions.TemplateCopierUnknownModeException):
+            TemplateCopier(self.source_dir, self.output_dir, mode="teleport")
+
+    def test_copy_fails(self):
+        copier = TemplateCopier(self.source_dir + "/missing", self.output_dir)
+        with self.assertRaises(exceptions.TemplateCopierCopyFailedException):
+            copier.copy()
@@ -0,0 +1,120 @@
+import unittest
+import os
+import tempfile
+import subprocess
+from nasti.git_cache import GitMirrorCache
+from nasti.source_handlers import SourceHandlerResolver, GitHandler
+import nasti.exceptions as exceptions
+import tests.mocks as mocks
+
+GIT = "git -c user.name=nasti -c user.email=nasti@example.com -c init.defaultBranch=main"
+
+# Sets up a local bare repo to clone from over file://
+class GitRemoteTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = self.tmp_dir.name + "/cache"
+        self.remote = self.make_remote("template", "example_app")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    # Creates a bare repo with one commit and returns its file:// url
+    def make_remote(self, name, text):
+        work_dir = f"{self.tmp_dir.name}/{name}_work"
+        bare_dir = f"{self.tmp_dir.name}/{name}.git"
+        os.makedirs(work_dir + "/templates/api")
+        with open(work_dir + "/README.md", "w") as f:
+            f.write(text)
+        with open(work_dir + "/templates/api/app.txt", "w") as f:
+            f.write(text)
+        os.system(f"{GIT} -C {work_dir} init -q && {GIT} -C {work_dir} add -A && {GIT} -C {work_dir} commit -qm init && {GIT} -C {work_dir} tag v1")
+        os.system(f"{GIT} clone -q --bare {work_dir} {bare_dir}")
+        return "file://" + bare_dir
+
+    def push_change(self, name, text):
+        work_dir = f"{self.tmp_dir.name}/{name}_work"
+        with open(work_dir + "/README.md", "w") as f:
+            f.write(text)
+        os.system(f"{GIT} -C {work_dir} commit -qam change && {GIT} -C {work_dir} push -q {self.tmp_dir.name}/{name}.git HEAD:main")
+
+    def git_output(self, args):
+        return subprocess.check_output(f"git {args}", shell=True, text=True).strip()
+
+class TestGitMirrorCache(GitRemoteTestCase):
+    def test_checkout(self):
+        cache = GitMirrorCache(self.cache_dir)
+        cache.checkout(self.remote, self.tmp_dir.name + "/first")
+        assert mocks.read_file(self.tmp_dir.name + "/first/README.md") == "example_app"
+        assert os.path.isdir(cache.get_mirror_path(self.remote))
+
+    def test_checkout_fetches_changes(self):
+        cache = GitMirrorCache(self.cache_dir)
+        cache.checkout(self.remote, self.tmp_dir.name + "/first")
+        self.push_change("template", "changed_app")
+        cache.checkout(self.remote, self.tmp_dir.name + "/second")
+        assert mocks.read_file(self.tmp_dir.name + "/second/README.md") == "changed_app"
+        assert len(cache.get_mirrors()) == 1
+
+    def test_checkout_fails(self):
+        cache = GitMirrorCache(self.cache_dir)
+        with self.assertRaises(exceptions.GitMirrorCacheCloneException):
+            cache.checkout("file://" + self.tmp_dir.name + "/missing.git", self.tmp_dir.name + "/first")
+        assert cache.get_mirrors() == []
+
+    def test_evicts_least_recently_used(self):
+        other_remote = self.make_remote("other", "other_app")
+        cache = GitMirrorCache(self.cache_dir, max_size=0)
+        cache.checkout(self.remote, self.tmp_dir.name + "/first")
+        cache.checkout(other_remote, self.tmp_dir.name + "/second")
+        # The most recently used mirror is always kept
+        mirrors = cache.get_mirrors()
+        assert [mirror[0] for mirror in mirrors] == [cache.get_mirror_path(other_remote)]
+
+    def test_git_handler_uses_cache(self):
+        cache = GitMirrorCache(self.cache_dir)
+        resolver = SourceHandlerResolver(self.remote, "help text", os, print, cache)
+        handler = resolver.resolve()
+        assert isinstance(handler, GitHandler)
+        handler.run()
+        assert mocks.read_file(handler.source_dir + "/README.md") == "example_app"
+        handler.clean_up()
+
+    def test_checkout_ref_and_subdir(self):
+        self.push_change("template", "changed_app")
+        cache = GitMirrorCache(self.cache_dir)
+        cache.checkout(self.remote, self.tmp_dir.name + "/first", "v1", "templates/api")
+        assert mocks.read_file(self.tmp_dir.name + "/first/templates/api/app.txt") == "example_app"
+        assert not os.path.exists(self.tmp_dir.name + "/first/README.md")
+
+class TestGitHandlerFetch(GitRemoteTestCase):
+    # Runs the git handler against a local bare repo without the cache
+    def run_handler(self, source):
+        handler = GitHandler(source, os)
+        handler.run()
+        self.addCleanup(handler.clean_up)
+        return handler
+
+    def test_fetch_default_branch(self):
+        handler = self.run_handler(self.remote)
+        assert mocks.read_file(handler.source_dir + "/README.md") == "example_app"
+        # Only the one commit is fetched
+        assert self.git_output(f"-C {handler.source_dir} rev-list --count HEAD") == "1"
+
+    def test_fetch_tag_and_subdir(self):
+        self.push_change("template", "changed_app")
+        handler = self.run_handler(self.remote + "#v1:templates/api")
+        assert handler.source_dir == handler.clone_dir + "/templates/api"
+        assert mocks.read_file(handler.source_dir + "/app.txt") == "example_app"
+        assert not os.path.exists(handler.clone_dir + "/README.md")
+
+    def test_fetch_commit(self):
+        commit = self.git_output(f"-C {self.tmp_dir.name}/template_work rev-parse HEAD")
+        self.push_change("template", "changed_app")
+        handler = self.run_handler(self.remote + "#" + commit)
+        assert mocks.read_file(handler.source_dir + "/README.md") == "example_app"
+        assert handler.get_revision() == commit
+
+    def test_fetch_missing_subdir(self):
+        with self.assertRaises(exceptions.GitHandlerSubdirNotFoundException):
+            self.run_handler(self.remote + "#main:missing")
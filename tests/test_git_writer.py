@@ -0,0 +1,202 @@
+import unittest
+import os
+import shutil
+import tempfile
+import subprocess
+from unittest import mock
+from nasti.git_writer import GitRepoWriter, IgnoreRules, parse_git_config
+from nasti.nasti import Nasti
+import nasti.exceptions as exceptions
+import tests.mocks as mocks
+
+class TestGitRepoWriter(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.repo_dir = self.tmp_dir.name + "/repo"
+        self.config_path = self.tmp_dir.name + "/gitconfig"
+        with open(self.config_path, "w") as f:
+            f.write("[user]\n\tname = Nasti Test\n\temail = test@example.com\n")
+        # Keep the user's own git config out of the tests
+        self.environ = {
+            "GIT_CONFIG_NOSYSTEM": "1",
+            "GIT_CONFIG_GLOBAL": self.config_path,
+            "HOME": self.tmp_dir.name,
+            "XDG_CONFIG_HOME": self.tmp_dir.name + "/config",
+        }
+        # Written here rather than kept in tests/nastifiles, the .gitignore
+        # would keep git from tracking the files it ignores there
+        self.write_files({
+            "README.md": "# Great App\n",
+            "src/main.py": "print('hello')\n",
+            "src/empty/__init__.py": "",
+            "src/other/__init__.py": "",
+            "run.sh": "#!/bin/sh\necho hi\n",
+            ".gitignore": "build/\n*.log\n!keep.log\n/root_only.txt\n",
+            "build/out.o": "binary\n",
+            "debug.log": "noise\n",
+            "keep.log": "kept\n",
+            "root_only.txt": "ignored\n",
+            "src/root_only.txt": "kept\n",
+        })
+        os.chmod(self.repo_dir + "/run.sh", 0o755)
+        os.symlink("README.md", self.repo_dir + "/link.md")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_files(self, files, root=None):
+        root = root or self.repo_dir
+        for file, text in files.items():
+            mocks.write_file(root, file, text)
+
+    def git(self, cwd, *args):
+        env = dict(os.environ)
+        env.update(self.environ)
+        return subprocess.run(["git", *args], cwd=cwd, env=env, capture_output=True, text=True, check=True).stdout
+
+    def make_writer(self):
+        return GitRepoWriter(self.repo_dir, environ=self.environ, home=self.tmp_dir.name)
+
+    def test_commit_matches_git(self):
+        # git's own view of the same files
+        copy_dir = self.tmp_dir.name + "/copy"
+        shutil.copytree(self.repo_dir, copy_dir, symlinks=True)
+        self.git(copy_dir, "init", "-q")
+        self.git(copy_dir, "add", "-A")
+        expected_tree = self.git(copy_dir, "write-tree").strip()
+
+        commit = self.make_writer().commit("Initial commit")
+        assert self.git(self.repo_dir, "rev-parse", "HEAD").strip() == commit
+        assert self.git(self.repo_dir, "rev-parse", "HEAD^{tree}").strip() == expected_tree
+        self.git(self.repo_dir, "fsck", "--strict")
+        # The index matches the files so nothing shows as changed
+        assert self.git(self.repo_dir, "status", "--porcelain") == ""
+        assert self.git(self.repo_dir, "log", "--format=%an <%ae> %s").strip() == "Nasti Test <test@example.com> Initial commit"
+        files = self.git(self.repo_dir, "ls-files", "-s").splitlines()
+        assert any(line.startswith("100755") and line.endswith("run.sh") for line in files)
+        assert any(line.startswith("120000") and line.endswith("link.md") for line in files)
+        assert not any(line.endswith(("out.o", "debug.log", "\troot_only.txt")) for line in files)
+
+    def test_same_contents_packed_once(self):
+        self.make_writer().commit("Initial commit")
+        # The empty __init__.py files share one blob and their
+        # directories share one tree
+        object_ids = {line.split()[2] for line in self.git(self.repo_dir, "ls-tree", "-r", "-t", "HEAD").splitlines()}
+        assert "src/empty/__init__.py" in self.git(self.repo_dir, "ls-files")
+        # Plus the root tree and the commit
+        assert f"in-pack: {len(object_ids) + 2}" in self.git(self.repo_dir, "count-objects", "-v")
+
+    def test_big_files_are_streamed(self):
+        with open(self.repo_dir + "/big.bin", "wb") as f:
+            f.write(os.urandom(50000))
+        with mock.patch.object(GitRepoWriter, "READ_SIZE", 4096):
+            self.make_writer().commit("Initial commit")
+        self.git(self.repo_dir, "fsck", "--strict")
+        assert self.git(self.repo_dir, "status", "--porcelain") == ""
+
+    def test_default_branch_from_config(self):
+        with open(self.config_path, "a") as f:
+            f.write("[init]\n\tdefaultBranch = main\n")
+        self.make_writer().commit("Initial commit")
+        assert self.git(self.repo_dir, "rev-parse", "--abbrev-ref", "HEAD").strip() == "main"
+
+    def append_config(self, text):
+        with open(self.config_path, "a") as f:
+            f.write(text)
+
+    def test_unsupported_setups_write_nothing(self):
+        setups = [
+            # No identity
+            lambda: open(self.config_path, "w").close(),
+            lambda: self.append_config("[commit]\n\tgpgsign = true\n"),
+            lambda: self.append_config("[include]\n\tpath = other\n"),
+            lambda: self.append_config("[core]\n\tautocrlf = true\n"),
+            lambda: self.append_config("[core]\n\thooksPath = hooks\n"),
+            lambda: self.append_config("[init]\n\ttemplateDir = ~/.git-template\n"),
+            lambda: self.environ.update({"GIT_TEMPLATE_DIR": self.tmp_dir.name + "/git-template"}),
+            lambda: self.write_files({"src/.gitattributes": "* text=auto\n"}),
+            lambda: os.makedirs(self.repo_dir + "/vendor/lib/.git"),
+        ]
+        for setup in setups:
+            self.tearDown()
+            self.setUp()
+            setup()
+            with self.assertRaises(exceptions.GitWriterUnsupportedException):
+                self.make_writer().commit("Initial commit")
+            assert not os.path.exists(self.repo_dir + "/.git")
+
+    def test_nasti_run_with_native_git(self):
+        template_dir = self.tmp_dir.name + "/template"
+        output_dir = self.tmp_dir.name + "/output"
+        self.write_files({
+            "nasti.yaml": "mutations:\n  - name: app_name\n    prompt: App name\n    replace: great_app\n    files:\n      - main.py\n",
+            "main.py": "print('great_app')\n",
+        }, template_dir)
+        nasti = Nasti(mocks.nasti_opts(template_dir, output_dir, {"app_name": "billing"}, git_init=True, native_git=True))
+        with mock.patch.dict(os.environ, self.environ):
+            nasti.run()
+        assert not os.path.exists(output_dir + "/nasti.yaml")
+        assert self.git(output_dir, "show", "HEAD:main.py") == "print('billing')\n"
+        assert self.git(output_dir, "status", "--porcelain") == ""
+
+class TestIgnoreRules(unittest.TestCase):
+    def make_rules(self, *patterns, base_dir=""):
+        rules = IgnoreRules()
+        for pattern in patterns:
+            rules.add_pattern(pattern, base_dir)
+        return rules
+
+    def test_patterns(self):
+        cases = [
+            ("*.log", "a/b/debug.log", False, True),
+            ("*.log", "debug.log.txt", False, False),
+            ("/build", "build", True, True),
+            ("/build", "src/build", True, False),
+            ("build/", "src/build", True, True),
+            ("build/", "src/build", False, False),
+            ("doc/*.txt", "doc/notes.txt", False, True),
+            ("doc/*.txt", "doc/api/notes.txt", False, False),
+            ("**/cache", "a/b/cache", True, True),
+            ("a/**/z", "a/z", False, True),
+            ("a/**/z", "a/b/c/z", False, True),
+            ("out/**", "out/x/y", False, True),
+            ("file[0-9].txt", "file3.txt", False, True),
+            ("file[!0-9].txt", "file3.txt", False, False),
+            ("?.md", "a.md", False, True),
+            ("\\#notes", "#notes", False, True),
+        ]
+        for pattern, path, is_dir, ignored in cases:
+            assert self.make_rules(pattern).is_ignored(path, is_dir) == ignored, (pattern, path)
+
+    def test_last_match_wins(self):
+        rules = self.make_rules("*.log", "!keep.log")
+        assert rules.is_ignored("debug.log", False)
+        assert not rules.is_ignored("keep.log", False)
+
+    def test_deeper_rules_take_precedence(self):
+        rules = self.make_rules("*.txt")
+        child = rules.child()
+        child.add_pattern("!notes.txt", "docs")
+        assert not child.is_ignored("docs/notes.txt", False)
+        assert child.is_ignored("notes.txt", False)
+        assert child.is_ignored("docs/other.txt", False)
+
+class TestParseGitConfig(unittest.TestCase):
+    def test_parse(self):
+        config = parse_git_config(
+            "# comment\n"
+            "[user]\n"
+            "\tname = \"Nasti Dev\"\n"
+            "\temail = dev@example.com ; trailing\n"
+            "[Init]\n"
+            "\tdefaultBranch = trunk\n"
+            "[remote \"origin\"]\n"
+            "\turl = git@example.com:repo.git\n"
+            "[includeIf \"gitdir:~/work/\"]\n"
+            "\tpath = work.gitconfig\n"
+        )
+        assert config["user.name"] == "Nasti Dev"
+        assert config["user.email"] == "dev@example.com"
+        assert config["init.defaultbranch"] == "trunk"
+        assert config["remote.origin.url"] == "git@example.com:repo.git"
+        assert config["include"] == "true"
@@ -157,4 +157,16 @@ class TestHooks(unittest.TestCase):
         # verify the before script was cleaned up
         self.assertEqual(os.path.exists("tests/hooks/before_script.sh"), False)
         # verify the after script was cleaned up
-        self.assertEqual(os.path.exists("tests/hooks/after_script.sh"), False)
\ No newline at end of file
+        self.assertEqual(os.path.exists("tests/hooks/after_script.sh"), False)
+
+    def test_before_script_disables_lazy_mutations(self):
+        nasti_file = NastiFile({
+            "path": "tests/hooks",
+            "output_path": "tests/hooks_output",
+            "os_dep": os,
+            "open_dep": open,
+        })
+        nasti_file.load()
+        # The before script runs in the output dir and may change files there
+        self.assertEqual(nasti_file.hooks.working_dir, "tests/hooks_output")
+        self.assertEqual(nasti_file.is_lazy(), False)
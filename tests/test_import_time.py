@@ -0,0 +1,49 @@
+import unittest
+import os
+import sys
+import subprocess
+
+# Modules that are slow to import and only needed by some code paths
+DEFERRED_MODULES = [
+    "prompt_toolkit",
+    "jinja2",
+    "validators",
+    "asyncio",
+    "rich.console",
+    "tarfile",
+    "zipfile",
+    "concurrent.futures",
+]
+# Importing the CLI has to fit in this many milliseconds
+# Slow machines can raise it with NASTI_IMPORT_BUDGET_MS
+IMPORT_BUDGET_MS = int(os.environ.get("NASTI_IMPORT_BUDGET_MS", "150"))
+
+class TestImportTime(unittest.TestCase):
+    # Each check runs in a fresh interpreter so nothing the other
+    # tests imported is already loaded
+    def run_python(self, *args):
+        return subprocess.run([sys.executable, *args], capture_output=True, text=True, check=True)
+
+    def test_heavy_modules_are_deferred(self):
+        code = (
+            "import sys, json\n"
+            "import nasti.cli\n"
+            "from nasti.nastifile import NastiFile\n"
+            f"print(json.dumps([m for m in {DEFERRED_MODULES!r} if m in sys.modules]))\n"
+        )
+        assert self.run_python("-c", code).stdout.strip() == "[]"
+
+    def test_import_time_budget(self):
+        # The best of a few runs so a busy machine doesn't fail the test
+        import_times = [self.get_import_time_ms("nasti.cli") for _ in range(3)]
+        assert min(import_times) < IMPORT_BUDGET_MS, f"nasti.cli took {min(import_times)}ms to import, the budget is {IMPORT_BUDGET_MS}ms"
+
+    # Returns the cumulative import time of module in milliseconds
+    # as reported by python -X importtime
+    def get_import_time_ms(self, module):
+        stderr = self.run_python("-X", "importtime", "-c", f"import {module}").stderr
+        for line in stderr.splitlines():
+            fields = [field.strip() for field in line.split("|")]
+            if len(fields) == 3 and fields[2] == module:
+                return int(fields[1]) / 1000
+        raise AssertionError(f"{module} wasn't in the import time report")
@@ -0,0 +1,196 @@
+import unittest
+import os
+import time
+import tempfile
+from unittest import mock
+from nasti.index import TemplateIndex
+from nasti.scanner import TemplateScanner
+from nasti.matcher import TokenMatcher
+from nasti.nastifile import NastiFile
+from nasti.copier import TemplateCopier
+import nasti.config_cache as config_cache
+import nasti.exceptions as exceptions
+import tests.mocks as mocks
+
+# Old enough that the index never treats a file as racy
+OLD_MTIME = time.time() - 60
+
+# Copies the template to path with every file OLD_MTIME old
+def copy_old_template(path):
+    mocks.copy_template("great_app", path)
+    for dir_path, _, files in os.walk(path):
+        for file in files:
+            os.utime(dir_path + "/" + file, (OLD_MTIME, OLD_MTIME))
+
+class TestTemplateIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.template_dir = self.tmp_dir.name + "/template"
+        copy_old_template(self.template_dir)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, file, text, mtime=OLD_MTIME):
+        mocks.write_file(self.template_dir, file, text)
+        os.utime(self.template_dir + "/" + file, (mtime, mtime))
+
+    def counting_open(self, opened):
+        def counting_open(path, mode, errors=None):
+            opened.append(path)
+            return open(path, mode, errors=errors)
+        return counting_open
+
+    def scan(self, tokens, opened=None):
+        open_dep = self.counting_open(opened) if opened is not None else open
+        index = TemplateIndex(self.template_dir, os, open_dep)
+        return TemplateScanner(self.template_dir, os, open_dep, index=index).scan(TokenMatcher(tokens))
+
+    def read_files(self, opened):
+        return sorted(os.path.relpath(path, self.template_dir) for path in opened if TemplateIndex.DIR_NAME not in path)
+
+    def test_unchanged_files_are_not_read(self):
+        expected = {"main.py": {"great_app"}, "README.md": {"great_app", "somedev"}}
+        assert self.scan(["great_app", "somedev"]) == expected
+        opened = []
+        assert self.scan(["great_app", "somedev"], opened) == expected
+        assert self.read_files(opened) == []
+
+    def test_changed_files_are_read(self):
+        self.scan(["great_app", "somedev"])
+        self.write("docs/guide.md", "now great_app too\n")
+        self.write("main.py", "print('renamed')\n", OLD_MTIME + 1)
+        opened = []
+        assert self.scan(["great_app", "somedev"], opened) == {
+            "README.md": {"great_app", "somedev"},
+            "docs/guide.md": {"great_app"},
+        }
+        assert self.read_files(opened) == ["docs/guide.md", "main.py"]
+
+    def test_removed_tokens_dont_read_files(self):
+        self.scan(["great_app", "somedev"])
+        opened = []
+        assert self.scan(["somedev"], opened) == {"README.md": {"somedev"}}
+        assert self.read_files(opened) == []
+
+    def test_new_tokens_read_files(self):
+        self.scan(["great_app"])
+        opened = []
+        assert self.scan(["great_app", "untouched"], opened) == {
+            "main.py": {"great_app"},
+            "README.md": {"great_app"},
+            "docs/guide.md": {"untouched"},
+        }
+        assert self.read_files(opened) == ["README.md", "docs/guide.md", "main.py"]
+        # Both are known now, and so is the first token on its own
+        opened = []
+        self.scan(["great_app"], opened)
+        assert self.read_files(opened) == []
+
+    def test_binary_files_are_remembered(self):
+        path = self.template_dir + "/data.bin"
+        with open(path, "wb") as f:
+            f.write(b"\x00great_app\x00")
+        os.utime(path, (OLD_MTIME, OLD_MTIME))
+        assert "data.bin" not in self.scan(["great_app"])
+        opened = []
+        assert "data.bin" not in self.scan(["great_app"], opened)
+        assert self.read_files(opened) == []
+
+    def test_racy_files_are_read_again(self):
+        self.write("main.py", "print('great_app')\n", time.time())
+        self.scan(["great_app"])
+        opened = []
+        self.scan(["great_app"], opened)
+        assert self.read_files(opened) == ["main.py"]
+
+    def test_deleted_files_are_forgotten(self):
+        self.scan(["great_app"])
+        os.remove(self.template_dir + "/main.py")
+        assert self.scan(["great_app"]) == {"README.md": {"great_app"}}
+        index = TemplateIndex(self.template_dir)
+        index.load()
+        assert sorted(index.entries) == ["README.md", "docs/guide.md"]
+
+    def test_index_ignores_itself(self):
+        self.scan(["great_app"])
+        cache_dir = self.template_dir + "/" + TemplateIndex.DIR_NAME
+        with open(cache_dir + "/.gitignore") as f:
+            assert f.read() == "*\n"
+        assert sorted(os.listdir(cache_dir)) == [".gitignore", "index.json"]
+
+    def test_broken_index_is_ignored(self):
+        os.makedirs(self.template_dir + "/" + TemplateIndex.DIR_NAME)
+        with open(self.template_dir + "/" + TemplateIndex.DIR_NAME + "/index.json", "w") as f:
+            f.write("{not json")
+        assert self.scan(["great_app"]) == {"main.py": {"great_app"}, "README.md": {"great_app"}}
+
+    def test_read_only_template_is_scanned(self):
+        with mock.patch.object(TemplateIndex, "save", side_effect=PermissionError("read only")):
+            assert self.scan(["great_app"]) == {"main.py": {"great_app"}, "README.md": {"great_app"}}
+
+    def test_copier_skips_index(self):
+        self.scan(["great_app"])
+        output_dir = self.tmp_dir.name + "/output"
+        files = TemplateCopier(self.template_dir, output_dir).copy()
+        assert not any(TemplateIndex.DIR_NAME in file for file in files)
+        assert not os.path.exists(output_dir + "/" + TemplateIndex.DIR_NAME)
+
+class TestNastiFileIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.template_dir = self.tmp_dir.name + "/template"
+        copy_old_template(self.template_dir)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def make_nasti_file(self, use_index, opened):
+        def counting_open(path, mode, errors=None):
+            opened.append(path)
+            return open(path, mode, errors=errors)
+        return NastiFile({
+            "path": self.template_dir,
+            "os_dep": os,
+            "open_dep": counting_open,
+            "print_dep": lambda *args: None,
+            "config_cache": config_cache.NastiFileCache(),
+            "use_index": use_index,
+        })
+
+    def test_validate_and_find_match_without_index(self):
+        for use_index in [False, True, True]:
+            opened = []
+            nasti_file = self.make_nasti_file(use_index, opened)
+            nasti_file.load()
+            nasti_file.validate_mutations()
+            assert nasti_file.find_unmentioned_files().get_results() == []
+
+    def test_warm_validate_reads_only_the_nastifile(self):
+        nasti_file = self.make_nasti_file(True, [])
+        nasti_file.load()
+        nasti_file.validate_mutations()
+        nasti_file.find_unmentioned_files()
+        opened = []
+        nasti_file = self.make_nasti_file(True, opened)
+        nasti_file.load()
+        nasti_file.validate_mutations()
+        nasti_file.find_unmentioned_files()
+        assert set(path for path in opened if TemplateIndex.DIR_NAME not in path) == {self.template_dir + "/nasti.yaml"}
+
+    def test_changed_file_fails_validation(self):
+        nasti_file = self.make_nasti_file(True, [])
+        nasti_file.load()
+        nasti_file.validate_mutations()
+        with open(self.template_dir + "/main.py", "w") as f:
+            f.write("print('renamed')\n")
+        nasti_file = self.make_nasti_file(True, [])
+        nasti_file.load()
+        with self.assertRaises(exceptions.MutationFileDoesNotContainReplacementStringException):
+            nasti_file.validate_mutations()
+
+    def test_index_is_opt_in(self):
+        nasti_file = self.make_nasti_file(False, [])
+        nasti_file.load()
+        nasti_file.validate_mutations()
+        assert not os.path.exists(self.template_dir + "/" + TemplateIndex.DIR_NAME)
@@ -0,0 +1,124 @@
+import unittest
+import random
+from nasti.matcher import TokenMatcher, ReplacementSet, strings_overlap
+
+class TestTokenMatcher(unittest.TestCase):
+    def test_find(self):
+        matcher = TokenMatcher(["example_app", "example_owner", "missing"])
+        found = matcher.find("example_app belongs to example_owner")
+        assert found == set(["example_app", "example_owner"])
+
+    def test_find_is_literal(self):
+        matcher = TokenMatcher(["app.name", "(group)"])
+        assert matcher.find("appXname group") == set()
+        assert matcher.find("app.name (group)") == set(["app.name", "(group)"])
+
+    def test_find_overlapping_tokens(self):
+        matcher = TokenMatcher(["example", "example_app"])
+        assert matcher.overlapping
+        assert matcher.find("example_app") == set(["example", "example_app"])
+
+    def test_no_tokens(self):
+        matcher = TokenMatcher(["", ""])
+        assert matcher.find("anything") == set()
+        assert matcher.replace("anything", {}) == "anything"
+
+    def test_replace(self):
+        matcher = TokenMatcher(["one", "two"])
+        assert matcher.replace("one two one", {"one": "1", "two": "2"}) == "1 2 1"
+
+    def test_find_stream_across_chunks(self):
+        matcher = TokenMatcher(["example_app", "owner"])
+        assert matcher.find_stream(["my exam", "ple_a", "pp by own", "er"]) == {"example_app", "owner"}
+        assert matcher.find_stream(["example", "_ap"]) == set()
+
+    def test_find_stream_stops_when_everything_is_found(self):
+        read = []
+        def chunks():
+            for chunk in ["example_app", "more", "text"]:
+                read.append(chunk)
+                yield chunk
+        assert TokenMatcher(["example_app"]).find_stream(chunks()) == {"example_app"}
+        assert read == ["example_app"]
+
+    def test_replace_stream_across_chunks(self):
+        matcher = TokenMatcher(["example_app", "app"])
+        chunks = list(matcher.replace_stream(["an example_a", "pp and an a", "pp"], {"example_app": "X", "app": "Y"}))
+        assert "".join(chunks) == "an X and an Y"
+        # Text is handed on as soon as no later chunk can change it
+        assert chunks[0] == "an"
+
+    def test_find_bytes_matches_find(self):
+        rng = random.Random(99)
+        def random_string(min_length, max_length):
+            return "".join(rng.choice("abé") for _ in range(rng.randint(min_length, max_length)))
+        for _ in range(1000):
+            matcher = TokenMatcher([random_string(1, 3) for _ in range(rng.randint(1, 3))])
+            text = random_string(0, 30)
+            assert matcher.can_find_bytes()
+            assert matcher.find_bytes(text.encode("utf-8")) == matcher.find(text), (matcher.tokens, text)
+
+    def test_find_bytes_ignores_undecodable_bytes(self):
+        matcher = TokenMatcher(["example_app", "owner"])
+        assert matcher.find_bytes(b"\xff\xfe example_app \x80") == {"example_app"}
+        assert matcher.find_bytes(memoryview(b"owner")) == {"owner"}
+
+    def test_line_break_tokens_are_found_as_text(self):
+        assert not TokenMatcher(["one\ntwo"]).can_find_bytes()
+
+    def test_strings_overlap(self):
+        assert strings_overlap("abc", "b")
+        assert strings_overlap("abc", "cde")
+        assert strings_overlap("cde", "abc")
+        assert not strings_overlap("abc", "def")
+
+class TestReplacementSet(unittest.TestCase):
+    def apply_sequentially(self, replacements, text):
+        for replace, value in replacements:
+            text = text.replace(replace, value)
+        return text
+
+    def test_single_pass(self):
+        replacements = [("example_app", "my_app"), ("example_owner", "me")]
+        replacement_set = ReplacementSet(replacements)
+        assert replacement_set.single_pass
+        assert replacement_set.apply("example_app by example_owner") == "my_app by me"
+
+    def test_chained_replacements_fall_back(self):
+        replacements = [("example_app", "my_app"), ("my_", "our_")]
+        replacement_set = ReplacementSet(replacements)
+        assert not replacement_set.single_pass
+        assert replacement_set.apply("example_app") == "our_app"
+
+    def test_empty_value_falls_back(self):
+        replacements = [("-", ""), ("ab", "x")]
+        replacement_set = ReplacementSet(replacements)
+        assert not replacement_set.single_pass
+        assert replacement_set.apply("a-b") == "x"
+
+    def test_matches_sequential_replace(self):
+        # Small alphabets make tokens and values collide as often as possible
+        rng = random.Random(1234)
+        def random_string(max_length):
+            return "".join(rng.choice("abc") for _ in range(rng.randint(0, max_length)))
+        for _ in range(2000):
+            replacements = [(random_string(3), random_string(3)) for _ in range(rng.randint(1, 4))]
+            text = random_string(30)
+            expected = self.apply_sequentially(replacements, text)
+            assert ReplacementSet(replacements).apply(text) == expected, (replacements, text)
+
+    def test_apply_stream_matches_sequential_replace(self):
+        rng = random.Random(4321)
+        def random_string(min_length, max_length):
+            return "".join(rng.choice("abc") for _ in range(rng.randint(min_length, max_length)))
+        for _ in range(2000):
+            replacements = [(random_string(1, 3), random_string(0, 3)) for _ in range(rng.randint(1, 4))]
+            text = random_string(0, 40)
+            size = rng.randint(1, 8)
+            chunks = [text[i:i + size] for i in range(0, len(text), size)]
+            expected = self.apply_sequentially(replacements, text)
+            assert "".join(ReplacementSet(replacements).apply_stream(chunks)) == expected, (replacements, text, size)
+
+    def test_empty_tokens_cant_stream(self):
+        assert not ReplacementSet([("", "x")]).can_stream()
+        assert ReplacementSet([("a", "")]).can_stream()
@@ -1,9 +1,12 @@
 import unittest
 from nasti.mutation import Mutation
+from nasti.renderer import TemplateRenderer
 import nasti.exceptions as exceptions
 import tests.mocks as mocks
 import os
 import yaml
+import tempfile
+from unittest import mock
 
 class TestMutation(unittest.TestCase):
     # This tests that the files array is present but empty
@@ -84,6 +87,17 @@ class TestMutation(unittest.TestCase):
         with self.assertRaises(exceptions.MutationFileDoesNotContainReplacementStringException):
             mutation.validate()
     
+    def test_run_file_missing(self):
+        mutation_config = {"name": "app_name", "prompt": "App Name", "replace": "example_app", "default": "my_app", "files": ["missing.txt"]}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Accepted defaults raise the error as it is
+            mutation = Mutation(mutation_config, tmp_dir, os, open, input, lambda x: None, accept_defaults=True)
+            with self.assertRaises(FileNotFoundError):
+                mutation.run()
+            mutation = Mutation(mutation_config, tmp_dir, os, open, input, lambda x: None, silent_mode=True)
+            with self.assertRaises(exceptions.MutationTextReplacementFailedException):
+                mutation.run()
+
     def test_text_replacement_fails(self):
         input_dep = func = lambda x: "bogus_slug"
         print_dep = func = lambda x: None
@@ -160,4 +174,23 @@ class TestMutation(unittest.TestCase):
         mutation_config["globals"] = {config["globals"][0]["name"]: "Test App"}
         mutation = Mutation(mutation_config, "tests/nastifiles/mutation_default_exception", os, open, input_dep, print_dep)
         with self.assertRaises(exceptions.MutationDefaultTemplateInvalidException):
-            mutation.render_default_template()
\ No newline at end of file
+            mutation.render_default_template()
+
+    def test_mutation_default_renders_once(self):
+        input_dep = func = lambda x: ""
+        print_dep = func = lambda x: None
+        #open the yaml file
+        with open("tests/nastifiles/mutation_default_and_globals_simple/nasti.yaml", "r") as f:
+            config = yaml.safe_load(f)
+        mutation_config = config["mutations"][0]
+        mutation_config["globals"] = {config["globals"][0]["name"]: "Test App"}
+        renderer = TemplateRenderer()
+        mutation = Mutation(mutation_config, "tests/nastifiles/mutation_default_and_globals_simple", os, open, input_dep, print_dep, renderer=renderer)
+        with mock.patch.object(renderer, "compile", wraps=renderer.compile) as compile:
+            # The default is shown in the prompt and used again on empty input
+            assert mutation.resolve() == "Test App"
+            assert compile.call_count == 1
+            # New globals render again from the same compiled template
+            mutation_config["globals"]["app_name"] = "Other App"
+            assert mutation.render_default_template() == "Other App"
+        assert len(renderer.templates) == 1
@@ -0,0 +1,85 @@
+import unittest
+import os
+import asyncio
+import tempfile
+from nasti.nasti import Nasti
+import nasti.exceptions as exceptions
+import tests.mocks as mocks
+
+class TestNastiRunAsync(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.source_dir = self.tmp_dir.name + "/template"
+        self.output_dir = self.tmp_dir.name + "/output"
+        mocks.copy_template("app_slug", self.source_dir)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def make_nasti(self, output_dir, lazy=False, **opts):
+        return Nasti(mocks.nasti_opts(self.source_dir, output_dir, {"app_name": "Great App"}, lazy=lazy, **opts))
+
+    def read_tree(self, root):
+        tree = {}
+        for dir_path, _, files in os.walk(root):
+            for file in files:
+                with open(dir_path + "/" + file, "r") as f:
+                    tree[os.path.relpath(dir_path + "/" + file, root)] = f.read()
+        return tree
+
+    def test_run_async_matches_run(self):
+        for lazy in [False, True]:
+            sync_dir = f"{self.tmp_dir.name}/sync_{lazy}"
+            async_dir = f"{self.tmp_dir.name}/async_{lazy}"
+            self.make_nasti(sync_dir, lazy).run()
+            asyncio.run(self.make_nasti(async_dir, lazy).run_async())
+            assert self.read_tree(async_dir) == self.read_tree(sync_dir)
+            assert self.read_tree(async_dir)["nested/slug.txt"] == "slug=great_app\n"
+            assert "nasti.yaml" not in self.read_tree(async_dir)
+
+    def test_run_async_failure_removes_output(self):
+        mocks.write_file(self.source_dir, "main.txt", "nothing to replace\n")
+        with self.assertRaises(exceptions.MutationFileDoesNotContainReplacementStringException):
+            asyncio.run(self.make_nasti(self.output_dir).run_async())
+        assert not os.path.exists(self.output_dir)
+
+    def test_output_dir_that_cant_be_created_fails_in_silent_mode(self):
+        # A file is in the way of the output directory
+        with open(self.output_dir, "w") as f:
+            f.write("not a directory\n")
+        def input_dep(text):
+            raise AssertionError("silent mode prompted")
+        with self.assertRaises(exceptions.NastiOutputDirCreationException):
+            self.make_nasti(self.output_dir, input_dep=input_dep).run()
+        # What was already there isn't deleted
+        with open(self.output_dir) as f:
+            assert f.read() == "not a directory\n"
+
+    def test_output_dir_that_cant_be_created_prompts(self):
+        with open(self.output_dir, "w") as f:
+            f.write("not a directory\n")
+        other_dir = self.tmp_dir.name + "/other"
+        prompts = []
+        def input_dep(text):
+            prompts.append(text)
+            return other_dir if text.startswith("Enter an output directory") else "Great App"
+        self.make_nasti(self.output_dir, input_dep=input_dep, silent_mode=False, accept_defaults=True).run()
+        assert "Enter an output directory name: " in prompts
+        assert self.read_tree(other_dir)["main.txt"] == "great_app\n"
+
+    # Output directories are never passed through a shell
+    # It runs from an empty directory so a shell would only touch that
+    def test_output_dir_with_shell_characters(self):
+        os.mkdir(self.tmp_dir.name + "/cwd")
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.tmp_dir.name + "/cwd")
+        output_dir = self.tmp_dir.name + "/app; touch pwned"
+        self.make_nasti(output_dir, git_init=True).run()
+        assert os.path.exists(output_dir + "/.git/HEAD")
+        assert not os.path.exists("pwned")
+        failing_dir = self.tmp_dir.name + "/failed $(touch pwned)"
+        mocks.write_file(self.source_dir, "main.txt", "nothing to replace\n")
+        with self.assertRaises(exceptions.MutationFileDoesNotContainReplacementStringException):
+            self.make_nasti(failing_dir).run()
+        assert not os.path.exists(failing_dir)
+        assert not os.path.exists("pwned")
@@ -0,0 +1,145 @@
+import unittest
+from nasti.plan import MutationPlan
+from nasti.mutation import Mutation
+from nasti.nastifile import NastiFile
+import os
+import yaml
+import nasti.exceptions as exceptions
+import tempfile
+import asyncio
+from unittest import mock
+
+FIXTURE_DIR = "tests/nastifiles/plan_shared_files"
+FIXTURE_FILES = {
+    "one.txt": "example_app is example_app\n",
+    "two.txt": "example_app belongs to example_owner\n",
+}
+SILENT_OPTS = {
+    "app_name": "my_app",
+    "app_prefix": "our_",
+    "app_owner": "me",
+}
+
+class TestMutationPlan(unittest.TestCase):
+    def setUp(self):
+        for file, text in FIXTURE_FILES.items():
+            with open(f"{FIXTURE_DIR}/{file}", "w") as f:
+                f.write(text)
+
+    def tearDown(self):
+        for file in FIXTURE_FILES:
+            os.remove(f"{FIXTURE_DIR}/{file}")
+
+    def read_fixture_files(self):
+        contents = {}
+        for file in FIXTURE_FILES:
+            with open(f"{FIXTURE_DIR}/{file}", "r") as f:
+                contents[file] = f.read()
+        return contents
+
+    def load_mutations(self):
+        with open(f"{FIXTURE_DIR}/nasti.yaml", "r") as f:
+            config = yaml.safe_load(f)
+        return [Mutation(mutation_config, FIXTURE_DIR, silent_mode=True, silent_opts=SILENT_OPTS) for mutation_config in config["mutations"]]
+
+    def test_groups_replacements_by_file(self):
+        plan = MutationPlan(FIXTURE_DIR)
+        for mutation in self.load_mutations():
+            plan.add(mutation, mutation.resolve())
+        assert plan.get_files() == ["one.txt", "two.txt"]
+        assert plan.get_replacements("one.txt") == [("example_app", "my_app"), ("my_", "our_")]
+        assert plan.get_replacements("two.txt") == [("example_app", "my_app"), ("example_owner", "me")]
+
+    def test_reads_and_writes_each_file_once(self):
+        opened = []
+        def counting_open(path, mode):
+            opened.append((path, mode))
+            return open(path, mode)
+        plan = MutationPlan(FIXTURE_DIR, os, counting_open)
+        for mutation in self.load_mutations():
+            plan.add(mutation, mutation.resolve())
+        plan.apply()
+        assert len(opened) == 4
+        assert opened.count((f"{FIXTURE_DIR}/one.txt", "r")) == 1
+        assert opened.count((f"{FIXTURE_DIR}/one.txt", "w")) == 1
+
+    def test_matches_running_mutations_one_at_a_time(self):
+        for mutation in self.load_mutations():
+            mutation.run()
+        expected = self.read_fixture_files()
+        self.setUp()
+        nasti_file = NastiFile({
+            "path": FIXTURE_DIR,
+            "os_dep": os,
+            "open_dep": open,
+            "silent_mode": True,
+            "silent_opts": SILENT_OPTS,
+        })
+        nasti_file.load()
+        nasti_file.run_mutations()
+        assert self.read_fixture_files() == expected
+        # The second mutation sees the output of the first
+        assert expected["one.txt"] == "our_app is our_app\n"
+
+    def test_writes_to_output_path(self):
+        os.chmod(f"{FIXTURE_DIR}/one.txt", 0o755)
+        with tempfile.TemporaryDirectory() as output_dir:
+            nasti_file = NastiFile({
+                "path": FIXTURE_DIR,
+                "output_path": output_dir,
+                "os_dep": os,
+                "open_dep": open,
+                "silent_mode": True,
+                "silent_opts": SILENT_OPTS,
+            })
+            nasti_file.load()
+            assert nasti_file.is_lazy()
+            nasti_file.run_mutations()
+            # The template is left alone
+            assert self.read_fixture_files() == FIXTURE_FILES
+            with open(f"{output_dir}/one.txt", "r") as f:
+                assert f.read() == "our_app is our_app\n"
+            with open(f"{output_dir}/two.txt", "r") as f:
+                assert f.read() == "my_app belongs to me\n"
+            assert os.stat(f"{output_dir}/one.txt").st_mode & 0o777 == 0o755
+
+    def test_apply_async_matches_apply(self):
+        plan = MutationPlan(FIXTURE_DIR)
+        for mutation in self.load_mutations():
+            plan.add(mutation, mutation.resolve())
+        plan.apply()
+        expected = self.read_fixture_files()
+        self.setUp()
+        asyncio.run(plan.apply_async())
+        assert self.read_fixture_files() == expected
+
+    def test_streams_big_files(self):
+        plan = MutationPlan(FIXTURE_DIR)
+        for mutation in self.load_mutations():
+            plan.add(mutation, mutation.resolve())
+        plan.apply()
+        expected = self.read_fixture_files()
+        self.setUp()
+        os.chmod(f"{FIXTURE_DIR}/one.txt", 0o755)
+        # Every file is big enough to stream and tokens straddle the chunks
+        with mock.patch.object(MutationPlan, "STREAM_SIZE", 1), mock.patch.object(MutationPlan, "CHUNK_SIZE", 4):
+            plan.apply()
+            assert self.read_fixture_files() == expected
+            assert os.stat(f"{FIXTURE_DIR}/one.txt").st_mode & 0o777 == 0o755
+            assert not os.path.exists(f"{FIXTURE_DIR}/one.txt.nasti-tmp")
+            with tempfile.TemporaryDirectory() as output_dir:
+                self.setUp()
+                plan.output_path = output_dir
+                plan.apply()
+                assert self.read_fixture_files() == FIXTURE_FILES
+                with open(f"{output_dir}/one.txt", "r") as f:
+                    assert f.read() == expected["one.txt"]
+                assert os.stat(f"{output_dir}/one.txt").st_mode & 0o777 == 0o755
+
+    def test_validate_stream(self):
+        plan = MutationPlan(FIXTURE_DIR)
+        for mutation in self.load_mutations():
+            plan.add(mutation, mutation.resolve())
+        assert "".join(plan.validate_stream("two.txt", ["example_a", "pp belongs to exam", "ple_owner"])) == FIXTURE_FILES["two.txt"].strip()
+        with self.assertRaises(exceptions.MutationFileDoesNotContainReplacementStringException):
+            list(plan.validate_stream("two.txt", ["example_app belongs to ", "nobody"]))
@@ -0,0 +1,121 @@
+import unittest
+import json
+import asyncio
+import tempfile
+from nasti.profiler import Profiler, NullProfiler, null_profiler, read_io
+from nasti.nasti import Nasti
+import tests.mocks as mocks
+
+class TestProfiler(unittest.TestCase):
+    def test_phase_records_span(self):
+        profiler = Profiler()
+        with profiler.phase("outer", path="a") as span:
+            span.add_files(2)
+            span.add_files(1)
+            with profiler.phase("inner", "file"):
+                pass
+        spans = profiler.to_dict()["spans"]
+        assert [span["name"] for span in spans] == ["outer", "inner"]
+        outer, inner = spans
+        assert outer["category"] == "phase"
+        assert outer["files"] == 3
+        assert outer["path"] == "a"
+        assert inner["category"] == "file"
+        assert inner["files"] is None
+        assert outer["start"] <= inner["start"]
+        assert outer["duration"] >= inner["duration"]
+        assert outer["peak_rss"] > 0
+
+    def test_bytes_read_and_written(self):
+        if read_io() is None:
+            self.skipTest("/proc/self/io isn't available")
+        profiler = Profiler()
+        with tempfile.TemporaryFile() as f, profiler.phase("io"):
+            f.write(b"x" * 100000)
+            f.flush()
+            f.seek(0)
+            f.read()
+        span = profiler.to_dict()["spans"][0]
+        assert span["bytes_written"] >= 100000
+        assert span["bytes_read"] >= 100000
+
+    def test_hooks_see_each_span(self):
+        names = []
+        profiler = Profiler([lambda span: names.append(span.name)])
+        profiler.add_hook(lambda span: names.append(span.category))
+        with profiler.phase("one"):
+            pass
+        assert names == ["one", "phase"]
+
+    def test_trace_events(self):
+        profiler = Profiler()
+        with profiler.phase("copy") as span:
+            span.add_files(4)
+        trace = profiler.to_trace()
+        event = trace["traceEvents"][0]
+        assert event["ph"] == "X"
+        assert event["name"] == "copy"
+        assert event["cat"] == "phase"
+        assert event["dur"] >= 0
+        assert event["args"]["files"] == 4
+
+    def test_save(self):
+        profiler = Profiler()
+        with profiler.phase("one"):
+            pass
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            profiler.save(tmp_dir + "/profile.json")
+            profiler.save(tmp_dir + "/trace.json", Profiler.TRACE_FORMAT)
+            with open(tmp_dir + "/profile.json") as f:
+                assert json.load(f)["spans"][0]["name"] == "one"
+            with open(tmp_dir + "/trace.json") as f:
+                assert json.load(f)["traceEvents"][0]["name"] == "one"
+
+    def test_null_profiler_shares_one_span(self):
+        profiler = NullProfiler()
+        assert not profiler.enabled
+        with profiler.phase("one") as span:
+            span.add_files(1)
+        assert profiler.phase("two", "file", path="a") is span
+
+class TestNastiProfiling(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.source_dir = self.tmp_dir.name + "/template"
+        mocks.copy_template("great_app", self.source_dir)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def make_nasti(self, output_dir, profiler, lazy=False):
+        return Nasti(mocks.nasti_opts(self.source_dir, output_dir, {"app_name": "billing", "owner": "finance"}, lazy=lazy, profiler=profiler))
+
+    def assert_profiled(self, profiler):
+        spans = profiler.to_dict()["spans"]
+        phases = {span["name"]: span for span in spans if span["category"] == "phase"}
+        for phase in ["create_output_dir", "copy_source_files", "load_nastifile", "validate_mutations", "run_globals", "plan_mutations", "apply_mutations", "write_lockfile", "clean_up", "git_init"]:
+            assert phase in phases, phase
+        assert phases["apply_mutations"]["files"] == 2
+        mutations = {span["name"]: span for span in spans if span["category"] == "mutation"}
+        assert mutations["app_name"]["files"] == 2
+        assert mutations["owner"]["files"] == 1
+        files = {span["name"]: span for span in spans if span["category"] == "file"}
+        assert files["README.md"]["mutations"] == ["app_name", "owner"]
+        assert files["main.py"]["mutations"] == ["app_name"]
+
+    def test_run_is_profiled(self):
+        for lazy in [False, True]:
+            profiler = Profiler()
+            self.make_nasti(f"{self.tmp_dir.name}/output_{lazy}", profiler, lazy).run()
+            self.assert_profiled(profiler)
+
+    def test_run_async_is_profiled(self):
+        profiler = Profiler()
+        asyncio.run(self.make_nasti(self.tmp_dir.name + "/output", profiler).run_async())
+        self.assert_profiled(profiler)
+
+    def test_run_with_null_profiler(self):
+        nasti = self.make_nasti(self.tmp_dir.name + "/output", null_profiler)
+        nasti.run()
+        with open(self.tmp_dir.name + "/output/README.md") as f:
+            assert f.read() == "# billing by finance\n"
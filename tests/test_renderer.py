@@ -0,0 +1,49 @@
+import unittest
+from unittest import mock
+from jinja2.exceptions import TemplateSyntaxError
+from nasti.renderer import TemplateRenderer
+
+class TestTemplateRenderer(unittest.TestCase):
+    def test_render(self):
+        renderer = TemplateRenderer()
+        assert renderer.render("{{ app_name | lower }}", {"app_name": "Test App"}) == "test app"
+        assert renderer.render("plain") == "plain"
+
+    def test_compile_once(self):
+        renderer = TemplateRenderer()
+        with mock.patch.object(renderer.get_environment(), "from_string", wraps=renderer.get_environment().from_string) as from_string:
+            renderer.render("{{ app_name }}", {"app_name": "one"})
+            renderer.render("{{ app_name }}", {"app_name": "two"})
+            renderer.compile("{{ app_name }}")
+        assert from_string.call_count == 1
+
+    def test_render_memoized_against_snapshot(self):
+        renderer = TemplateRenderer()
+        variables = {"app_name": "one"}
+        template = renderer.compile("{{ app_name }}")
+        with mock.patch.object(template, "render", wraps=template.render) as render:
+            assert renderer.render("{{ app_name }}", variables) == "one"
+            assert renderer.render("{{ app_name }}", variables) == "one"
+            assert render.call_count == 1
+            # Globals are filled in as they run so a changed dict renders again
+            variables["app_name"] = "two"
+            assert renderer.render("{{ app_name }}", variables) == "two"
+            assert render.call_count == 2
+
+    def test_rendered_values_are_bounded(self):
+        renderer = TemplateRenderer(max_rendered=2)
+        renderer.render("{{ app_name }}", {"app_name": "one"})
+        renderer.render("{{ app_name }}", {"app_name": "two"})
+        # Using one makes it the most recently used
+        renderer.render("{{ app_name }}", {"app_name": "one"})
+        renderer.render("{{ app_name }}", {"app_name": "three"})
+        assert [dict(variables)["app_name"] for _, variables in renderer.rendered] == ["one", "three"]
+
+    def test_unhashable_variables(self):
+        renderer = TemplateRenderer()
+        assert renderer.render("{{ names | join(',') }}", {"names": ["a", "b"]}) == "a,b"
+        assert renderer.rendered == {}
+
+    def test_invalid_template(self):
+        with self.assertRaises(TemplateSyntaxError):
+            TemplateRenderer().compile("{{ app_name ")
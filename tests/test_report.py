@@ -0,0 +1,59 @@
+import unittest
+import os
+import tempfile
+from nasti.nasti import Nasti
+import nasti.exceptions as exceptions
+import tests.mocks as mocks
+
+ANSWERS = {"app_name": "my_longer_app", "owner": "me"}
+
+class TestPlanReport(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.source_dir = self.tmp_dir.name + "/template"
+        self.output_dir = self.tmp_dir.name + "/output"
+        mocks.copy_template("report", self.source_dir)
+        # git won't keep a .git directory in tests/nastifiles
+        mocks.write_file(self.source_dir, ".git/HEAD", "ref: refs/heads/master\n")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def make_nasti(self, source=None):
+        return Nasti(mocks.nasti_opts(source or self.source_dir, self.output_dir, ANSWERS))
+
+    def test_plan(self):
+        report = self.make_nasti().plan().to_dict()
+        # Nothing is written
+        assert not os.path.exists(self.output_dir)
+        assert report["mutations"] == [
+            {"name": "app_name", "replace": "example_app", "value": "my_longer_app", "files": {"main.txt": 3, "nested/config.txt": 1}},
+            {"name": "owner", "replace": "example_owner", "value": "me", "files": {"nested/config.txt": 1}},
+        ]
+        assert report["files"]["main.txt"] == {"occurrences": 3, "bytes_read": 36, "bytes_written": 42}
+        assert report["files"]["nested/config.txt"]["occurrences"] == 2
+        assert report["copied_files"] == 1
+        assert report["copied_bytes"] == len("leave me be\n")
+
+    def test_plan_matches_run(self):
+        report = self.make_nasti().plan().to_dict()
+        self.make_nasti().run()
+        for file, result in report["files"].items():
+            assert os.path.getsize(self.output_dir + "/" + file) == result["bytes_written"]
+        written = 0
+        for dir_path, _, files in os.walk(self.output_dir):
+            written += sum(os.path.getsize(dir_path + "/" + file) for file in files)
+        assert report["bytes_written"] == written
+
+    def test_plan_archive(self):
+        assert self.make_nasti(mocks.make_archive(self.source_dir, self.tmp_dir.name + "/template.tar.gz")).plan().to_dict() == self.make_nasti().plan().to_dict() | {"source": self.tmp_dir.name + "/template.tar.gz"}
+
+    def test_plan_missing_replace(self):
+        mocks.write_file(self.source_dir, "main.txt", "nothing to replace\n")
+        with self.assertRaises(exceptions.MutationFileDoesNotContainReplacementStringException):
+            self.make_nasti().plan()
+
+    def test_plan_missing_file(self):
+        os.remove(self.source_dir + "/nested/config.txt")
+        with self.assertRaises(exceptions.MutationFileDoesNotExistException):
+            self.make_nasti().plan()
@@ -0,0 +1,160 @@
+import unittest
+from nasti.scanner import TemplateScanner
+from nasti.matcher import TokenMatcher
+from nasti.nastifile import NastiFile
+from nasti.classifier import FileClassifier
+import os
+import tempfile
+from unittest import mock
+
+FIXTURE_DIR = "tests/nastifiles/find_multiple_mutations"
+
+class TestTemplateScanner(unittest.TestCase):
+    def test_list_files(self):
+        scanner = TemplateScanner(FIXTURE_DIR)
+        assert scanner.list_files() == [
+            "src/main.txt",
+            "src/nested/both.txt",
+            "src/nested/owner.txt",
+            "src/plain.txt",
+        ]
+
+    def test_scan(self):
+        scanner = TemplateScanner(FIXTURE_DIR)
+        file_tokens = scanner.scan(TokenMatcher(["example_app", "example_owner"]))
+        assert file_tokens == {
+            "src/main.txt": set(["example_app", "example_owner"]),
+            "src/nested/both.txt": set(["example_app", "example_owner"]),
+            "src/nested/owner.txt": set(["example_owner"]),
+        }
+
+    def test_find_reads_each_file_once(self):
+        opened = []
+        def counting_open(path, mode, errors=None):
+            opened.append(path)
+            return open(path, mode, errors=errors)
+        nasti_file = NastiFile({
+            "path": FIXTURE_DIR,
+            "os_dep": os,
+            "open_dep": counting_open,
+        })
+        unmentioned_files = nasti_file.find_unmentioned_files()
+        scanned = [path for path in opened if not path.endswith("nasti.yaml")]
+        assert len(scanned) == 4
+        assert len(set(scanned)) == 4
+        results = unmentioned_files.get_results()
+        assert [result.get_mutation().name for result in results] == ["app_name", "app_owner"]
+        assert results[0].get_files() == ["src/nested/both.txt"]
+        assert results[1].get_files() == ["src/main.txt", "src/nested/both.txt"]
+
+    def test_scan_with_threads_matches_serial(self):
+        matcher = TokenMatcher(["example_app", "example_owner"])
+        serial = TemplateScanner(FIXTURE_DIR).scan(matcher)
+        threaded = TemplateScanner(FIXTURE_DIR, jobs=4).scan(matcher)
+        assert list(threaded.items()) == list(serial.items())
+
+    def test_scan_with_processes_matches_serial(self):
+        matcher = TokenMatcher(["example_app", "example_owner"])
+        serial = TemplateScanner(FIXTURE_DIR).scan(matcher)
+        processes = TemplateScanner(FIXTURE_DIR, jobs=2, use_processes=True).scan(matcher)
+        assert list(processes.items()) == list(serial.items())
+
+    def test_scan_uses_os_dep(self):
+        os_dep = mock.Mock(wraps=os)
+        os_dep.path = os.path
+        TemplateScanner(FIXTURE_DIR, os_dep, jobs=4).scan(TokenMatcher(["example_app"]))
+        assert os_dep.fstat.call_count == 4
+
+    def test_scan_files_raises_first_error(self):
+        scanner = TemplateScanner(FIXTURE_DIR, jobs=4)
+        matcher = TokenMatcher(["example_app"])
+        with self.assertRaises(FileNotFoundError) as context:
+            scanner.scan_files(matcher, ["src/main.txt", "missing_one.txt", "missing_two.txt"])
+        assert "missing_one.txt" in str(context.exception)
+
+    def test_scan_files_ignore_errors(self):
+        scanner = TemplateScanner(FIXTURE_DIR, jobs=4)
+        matcher = TokenMatcher(["example_app"])
+        file_tokens = scanner.scan_files(matcher, ["src/main.txt", "missing.txt", "src/plain.txt"], ignore_errors=True)
+        assert file_tokens == {"src/main.txt": set(["example_app"]), "src/plain.txt": set()}
+
+    def test_validate_with_jobs(self):
+        nasti_file = NastiFile({
+            "path": FIXTURE_DIR,
+            "os_dep": os,
+            "open_dep": open,
+            "jobs": 4,
+        })
+        nasti_file.validate_mutations()
+
+    def test_scan_memory_mapped_files_matches_read(self):
+        matcher = TokenMatcher(["example_app", "example_owner"])
+        read = TemplateScanner(FIXTURE_DIR).scan(matcher)
+        with mock.patch.object(TemplateScanner, "MMAP_SIZE", 0):
+            mapped = TemplateScanner(FIXTURE_DIR).scan(matcher)
+        assert list(mapped.items()) == list(read.items())
+
+    # Mutations can't rewrite a file that doesn't decode, so validate
+    # reports it like reading it as text does, while find still searches it
+    def test_validate_file_that_isnt_utf8(self):
+        with tempfile.TemporaryDirectory() as template_dir:
+            with open(template_dir + "/nasti.yaml", "w") as f:
+                f.write('mutations:\n  - name: "app_name"\n    prompt: "App Name"\n    replace: "example_app"\n    files:\n      - "latin1.txt"\n')
+            with open(template_dir + "/latin1.txt", "wb") as f:
+                f.write("café example_app\n".encode("latin-1"))
+            # Old enough for the index to record it
+            os.utime(template_dir + "/latin1.txt", (0, 0))
+            for mmap_size in [TemplateScanner.MMAP_SIZE, 0]:
+                nasti_file = NastiFile({
+                    "path": template_dir,
+                    "os_dep": os,
+                    "open_dep": open,
+                    "use_index": True,
+                })
+                with mock.patch.object(TemplateScanner, "MMAP_SIZE", mmap_size):
+                    nasti_file.load()
+                    # Indexes the file without decoding it
+                    assert nasti_file.get_scanner().scan(TokenMatcher(["example_app"])) == {"latin1.txt": {"example_app"}}
+                    with self.assertRaises(UnicodeDecodeError):
+                        nasti_file.validate_mutations()
+
+    def test_scan_skips_binary_files(self):
+        with tempfile.TemporaryDirectory() as template_dir:
+            files = {
+                "main.txt": b"example_app\n",
+                "logo.png": b"example_app",
+                "blob.bin": b"\0example_app",
+                "fake.pdf.txt": b"%PDF-1.7 example_app",
+                "app.min.js": b"example_app",
+            }
+            for file, data in files.items():
+                with open(template_dir + "/" + file, "wb") as f:
+                    f.write(data)
+            opened = []
+            def counting_open(path, mode, errors=None):
+                opened.append(os.path.basename(path))
+                return open(path, mode)
+            classifier = FileClassifier([".min.js"])
+            matcher = TokenMatcher(["example_app"])
+            assert TemplateScanner(template_dir, os, counting_open, classifier=classifier).scan(matcher) == {"main.txt": {"example_app"}}
+            # Files are judged by extension without being opened
+            assert sorted(opened) == ["blob.bin", "fake.pdf.txt", "main.txt"]
+            # and only sniffed once per run
+            opened.clear()
+            TemplateScanner(template_dir, os, counting_open, classifier=classifier).scan(matcher)
+            assert opened == ["main.txt"]
+
+    def test_find_uses_nastifile_binary_extensions(self):
+        with tempfile.TemporaryDirectory() as template_dir:
+            with open(template_dir + "/nasti.yaml", "w") as f:
+                f.write('binary_extensions: [".min.js"]\nmutations:\n  - name: "app_name"\n    prompt: "App Name"\n    replace: "example_app"\n    files:\n      - "main.txt"\n')
+            for file in ["main.txt", "other.txt", "app.min.js"]:
+                with open(template_dir + "/" + file, "w") as f:
+                    f.write("example_app\n")
+            nasti_file = NastiFile({
+                "path": template_dir,
+                "os_dep": os,
+                "open_dep": open,
+            })
+            results = nasti_file.find_unmentioned_files().get_results()
+            assert results[0].get_files() == ["other.txt"]
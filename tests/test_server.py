@@ -0,0 +1,179 @@
+import unittest
+import os
+import json
+import socket
+import shutil
+import tempfile
+import threading
+import http.client
+from nasti.server import NastiServer
+import tests.mocks as mocks
+
+class TestNastiServer(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.source_dir = self.tmp_dir.name + "/template"
+        mocks.copy_template("server", self.source_dir)
+        self.server = NastiServer({
+            "os_dep": os,
+            "open_dep": open,
+            "help_text": "",
+        })
+        # Cleanups run last in first out so servers stop before this
+        self.addCleanup(self.server.close)
+
+    def make_job(self, name, source=None):
+        return {
+            "source": source or self.source_dir,
+            "output_dir": self.tmp_dir.name + "/" + name,
+            "answers": {"app_name": name},
+            "git": False,
+        }
+
+    def run_job(self, job):
+        events = []
+        ok = self.server.run_job(job, events.append)
+        return ok, events
+
+    def test_run_job(self):
+        ok, events = self.run_job(self.make_job("first_app"))
+        assert ok
+        assert [event["event"] for event in events] == ["resolving", "resolved", "generating", "done"]
+        assert events[-1]["ok"]
+        assert mocks.read_file(self.tmp_dir.name + "/first_app/main.txt") == "first_app\n"
+        assert mocks.read_file(self.tmp_dir.name + "/first_app/untouched.txt") == "leave me be\n"
+
+    def test_archive_stays_warm(self):
+        archive = mocks.make_archive(self.source_dir, self.tmp_dir.name + "/template.tar.gz")
+        _, events = self.run_job(self.make_job("first_app", archive))
+        assert not events[1]["warm"]
+        ok, events = self.run_job(self.make_job("second_app", archive))
+        assert ok
+        assert events[1]["warm"]
+        assert mocks.read_file(self.tmp_dir.name + "/second_app/main.txt") == "second_app\n"
+        ok, events = self.run_job(dict(self.make_job("third_app", archive), refresh=True))
+        assert ok
+        assert not events[1]["warm"]
+
+    def test_refreshed_source_is_removed(self):
+        archive = mocks.make_archive(self.source_dir, self.tmp_dir.name + "/template.tar.gz")
+        self.run_job(self.make_job("first_app", archive))
+        first_dir = self.server.sources[archive].handler.source_dir
+        self.run_job(dict(self.make_job("second_app", archive), refresh=True))
+        assert not os.path.exists(first_dir)
+        assert self.server.retired_sources == []
+
+    def test_refreshed_source_is_kept_until_its_jobs_end(self):
+        archive = mocks.make_archive(self.source_dir, self.tmp_dir.name + "/template.tar.gz")
+        self.run_job(self.make_job("first_app", archive))
+        first_dir = self.server.sources[archive].handler.source_dir
+        def emit(event):
+            if event["event"] == "generating":
+                self.run_job(dict(self.make_job("refreshed_app", archive), refresh=True))
+                assert os.path.exists(first_dir)
+        assert self.server.run_job(self.make_job("second_app", archive), emit)
+        assert mocks.read_file(self.tmp_dir.name + "/second_app/main.txt") == "second_app\n"
+        assert not os.path.exists(first_dir)
+        assert self.server.retired_sources == []
+
+    def test_least_recently_used_source_is_removed(self):
+        self.server.max_sources = 1
+        archive = mocks.make_archive(self.source_dir, self.tmp_dir.name + "/template.tar.gz")
+        other_archive = self.tmp_dir.name + "/other.tar.gz"
+        shutil.copy(archive, other_archive)
+        self.run_job(self.make_job("first_app", archive))
+        first_dir = self.server.sources[archive].handler.source_dir
+        self.run_job(self.make_job("second_app", other_archive))
+        assert list(self.server.sources) == [other_archive]
+        assert list(self.server.source_locks) == [other_archive]
+        assert not os.path.exists(first_dir)
+
+    def test_local_directory_is_never_warm(self):
+        self.run_job(self.make_job("first_app"))
+        _, events = self.run_job(self.make_job("second_app"))
+        assert not events[1]["warm"]
+        assert self.server.source_locks == {}
+
+    def test_invalid_jobs(self):
+        invalid_jobs = [
+            [],
+            {"output_dir": self.tmp_dir.name + "/app"},
+            {"source": self.source_dir, "output_dir": "relative/app"},
+            {"source": "template", "output_dir": self.tmp_dir.name + "/app"},
+            {"source": "file://template.tar.gz", "output_dir": self.tmp_dir.name + "/app"},
+            {"source": self.source_dir, "output_dir": self.source_dir},
+            {"source": self.source_dir, "output_dir": self.tmp_dir.name + "/app", "answers": {"app_name": 1}},
+        ]
+        for job in invalid_jobs:
+            ok, events = self.run_job(job)
+            assert not ok
+            assert events[0]["type"] == "NastiServerInvalidJobException"
+            assert events[-1] == {"event": "done", "ok": False, "elapsed_ms": events[-1]["elapsed_ms"]}
+
+    def test_failed_job(self):
+        job = self.make_job("app")
+        del job["answers"]
+        ok, events = self.run_job(job)
+        assert not ok
+        assert events[-2]["type"] == "MutationSilentModeException"
+        assert not os.path.exists(job["output_dir"])
+
+    def start(self):
+        thread = threading.Thread(target=self.server.serve, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.shutdown)
+
+    def test_serve_unix(self):
+        socket_path = self.tmp_dir.name + "/nasti.sock"
+        self.server.listen_unix(socket_path)
+        self.start()
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(socket_path)
+            client.sendall((json.dumps(self.make_job("socket_app")) + "\n").encode("utf-8"))
+            with client.makefile("r") as f:
+                events = [json.loads(line) for line in f]
+        assert events[-1]["ok"]
+        assert os.stat(socket_path).st_mode & 0o777 == 0o600
+        assert mocks.read_file(self.tmp_dir.name + "/socket_app/main.txt") == "socket_app\n"
+
+    def post_job(self, job, headers=None):
+        if headers is None:
+            headers = {"Authorization": f"Bearer {self.server.token}", "Content-Type": "application/json"}
+        connection = http.client.HTTPConnection(*self.server.server_address, timeout=10)
+        connection.request("POST", "/jobs", json.dumps(job), headers)
+        response = connection.getresponse()
+        body = response.read().decode("utf-8")
+        connection.close()
+        return response.status, body
+
+    def test_serve_http(self):
+        token_path = self.tmp_dir.name + "/nasti.token"
+        self.server.listen_http(0, token_path)
+        self.start()
+        with open(token_path) as f:
+            assert f.read().strip() == self.server.token
+        assert os.stat(token_path).st_mode & 0o777 == 0o600
+        status, body = self.post_job(self.make_job("http_app"))
+        events = [json.loads(line) for line in body.splitlines()]
+        assert status == 200
+        assert events[-1]["ok"]
+        assert mocks.read_file(self.tmp_dir.name + "/http_app/main.txt") == "http_app\n"
+
+    def test_http_refuses_unauthorized_requests(self):
+        self.server.listen_http(0)
+        self.start()
+        token = f"Bearer {self.server.token}"
+        refused = [
+            ({}, 401),
+            ({"Authorization": "Bearer wrong", "Content-Type": "application/json"}, 401),
+            # What a web page can send without asking first
+            ({"Content-Type": "text/plain", "Origin": "https://evil.example"}, 403),
+            ({"Authorization": token, "Content-Type": "application/json", "Origin": "https://evil.example"}, 403),
+            ({"Authorization": token, "Content-Type": "text/plain"}, 415),
+        ]
+        for headers, expected_status in refused:
+            status, _ = self.post_job(self.make_job("refused_app"), headers)
+            assert status == expected_status, headers
+        assert not os.path.exists(self.tmp_dir.name + "/refused_app")
@@ -53,6 +53,27 @@ class TestGitHandler(unittest.TestCase):
         with self.assertRaises(exceptions.GitHandlerCloneException):
             handler.clone_repo()
 
+    def test_parse_source(self):
+        handler = GitHandler("git@test.com:test/test.git", mocks.MockOs())
+        assert (handler.url, handler.ref, handler.subdir) == ("git@test.com:test/test.git", None, None)
+
+    def test_parse_source_with_ref_and_subdir(self):
+        handler = GitHandler("git@test.com:test/test.git#v2:templates/api/", mocks.MockOs())
+        assert (handler.url, handler.ref, handler.subdir) == ("git@test.com:test/test.git", "v2", "templates/api")
+
+    def test_parse_source_with_subdir_only(self):
+        handler = GitHandler("git@test.com:test/test.git#:templates/api", mocks.MockOs())
+        assert (handler.url, handler.ref, handler.subdir) == ("git@test.com:test/test.git", None, "templates/api")
+
+    def test_parse_source_with_invalid_subdir(self):
+        with self.assertRaises(exceptions.GitHandlerInvalidSourceException):
+            GitHandler("git@test.com:test/test.git#main:../../etc", mocks.MockOs())
+
+    def test_run_subdir_missing(self):
+        handler = GitHandler("git@test.com:test/test.git#main:missing", mocks.MockOs({"isdir": False}))
+        with self.assertRaises(exceptions.GitHandlerSubdirNotFoundException):
+            handler.run()
+
 class TestLocalDirectoryHandler(unittest.TestCase):
     def test_run(self):
         handler = LocalDirectoryHandler("tests/mocks/test_dir", mocks.MockOs())
@@ -0,0 +1,115 @@
+import unittest
+import os
+import json
+import hashlib
+import tempfile
+from nasti.nasti import Nasti
+from nasti.update import NastiUpdate
+from nasti.lockfile import Lockfile
+import nasti.exceptions as exceptions
+import tests.mocks as mocks
+
+class TestNastiUpdate(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.source_dir = self.tmp_dir.name + "/template"
+        self.output_dir = self.tmp_dir.name + "/output"
+        mocks.copy_template("app_slug", self.source_dir)
+        mocks.write_file(self.source_dir, "old.txt", "going away\n")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_files(self, root, files):
+        for file, text in files.items():
+            mocks.write_file(root, file, text)
+
+    def generate(self, source=None):
+        Nasti(mocks.nasti_opts(source or self.source_dir, self.output_dir, {"app_name": "Great App"}, lock=True)).run()
+
+    def update(self, opts={}):
+        return NastiUpdate({
+            "os_dep": os,
+            "open_dep": open,
+            "print_dep": lambda *args: None,
+            "help_text": "",
+            "project_dir": self.output_dir,
+        } | opts).run()
+
+    def test_lockfile(self):
+        self.generate()
+        lockfile = Lockfile.load(self.output_dir)
+        assert lockfile.source == self.source_dir
+        assert lockfile.revision is None
+        assert lockfile.answers == {"app_name": "Great App", "app_slug": "great_app"}
+        assert sorted(lockfile.files) == ["main.txt", "nested/slug.txt", "old.txt", "untouched.txt"]
+        assert lockfile.files["main.txt"]["output"] == hashlib.sha256(b"great_app\n").hexdigest()
+        assert lockfile.files["untouched.txt"]["output"] == hashlib.sha256(b"leave me be\n").hexdigest()
+
+    def test_no_lockfile(self):
+        os.makedirs(self.output_dir)
+        with self.assertRaises(exceptions.LockfileNotFoundException):
+            self.update()
+
+    def test_update_nothing_changed(self):
+        self.generate()
+        before = os.stat(self.output_dir + "/main.txt").st_mtime_ns
+        result = self.update()
+        assert not result.is_changed() and result.conflicts == []
+        assert os.stat(self.output_dir + "/main.txt").st_mtime_ns == before
+
+    def test_update_changed_files(self):
+        self.generate()
+        os.remove(self.source_dir + "/old.txt")
+        self.write_files(self.source_dir, {
+            "main.txt": "example_slug v2\n",
+            "untouched.txt": "leave me be, please\n",
+            "new.txt": "hello\n",
+        })
+        result = self.update()
+        assert sorted(result.updated) == ["main.txt", "untouched.txt"]
+        assert result.added == ["new.txt"]
+        assert result.removed == ["old.txt"]
+        assert mocks.read_file(self.output_dir + "/main.txt") == "great_app v2\n"
+        assert mocks.read_file(self.output_dir + "/nested/slug.txt") == "slug=great_app\n"
+        assert not os.path.exists(self.output_dir + "/old.txt")
+        # A second update has nothing left to do
+        assert not self.update().is_changed()
+
+    def test_update_changed_answers(self):
+        self.generate()
+        result = self.update({"answers": {"app_slug": "renamed"}})
+        assert sorted(result.updated) == ["main.txt", "nested/slug.txt"]
+        assert mocks.read_file(self.output_dir + "/nested/slug.txt") == "slug=renamed\n"
+        assert Lockfile.load(self.output_dir).answers["app_slug"] == "renamed"
+
+    def test_update_conflicts(self):
+        self.generate()
+        self.write_files(self.output_dir, {"untouched.txt": "my edit\n", "old.txt": "kept\n"})
+        os.remove(self.source_dir + "/old.txt")
+        self.write_files(self.source_dir, {"untouched.txt": "template edit\n"})
+        result = self.update()
+        assert sorted(result.conflicts) == ["old.txt", "untouched.txt"]
+        assert mocks.read_file(self.output_dir + "/untouched.txt") == "my edit\n"
+        assert mocks.read_file(self.output_dir + "/old.txt") == "kept\n"
+        # The conflict is reported again until it's resolved
+        assert self.update().conflicts == ["untouched.txt"]
+        result = self.update({"force": True})
+        assert result.updated == ["untouched.txt"]
+        assert mocks.read_file(self.output_dir + "/untouched.txt") == "template edit\n"
+
+    def test_update_missing_replace(self):
+        self.generate()
+        self.write_files(self.source_dir, {"main.txt": "nothing to replace\n"})
+        with self.assertRaises(exceptions.MutationFileDoesNotContainReplacementStringException):
+            self.update()
+
+    def test_update_archive(self):
+        self.generate(mocks.make_archive(self.source_dir, self.tmp_dir.name + "/template.tar.gz"))
+        lockfile = Lockfile.load(self.output_dir)
+        assert lockfile.revision.startswith("sha256:")
+        assert self.update().up_to_date
+        self.write_files(self.source_dir, {"main.txt": "example_slug v2\n"})
+        result = self.update({"source": mocks.make_archive(self.source_dir, self.tmp_dir.name + "/template.tar.gz")})
+        assert result.updated == ["main.txt"]
+        assert mocks.read_file(self.output_dir + "/main.txt") == "great_app v2\n"
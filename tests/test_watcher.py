@@ -0,0 +1,99 @@
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+from unittest import mock
+from nasti.watcher import PollingWatcher, InotifyWatcher, make_watcher
+import tests.mocks as mocks
+
+class WatcherTests:
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.template_dir = self.tmp_dir.name + "/template"
+        self.write("nasti.yaml", "mutations: []\n")
+        self.write("src/main.py", "great_app\n")
+        self.write(".git/HEAD", "ref: refs/heads/main\n")
+        self.watcher = self.make_watcher()
+
+    def tearDown(self):
+        self.watcher.close()
+        self.tmp_dir.cleanup()
+
+    def write(self, file, text):
+        mocks.write_file(self.template_dir, file, text)
+
+    def test_modified_file(self):
+        self.change(lambda: self.write("src/main.py", "renamed_app, longer\n"))
+        assert self.watcher.wait() == {"src/main.py"}
+
+    def test_new_and_deleted_files(self):
+        def change():
+            self.write("src/new.py", "great_app\n")
+            os.remove(self.template_dir + "/nasti.yaml")
+        self.change(change)
+        assert self.watcher.wait() == {"src/new.py", "nasti.yaml"}
+
+    def test_files_in_new_directories(self):
+        self.change(lambda: self.write("docs/nested/guide.md", "great_app\n"))
+        changed = self.watcher.wait()
+        assert "docs/nested/guide.md" in changed or "docs" in changed
+        self.change(lambda: self.write("docs/nested/guide.md", "more great_app\n"))
+        assert "docs/nested/guide.md" in self.watcher.wait()
+
+    def test_git_and_index_are_ignored(self):
+        def change():
+            self.write(".git/HEAD", "ref: refs/heads/other\n")
+            self.write(".nasti-cache/index.json", "{}")
+            self.write("src/main.py", "renamed_app, longer\n")
+        self.change(change)
+        assert self.watcher.wait() == {"src/main.py"}
+
+class TestPollingWatcher(WatcherTests, unittest.TestCase):
+    def make_watcher(self):
+        return PollingWatcher(self.template_dir, os, 0, self.sleep)
+
+    # Changes happen while the watcher sleeps
+    def change(self, func):
+        self.pending = func
+
+    def sleep(self, interval):
+        func, self.pending = self.pending, None
+        if func:
+            func()
+
+    def test_deleted_directory(self):
+        self.change(lambda: shutil.rmtree(self.template_dir + "/src"))
+        assert self.watcher.wait() == {"src/main.py"}
+
+class TestInotifyWatcher(WatcherTests, unittest.TestCase):
+    def make_watcher(self):
+        try:
+            return InotifyWatcher(self.template_dir)
+        except (OSError, AttributeError):
+            self.skipTest("inotify isn't available")
+
+    # Changes are made once the watcher is waiting
+    def change(self, func):
+        timer = threading.Timer(0.05, func)
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+    def test_deleted_directory(self):
+        self.change(lambda: shutil.rmtree(self.template_dir + "/src"))
+        assert "src" in self.watcher.wait()
+
+    def test_moved_directory_is_watched_under_its_new_name(self):
+        self.change(lambda: os.rename(self.template_dir + "/src", self.template_dir + "/lib"))
+        assert self.watcher.wait() == {"src", "lib"}
+        self.change(lambda: self.write("lib/main.py", "renamed_app\n"))
+        assert self.watcher.wait() == {"lib/main.py"}
+
+class TestMakeWatcher(unittest.TestCase):
+    def test_falls_back_to_polling(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            assert isinstance(make_watcher(tmp_dir, poll=True), PollingWatcher)
+            with mock.patch.object(InotifyWatcher, "__init__", side_effect=OSError("no inotify")):
+                watcher = make_watcher(tmp_dir, interval=0.1)
+            assert isinstance(watcher, PollingWatcher)
+            assert watcher.interval == 0.1